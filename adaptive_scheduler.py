@@ -0,0 +1,46 @@
+import time
+
+
+# Chooses the motion_monitor sampling period from how settled the motion state is. While the state is stable and the
+# average motion is far from the threshold, the period grows geometrically up to max_period. It drops straight back
+# to min_period when a transition is being debounced, the average is within `margin` noise deviations of the
+# threshold, or the newest sample is more than `surprise` noise deviations away from the window average.
+class adaptive_scheduler:
+
+    def __init__(self, min_period=0.1, max_period=1.0, growth=1.5, margin=3.0, surprise=4.0, noise_floor=1.0):
+        self.__min_period = min_period
+        self.__max_period = max_period
+        self.__growth = growth
+        self.__margin = margin
+        self.__surprise = surprise
+        self.__noise_floor = noise_floor  # Lower bound on the noise estimate, so a perfectly quiet window still works
+        self.__period = min_period
+
+        # Statistics reported by stats()
+        self.__start_time = time.time()
+        self.__samples = 0
+        self.__fast_samples = 0
+        self.__total_period = 0.0
+
+    # Returns the number of seconds to wait before the next sample
+    def update(self, sample, mean, std, threshold, pending):
+        noise = max(std, self.__noise_floor)
+        if pending or abs(mean - threshold) < self.__margin * noise or abs(sample - mean) > self.__surprise * noise:
+            self.__period = self.__min_period
+            self.__fast_samples += 1
+        else:
+            self.__period = min(self.__period * self.__growth, self.__max_period)
+
+        self.__samples += 1
+        self.__total_period += self.__period
+        return self.__period
+
+    def reset(self):
+        self.__period = self.__min_period
+
+    def stats(self):
+        return {'samples': self.__samples,
+                'fast_samples': self.__fast_samples,
+                'current_period': self.__period,
+                'mean_period': self.__total_period / self.__samples if self.__samples else self.__period,
+                'samples_per_second': self.__samples / max(time.time() - self.__start_time, 1e-9)}
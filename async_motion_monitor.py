@@ -0,0 +1,98 @@
+from motion_monitor import motion_monitor
+import asyncio
+import time
+
+
+# asyncio flavour of motion_monitor. It shares the sampling core (motion_monitor.poll()) with the threaded monitor but
+# runs it as a task on the event loop, so IMU sampling can live next to the temperature, camera and upload tasks:
+#
+#   mm = async_motion_monitor()
+#   async with mm:
+#       async for parked in mm.transitions():
+#           ...
+#
+# I2C reads and the wake-on-motion wait are blocking, so they run in the loop's default executor.
+class async_motion_monitor(motion_monitor):
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.__task = None
+        self.__active = False
+        self.__subscribers = set()  # One asyncio.Queue per transitions() iterator
+        self.__parked_event = asyncio.Event()
+        self.__moving_event = asyncio.Event()
+        self.__set_events(self.is_parked())
+
+    async def __aenter__(self):
+        await self.start_async()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.stop_async()
+
+    # Starts the sampling task on the running event loop
+    async def start_async(self):
+        if self.__task is not None:
+            raise RuntimeWarning("Motion monitor is already running!")
+
+        self.__set_events(self.is_parked())
+        self.__active = True
+        self.__task = asyncio.create_task(self.__run())
+
+    async def stop_async(self):
+        if self.__task is None:
+            raise RuntimeWarning("Motion monitor is not running!")
+
+        self.__active = False
+        await self.__task
+        self.__task = None
+        for subscriber in self.__subscribers:
+            subscriber.put_nowait(None)
+
+    # Yields the new value of is_parked() on every transition, until the monitor is stopped
+    async def transitions(self):
+        subscriber = asyncio.Queue()
+        self.__subscribers.add(subscriber)
+        try:
+            while True:
+                parked = await subscriber.get()
+                if parked is None:
+                    return
+                yield parked
+        finally:
+            self.__subscribers.discard(subscriber)
+
+    async def wait_until_parked(self):
+        await self.__parked_event.wait()
+
+    async def wait_until_moving(self):
+        await self.__moving_event.wait()
+
+    async def __run(self):
+        loop = asyncio.get_running_loop()
+        parked = self.is_parked()
+        while self.__active:
+            started = time.monotonic()
+            pause_time = await loop.run_in_executor(None, self.poll)
+
+            if self.is_parked() != parked:
+                parked = self.is_parked()
+                self.__set_events(parked)
+                for subscriber in self.__subscribers:
+                    subscriber.put_nowait(parked)
+
+            if pause_time is None:
+                await loop.run_in_executor(None, self.wait_for_motion, self.__is_active)
+            else:
+                await asyncio.sleep(max(pause_time - (time.monotonic() - started), 0))
+
+    def __is_active(self):
+        return self.__active
+
+    def __set_events(self, parked):
+        if parked:
+            self.__moving_event.clear()
+            self.__parked_event.set()
+        else:
+            self.__parked_event.clear()
+            self.__moving_event.set()
@@ -0,0 +1,105 @@
+import io
+import os
+import time
+
+
+# Camera backends for the canary. Both have the same interface: open() gets the camera ready, capture() returns one
+# photo as encoded image bytes (opening the camera first if needed), and close() releases it. open_camera() chooses
+# the backend from spec, or from the CANARY_CAMERA environment variable:
+#
+#   CANARY_CAMERA=pi                   pi_camera(), the default
+#   CANARY_CAMERA=file                 file_camera('./testimgs')
+#   CANARY_CAMERA=file:DIR             file_camera(DIR)
+#   CANARY_CAMERA=file:DIR@RATE        file_camera(DIR, rate=RATE), e.g. file:./testimgs@0.2
+#
+# With the file backend, and BERRYIMU_BUS=sim for the IMU (see lib/BerryIMU/i2c.py), the canary runs without a Pi.
+def open_camera(spec=None):
+    if spec is None:
+        spec = os.environ.get('CANARY_CAMERA', 'pi')
+
+    if spec == 'pi':
+        return pi_camera()
+    if spec == 'file' or spec.startswith('file:'):
+        directory, _, rate = spec[len('file:'):].partition('@')
+        return file_camera(directory or './testimgs', float(rate) if rate else None)
+    raise ValueError(f"Unknown camera '{spec}', expected 'pi' or 'file[:DIR[@RATE]]'")
+
+
+# Raspberry Pi camera. While open, frames come from the video port through capture_continuous(), which skips the
+# sensor mode switch and exposure settling of a still-port capture. picamera is only imported when the camera is
+# opened, so this module can be imported anywhere.
+class pi_camera:
+
+    def __init__(self, use_video_port=True):
+        self.__use_video_port = use_video_port
+        self.__camera = None
+        self.__frames = None  # capture_continuous() generator, each next() writes a new frame to __buffer
+        self.__buffer = io.BytesIO()  # Reused for every capture so its memory is allocated once
+
+    def is_open(self):
+        return self.__camera is not None
+
+    def open(self):
+        if self.__camera is None:
+            from picamera import PiCamera
+            self.__camera = PiCamera()
+            self.__frames = self.__camera.capture_continuous(self.__buffer, format='jpeg',
+                                                             use_video_port=self.__use_video_port)
+
+    def close(self):
+        if self.__camera is not None:
+            self.__frames.close()
+            self.__camera.close()
+            self.__camera = None
+            self.__frames = None
+
+    # Returns the next frame as JPEG bytes
+    def capture(self):
+        self.open()
+        self.__buffer.seek(0)
+        self.__buffer.truncate()
+        next(self.__frames)
+        return self.__buffer.getvalue()
+
+
+# Simulated camera that plays back the images in a directory (e.g. testimgs/ with its baby, dog and empty scenes) in
+# name order, looping. With rate=None every capture returns the next image; otherwise the scene changes `rate` times
+# per second of wall time since open(), like a real cabin that changes whether or not photos are taken.
+class file_camera:
+
+    def __init__(self, directory='./testimgs', rate=None):
+        self.__directory = directory
+        self.__rate = rate
+        self.__images = None
+        self.__opened = None
+        self.__captures = 0
+
+    def is_open(self):
+        return self.__images is not None
+
+    def open(self):
+        if self.__images is not None:
+            return
+        names = sorted(name for name in os.listdir(self.__directory)
+                       if os.path.splitext(name)[1].lower() in ('.jpg', '.jpeg', '.png'))
+        if not names:
+            raise RuntimeError(f"No images found in {self.__directory}")
+        self.__images = []
+        for name in names:
+            with open(os.path.join(self.__directory, name), 'rb') as f:
+                self.__images.append(f.read())
+        self.__opened = time.monotonic()
+        self.__captures = 0
+
+    def close(self):
+        self.__images = None
+
+    # Returns the current image's bytes (JPEG or PNG, both accepted by Rekognition)
+    def capture(self):
+        self.open()
+        if self.__rate is None:
+            index = self.__captures
+        else:
+            index = int((time.monotonic() - self.__opened) * self.__rate)
+        self.__captures += 1
+        return self.__images[index % len(self.__images)]
@@ -1,6 +1,12 @@
-from motion_monitor import motion_monitor
+from process_motion_monitor import process_motion_monitor
+from motion_fusion import fusion_detector
+from pipeline import stage_queue, pipeline_stage, DROP_OLDEST, BLOCK
+from camera_source import open_camera
+from scene_gate import scene_gate
+from collections import namedtuple
+import os
+import threading
 import time
-from picamera import PiCamera
 import requests
 from datetime import datetime  # For console print timestamps
 import keys
@@ -10,11 +16,8 @@ import json
 from twilio.rest import Client
 import temp_reader
 
-# Rekognition client and alert labels
-rekognition_client = boto3.client('rekognition',
-                                  aws_access_key_id=keys.aws_access_id,
-                                  aws_secret_access_key=keys.aws_secret_id,
-                                  region_name='us-east-1')
+# Rekognition client, created on first use, and alert labels
+rekognition_client = None
 
 baby_alert_labels = ['Baby', 'Person']
 pet_alert_labels = ['Dog', 'Pet']
@@ -22,15 +25,58 @@ pet_alert_labels = ['Dog', 'Pet']
 min_temp_alert = 60
 min_temp_emergency = 80
 
-mm = motion_monitor()
-camera = PiCamera()
+# Capture pipeline. Photos are taken every capture_period seconds while parked, whatever the classification and
+# upload stages are doing. Between capture and classification, the oldest photo is dropped when classification falls
+# behind, so Rekognition always sees the freshest frame. Between classification and upload, classification waits for
+# the uploader (backpressure), so a slow server or a snoozed alert does not queue up Rekognition calls. Events older
+# than max_event_age seconds by the time they reach the uploader are not sent.
+capture_period = 5
+idle_period = 0.5  # How often to check whether the car is parked while it is moving
+photo_queue_size = 2
+event_queue_size = 1
+max_event_age = 60
+
+# A reading moving through the pipeline. photo holds the JPEG bytes, which stay in memory until the event is sent;
+# labels is None until the photo has been classified.
+canary_event = namedtuple('canary_event', ['timestamp', 'temp', 'photo', 'labels'])
+
+# Photos of an unchanged scene reuse the labels of the last classified photo instead of calling Rekognition, for up
+# to max_label_age seconds after that call. scene_tolerance is how many of the 64 scene hash bits may differ.
+scene_tolerance = 6
+max_label_age = 60
+scene = scene_gate(scene_tolerance, max_label_age)
+
+# Photos are only written to the SD card for events that are sent to the server
+captures_dir = './captures'
+
+# Set when the canary shuts down; also ends the uploader's sleeps early
+stopping = threading.Event()
+
+# Motion monitor, started by main()
+mm = None
 canary_id = keys.canary_id
 
+# Camera backend chosen by $CANARY_CAMERA (see camera_source.py): the Pi camera, or images from testimgs/ to run off
+# the Pi. The camera is kept open while parked, so photos are taken without warming it up each time. It is opened
+# when the car parks (or at the first photo) and released when the car moves.
+camera = open_camera()
+camera_lock = threading.Lock()
+
 
 def get_timestamp():
     return datetime.now().strftime("%H:%M:%S")
 
 
+def get_rekognition_client():
+    global rekognition_client
+    if rekognition_client is None:
+        rekognition_client = boto3.client('rekognition',
+                                          aws_access_key_id=keys.aws_access_id,
+                                          aws_secret_access_key=keys.aws_secret_id,
+                                          region_name='us-east-1')
+    return rekognition_client
+
+
 def send_emergency_sms():
     client = Client(keys.twilio_sid, keys.twilio_auth)
     message = f"EMERGENCY CONTACT MESSAGE. DEVICE ID {keys.canary_id}"
@@ -39,23 +85,41 @@ def send_emergency_sms():
 
 def parked_event():
     print(f"[{get_timestamp()}] Car is parked.")
+    with camera_lock:
+        camera.open()
 
 
 def moving_event():
     print(f"[{get_timestamp()}] Car is moving.")
+    release_camera()
+    scene.reset()  # The next parked scene has to be classified afresh
+
+
+def release_camera():
+    with camera_lock:
+        camera.close()
 
 
 def take_photo():
-    # Take photograph
-    img_timestamp = time.time()
-    image_file = f'./captures/capture-{img_timestamp}.jpg'
-    camera.capture(image_file)
-    return image_file
+    # Take photograph into memory and return the image bytes
+    with camera_lock:
+        return camera.capture()
+
+
+def photo_name(timestamp):
+    return f'capture-{timestamp}.jpg'
 
 
-def check_photo(image_filename):
+def save_photo(photo, timestamp):
+    # Keep a copy of a photo that is being sent, like the server does
+    os.makedirs(captures_dir, exist_ok=True)
+    with open(os.path.join(captures_dir, photo_name(timestamp)), 'wb') as f:
+        f.write(photo)
+
+
+def check_photo(photo, name=None):
     # Use photograph to determine whether there is a baby or dog in photo
-    rekognition = RekognitionImage.from_file(image_filename, rekognition_client)
+    rekognition = RekognitionImage({'Bytes': photo}, name, get_rekognition_client())
     labels = rekognition.detect_labels(20)
     confidence_dict = {label.name: label.confidence for label in labels}
 
@@ -74,7 +138,7 @@ def check_photo(image_filename):
     return relevant_labels
 
 
-def send_data(server_addr, temp, labels, photo):
+def send_data(server_addr, temp, labels, photo, timestamp):
     if server_addr is None:
         return False
 
@@ -84,7 +148,7 @@ def send_data(server_addr, temp, labels, photo):
     payload = {'canary_id': canary_id, 'timestamp': get_timestamp(),
                'temperature': temp, 'labels': json.dumps(labels)}
 
-    image = {'image': open(photo, 'rb')}
+    image = {'image': (photo_name(timestamp), photo, 'image/jpeg')}
 
     url = 'http://' + server_addr + '/post'
 
@@ -95,7 +159,7 @@ def send_data(server_addr, temp, labels, photo):
             if r.text.find('alert') != -1:
                 # Server notified user, sleep for 10 min to not spam server+user
                 print(f"[{get_timestamp()}] Server notified user about event! Sleeping...")
-                time.sleep(600)
+                stopping.wait(600)
             return True
         except requests.exceptions.ConnectionError as e:
             print(f'[{get_timestamp()}] Failed to connect to ServerPi. ', end='')
@@ -106,36 +170,94 @@ def send_data(server_addr, temp, labels, photo):
                 send_emergency_sms()
                 # Sleep for 10 min
                 print(f'[{get_timestamp()}] Sleeping...')
-                time.sleep(600)
+                stopping.wait(600)
             elif attempts == max_attempts:
                 print("Max attempts reached, but temperature reading does not constitute an emergency.")
             else:
-                time.sleep(3)  # Sleep 3 seconds, then try sending data again
+                stopping.wait(3)  # Sleep 3 seconds, then try sending data again
                 print("Retrying...")
     return False
 
 
+# Capture stage: reads the temperature and takes a photo every capture_period seconds while parked. Waits are
+# scheduled from the start of each capture, so slow captures do not stretch the cadence.
+def capture_loop(photos):
+    next_capture = time.monotonic()
+    while not stopping.is_set():
+        if not mm.is_parked():
+            release_camera()  # Normally done by moving_event; also covers a photo taken just as the car moved off
+            stopping.wait(idle_period)
+            next_capture = time.monotonic()
+            continue
+
+        # Get Temperature
+        temp = temp_reader.get_temp()
+        print(f'[{get_timestamp()}] Temperature: {temp}°F')
+        # Take photo
+        img_timestamp = time.time()
+        photo = take_photo()
+        print(f'[{get_timestamp()}] Photo captured: {len(photo)} bytes')
+        dropped = photos.put(canary_event(img_timestamp, temp, photo, None))
+        if dropped is not None:
+            print(f'[{get_timestamp()}] Classification is behind, skipped photo {photo_name(dropped.timestamp)}')
+
+        next_capture += capture_period
+        stopping.wait(max(next_capture - time.monotonic(), 0))
+
+
+# Classification stage: checks a photo for labels, or reuses the last labels if the scene has not changed. Returns
+# the event to send, or None if there is nothing to report.
+def classify_event(event):
+    relevant_labels = scene.check(event.photo, event.timestamp)
+    if relevant_labels is None:
+        relevant_labels = check_photo(event.photo, photo_name(event.timestamp))
+        scene.update(relevant_labels, event.timestamp)
+    else:
+        print(f'[{get_timestamp()}] Scene unchanged, reusing {len(relevant_labels)} relevant labels.')
+    if len(relevant_labels) > 0 and event.temp >= min_temp_alert:
+        return event._replace(labels=relevant_labels)
+    return None
+
+
+# Upload stage: sends an event to the server unless it went stale while waiting
+def upload_event(server_addr, event):
+    age = time.time() - event.timestamp
+    if age > max_event_age:
+        print(f'[{get_timestamp()}] Skipped event from {age:.0f} seconds ago.')
+        return None
+    save_photo(event.photo, event.timestamp)
+    send_data(server_addr, event.temp, event.labels, event.photo, event.timestamp)
+    return None
+
+
 def main():
+    global mm
     server_addr = input('Please enter the ServerPi\'s IP Address: ')
-    mm.calibrate()
+    photos = stage_queue(photo_queue_size, DROP_OLDEST)
+    events = stage_queue(event_queue_size, BLOCK)
+    classifier = pipeline_stage('canary_classify', classify_event, photos, events)
+    uploader = pipeline_stage('canary_upload', lambda event: upload_event(server_addr, event), events)
+
+    # The IMU sampler runs in its own process so photo checks and uploads cannot disturb its timing. It loads the saved
+    # calibration profile, or on first boot calibrates without prompting while the car is standing still. Parked/moving
+    # is decided from the accelerometer, gyro and compass together, as every false transition costs a photo check.
     try:
+        mm = process_motion_monitor(calibrate=True, use_fifo=True, adaptive_sampling=True, drift_tracking=True,
+                                    fusion=fusion_detector())
         mm.start(on_parked=parked_event, on_moving=moving_event)
-        while True:
-            if mm.is_parked():
-                # Get Temperature
-                temp = temp_reader.get_temp()
-                print(f'[{get_timestamp()}] Temperature: {temp}°F')
-                # Take photo and check for labels
-                img_file = take_photo()
-                print(f'[{get_timestamp()}] Photo captured: {img_file}')
-                relevant_labels = check_photo(img_file)
-                # Send to server
-                if len(relevant_labels) > 0 and temp >= min_temp_alert:
-                    send_data(server_addr, temp, relevant_labels, img_file)
-                time.sleep(5)  # Sleep 5 seconds, then take another reading
+        classifier.start()
+        uploader.start()
+        capture_loop(photos)
 
     finally:
-        mm.stop()
+        stopping.set()
+        photos.close()
+        events.close()
+        classifier.join(5)
+        uploader.join(5)
+        if mm is not None:
+            mm.close()
+        release_camera()
 
 
 if __name__ == "__main__":
@@ -1,291 +1,513 @@
-import smbus
-bus = smbus.SMBus(1)
 from .LSM9DS0 import *
 from .LSM9DS1 import *
 from .LSM6DSL import *
 from .LIS3MDL import *
+import abc
 import time
+import struct
+import json
+import numpy as np
+from .i2c import openBus, SimulatedBus
+from .magcal import MAG_CALIBRATION_FILE, loadMagCalibration
+from .statefile import statePath, saveJSON
 
 
 
 
 BerryIMUversion = 99
+bus = None                  #Default bus, opened by getBus() on first use
+imu = None                  #Driver returned by the last detectIMU(), used by the module-level functions
+
+#Setting the MSB of the register address asks the LSM9DS0, the LSM9DS1 magnetometer and the
+#LIS3MDL to auto-increment the address during a multi-byte read. The LSM6DSL and the LSM9DS1
+#accelerometer/gyro use a control register bit instead (IF_INC / IF_ADD_INC), set in initIMU()
+AUTO_INCREMENT = 0x80
+
+#LSM6DSL FIFO settings, see BerryIMUv3.initFIFO()
+FIFO_ODR = {12.5: 0b0001, 26: 0b0010, 52: 0b0011, 104: 0b0100, 208: 0b0101,
+            416: 0b0110, 833: 0b0111, 1660: 0b1000, 3330: 0b1001, 6660: 0b1010}
+FIFO_WORDS = 2048           #4 KB FIFO, 16 bit words
+FIFO_MAX_READ = 32          #SMBus block reads are limited to 32 bytes
+
+DETECT_CACHE_FILE = statePath('imu_detect.json')     #Suggested cache_file for detectIMU()
+
+
+
+
+def getBus():
+    #Returns the default bus, opening it on first use. Set BERRYIMU_BUS to choose the
+    #backend (see i2c.py), e.g. BERRYIMU_BUS=sim to run without a BerryIMU attached.
+    global bus
+    if bus is None:
+        bus = openBus()
+    return bus
+
+
+
+def combineXYZ(block):
+    #Convert six little-endian bytes (X_L, X_H, Y_L, Y_H, Z_L, Z_H) to three signed values
+    return struct.unpack('<hhh', bytes(block))
+
+
+
+class BerryIMU(abc.ABC):
+    #Driver for one BerryIMU on one I2C bus. Each subclass holds the addresses and output
+    #registers of its chip family as class attributes, so reads never branch on the version
+    #and several IMUs (e.g. on different buses) can be used in the same process.
+    #
+    #Each sensor is described by (device address, OUT_X_L register, burst read register);
+    #the burst register includes AUTO_INCREMENT where the chip needs it. WHO_AM_I lists the
+    #(device address, register, expected response) checks that identify the chip family.
+    version = 99
+    name = "unknown"
+    ACC = (0, 0, 0)
+    GYR = (0, 0, 0)
+    MAG = (0, 0, 0)
+    WHO_AM_I = ()
+
+    def __init__(self, bus):
+        self.bus = bus
+        self._readByte = bus.read_byte_data
+        self._readBlock = bus.read_i2c_block_data
+        self.magOffset = np.zeros(3)     #Hard iron offset, subtracted by correctMAG()
+        self.magScale = np.ones(3)       #Soft iron scale, applied after the offset
+        self.magCalibration = None       #Profile the two came from, see magcal.py
 
+    @classmethod
+    def probe(cls, bus):
+        #Returns True if this chip family answers on the bus with the expected 'who am i' values.
+        #Raises IOError if one of the devices is not connected.
+        for device_address, register, expected in cls.WHO_AM_I:
+            if bus.read_byte_data(device_address, register) != expected:
+                return False
+        return True
 
+    @classmethod
+    def verify(cls, bus):
+        #Cheaper probe() used for a cached detection: a single 'who am i' read
+        device_address, register, expected = cls.WHO_AM_I[0]
+        try:
+            return bus.read_byte_data(device_address, register) == expected
+        except IOError:
+            return False
 
+    def describe(self):
+        #Detection details stored in the detectIMU() cache file
+        return {'version': self.version, 'name': self.name,
+                'addresses': {'acc': self.ACC[0], 'gyr': self.GYR[0], 'mag': self.MAG[0]},
+                'who_am_i': [list(check) for check in self.WHO_AM_I]}
 
+    @abc.abstractmethod
+    def initIMU(self):
+        pass
 
-def detectIMU():
-    #Detect which version of BerryIMU is connected using the 'who am i' register
-    #BerryIMUv1 uses the LSM9DS0
-    #BerryIMUv2 uses the LSM9DS1
-    #BerryIMUv3 uses the LSM6DSL and LIS3MDL
- 
-    global BerryIMUversion
+    def writeByte(self, device_address, register, value):
+        self.bus.write_byte_data(device_address, register, value)
 
+    def readBlock(self, device_address, register, length):
+        return self._readBlock(device_address, register, length)
 
-    try:
-        #Check for BerryIMUv1 (LSM9DS0)
-        #If no LSM9DS0 is connected, there will be an I2C bus error and the program will exit.
-        #This section of code stops this from happening.
-        LSM9DS0_WHO_G_response = (bus.read_byte_data(LSM9DS0_GYR_ADDRESS, LSM9DS0_WHO_AM_I_G))
-        LSM9DS0_WHO_XM_response = (bus.read_byte_data(LSM9DS0_ACC_ADDRESS, LSM9DS0_WHO_AM_I_XM))
-    except IOError as e:
-        print('')        #need to do something here, so we just print a space
-    else:
-        if (LSM9DS0_WHO_G_response == 0xd4) and (LSM9DS0_WHO_XM_response == 0x49):
-            print("Found BerryIMUv1 (LSM9DS0)")
-            BerryIMUversion = 1
+    def _readAxis(self, device_address, register):
+        low = self._readByte(device_address, register)
+        high = self._readByte(device_address, register + 1)
+        combined = (low | high << 8)
+        return combined if combined < 32768 else combined - 65536
 
+    #The vector reads fetch all three axes of a sensor in one I2C transaction
+    #instead of the six single-byte transactions used by readACCx/y/z and friends.
+    def readACC(self):
+        return combineXYZ(self._readBlock(self.ACC[0], self.ACC[2], 6))
 
-    try:
-        #Check for BerryIMUv2 (LSM9DS1)
-        #If no LSM9DS1 is connnected, there will be an I2C bus error and the program will exit.
-        #This section of code stops this from happening.
-        LSM9DS1_WHO_XG_response = (bus.read_byte_data(LSM9DS1_GYR_ADDRESS, LSM9DS1_WHO_AM_I_XG))
-        LSM9DS1_WHO_M_response = (bus.read_byte_data(LSM9DS1_MAG_ADDRESS, LSM9DS1_WHO_AM_I_M))
-
-    except IOError as f:
-        print('')        #need to do something here, so we just print a space
-    else:
-        if (LSM9DS1_WHO_XG_response == 0x68) and (LSM9DS1_WHO_M_response == 0x3d):
-            print("Found BerryIMUv2 (LSM9DS1)")
-            BerryIMUversion = 2
+    def readGYR(self):
+        return combineXYZ(self._readBlock(self.GYR[0], self.GYR[2], 6))
 
-    try:
-        #Check for BerryIMUv3 (LSM6DSL and LIS3MDL)
-        #If no LSM6DSL or LIS3MDL is connected, there will be an I2C bus error and the program will exit.
-        #This section of code stops this from happening.
-        LSM6DSL_WHO_AM_I_response = (bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_WHO_AM_I))
-        LIS3MDL_WHO_AM_I_response = (bus.read_byte_data(LIS3MDL_ADDRESS, LIS3MDL_WHO_AM_I))
+    def readMAG(self):
+        return combineXYZ(self._readBlock(self.MAG[0], self.MAG[2], 6))
 
-    except IOError as f:
-        print('')        #need to do something here, so we just print a space
-    else:
-        if (LSM6DSL_WHO_AM_I_response == 0x6A) and (LIS3MDL_WHO_AM_I_response == 0x3D):
-            print("Found BerryIMUv3 (LSM6DSL and LIS3MDL)")
-            BerryIMUversion = 3
-    time.sleep(1)
+    def readAll(self):
+        #Returns ((ACCx, ACCy, ACCz), (GYRx, GYRy, GYRz), (MAGx, MAGy, MAGz))
+        return self.readACC(), self.readGYR(), self.readMAG()
 
+    def setMagCalibration(self, profile):
+        #Use the offset and scale of a calibration profile (see magcal.py), or none if None
+        self.magCalibration = profile
+        self.magOffset = np.zeros(3) if profile is None else np.array(profile['offset'], dtype=np.float64)
+        self.magScale = np.ones(3) if profile is None else np.array(profile['scale'], dtype=np.float64)
 
+    def correctMAG(self, mag):
+        #Applies the compass calibration to one raw (MAGx, MAGy, MAGz) reading or to readings
+        #shaped (n, 3). The reads themselves stay raw, so traces can be recorded before calibrating.
+        return (np.asarray(mag, dtype=np.float64) - self.magOffset) * self.magScale
 
+    def readACCx(self):
+        return self._readAxis(self.ACC[0], self.ACC[1])
 
+    def readACCy(self):
+        return self._readAxis(self.ACC[0], self.ACC[1] + 2)
+
+    def readACCz(self):
+        return self._readAxis(self.ACC[0], self.ACC[1] + 4)
 
+    def readGYRx(self):
+        return self._readAxis(self.GYR[0], self.GYR[1])
+
+    def readGYRy(self):
+        return self._readAxis(self.GYR[0], self.GYR[1] + 2)
+
+    def readGYRz(self):
+        return self._readAxis(self.GYR[0], self.GYR[1] + 4)
+
+    def readMAGx(self):
+        return self._readAxis(self.MAG[0], self.MAG[1])
 
+    def readMAGy(self):
+        return self._readAxis(self.MAG[0], self.MAG[1] + 2)
 
+    def readMAGz(self):
+        return self._readAxis(self.MAG[0], self.MAG[1] + 4)
 
+    def initFIFO(self, odr=52, gyro=False):
+        raise RuntimeError(f"FIFO batch sampling is not supported on {self.name}")
 
+    def readFIFO(self):
+        raise RuntimeError(f"FIFO batch sampling is not supported on {self.name}")
 
+    def enableWakeUp(self, threshold=1, duration=0):
+        raise RuntimeError(f"Wake-on-motion is not supported on {self.name}")
 
+    def disableWakeUp(self):
+        raise RuntimeError(f"Wake-on-motion is not supported on {self.name}")
 
+    def readWakeUpSource(self):
+        raise RuntimeError(f"Wake-on-motion is not supported on {self.name}")
 
 
-def writeByte(device_address,register,value):
-    bus.write_byte_data(device_address, register, value)
 
+class BerryIMUv1(BerryIMU):
+    #BerryIMUv1 uses the LSM9DS0
+    version = 1
+    name = "BerryIMUv1 (LSM9DS0)"
+    ACC = (LSM9DS0_ACC_ADDRESS, LSM9DS0_OUT_X_L_A, LSM9DS0_OUT_X_L_A | AUTO_INCREMENT)
+    GYR = (LSM9DS0_GYR_ADDRESS, LSM9DS0_OUT_X_L_G, LSM9DS0_OUT_X_L_G | AUTO_INCREMENT)
+    MAG = (LSM9DS0_MAG_ADDRESS, LSM9DS0_OUT_X_L_M, LSM9DS0_OUT_X_L_M | AUTO_INCREMENT)
+    WHO_AM_I = ((LSM9DS0_GYR_ADDRESS, LSM9DS0_WHO_AM_I_G, 0xd4),
+                (LSM9DS0_ACC_ADDRESS, LSM9DS0_WHO_AM_I_XM, 0x49))
+
+    def initIMU(self):
+        #initialise the accelerometer
+        self.writeByte(LSM9DS0_ACC_ADDRESS,LSM9DS0_CTRL_REG1_XM, 0b01100111)  #z,y,x axis enabled, continuos update,  100Hz data rate
+        self.writeByte(LSM9DS0_ACC_ADDRESS,LSM9DS0_CTRL_REG2_XM, 0b00011000)  #+/- 8G full scale
 
+        #initialise the magnetometer
+        self.writeByte(LSM9DS0_MAG_ADDRESS,LSM9DS0_CTRL_REG5_XM, 0b11110000)  #Temp enable, M data rate = 50Hz
+        self.writeByte(LSM9DS0_MAG_ADDRESS,LSM9DS0_CTRL_REG6_XM, 0b01100000)  #+/- 12gauss
+        self.writeByte(LSM9DS0_MAG_ADDRESS,LSM9DS0_CTRL_REG7_XM, 0b00000000)  #Continuous-conversion mode
 
-def readACCx():
-    acc_l = 0
-    acc_h = 0
-    if(BerryIMUversion == 1):
-        acc_l = bus.read_byte_data(LSM9DS0_ACC_ADDRESS, LSM9DS0_OUT_X_L_A)
-        acc_h = bus.read_byte_data(LSM9DS0_ACC_ADDRESS, LSM9DS0_OUT_X_H_A)
-    elif(BerryIMUversion == 2):
-        acc_l = bus.read_byte_data(LSM9DS1_ACC_ADDRESS, LSM9DS1_OUT_X_L_XL)
-        acc_h = bus.read_byte_data(LSM9DS1_ACC_ADDRESS, LSM9DS1_OUT_X_H_XL)
-    elif(BerryIMUversion == 3):
-        acc_l = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTX_L_XL)
-        acc_h = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTX_H_XL)
+        #initialise the gyroscope
+        self.writeByte(LSM9DS0_GYR_ADDRESS,LSM9DS0_CTRL_REG1_G, 0b00001111)   #Normal power mode, all axes enabled
+        self.writeByte(LSM9DS0_GYR_ADDRESS,LSM9DS0_CTRL_REG4_G, 0b00110000)   #Continuos update, 2000 dps full scale
 
-    acc_combined = (acc_l | acc_h <<8)
-    return acc_combined  if acc_combined < 32768 else acc_combined - 65536
 
 
+class BerryIMUv2(BerryIMU):
+    #BerryIMUv2 uses the LSM9DS1
+    version = 2
+    name = "BerryIMUv2 (LSM9DS1)"
+    ACC = (LSM9DS1_ACC_ADDRESS, LSM9DS1_OUT_X_L_XL, LSM9DS1_OUT_X_L_XL)
+    GYR = (LSM9DS1_GYR_ADDRESS, LSM9DS1_OUT_X_L_G, LSM9DS1_OUT_X_L_G)
+    MAG = (LSM9DS1_MAG_ADDRESS, LSM9DS1_OUT_X_L_M, LSM9DS1_OUT_X_L_M | AUTO_INCREMENT)
+    WHO_AM_I = ((LSM9DS1_GYR_ADDRESS, LSM9DS1_WHO_AM_I_XG, 0x68),
+                (LSM9DS1_MAG_ADDRESS, LSM9DS1_WHO_AM_I_M, 0x3d))
+
+    def initIMU(self):
+        #initialise the accelerometer
+        self.writeByte(LSM9DS1_ACC_ADDRESS,LSM9DS1_CTRL_REG5_XL,0b00111000)   #z, y, x axis enabled for accelerometer
+        self.writeByte(LSM9DS1_ACC_ADDRESS,LSM9DS1_CTRL_REG6_XL,0b00111000)   #+/- 8g
+        self.writeByte(LSM9DS1_ACC_ADDRESS,LSM9DS1_CTRL_REG8,0b01000100)      #Enable Block Data update, increment during multi byte read
 
- 
+        #initialise the gyroscope
+        self.writeByte(LSM9DS1_GYR_ADDRESS,LSM9DS1_CTRL_REG4,0b00111000)      #z, y, x axis enabled for gyro
+        self.writeByte(LSM9DS1_GYR_ADDRESS,LSM9DS1_CTRL_REG1_G,0b10111000)    #Gyro ODR = 476Hz, 2000 dps
+        self.writeByte(LSM9DS1_GYR_ADDRESS,LSM9DS1_ORIENT_CFG_G,0b10111000)   #Swap orientation
 
+        #initialise the magnetometer
+        self.writeByte(LSM9DS1_MAG_ADDRESS,LSM9DS1_CTRL_REG1_M, 0b10011100)    #Temp compensation enabled,Low power mode mode,80Hz ODR
+        self.writeByte(LSM9DS1_MAG_ADDRESS,LSM9DS1_CTRL_REG2_M, 0b01000000)    #+/- 2gauss
+        self.writeByte(LSM9DS1_MAG_ADDRESS,LSM9DS1_CTRL_REG3_M, 0b00000000)    #continuos update
+        self.writeByte(LSM9DS1_MAG_ADDRESS,LSM9DS1_CTRL_REG4_M, 0b00000000)    #lower power mode for Z axis
 
-def readACCy():
-    acc_l = 0
-    acc_h = 0
-    if(BerryIMUversion == 1):
-        acc_l = bus.read_byte_data(LSM9DS0_ACC_ADDRESS, LSM9DS0_OUT_Y_L_A)
-        acc_h = bus.read_byte_data(LSM9DS0_ACC_ADDRESS, LSM9DS0_OUT_Y_H_A)
-    elif(BerryIMUversion == 2):
-        acc_l = bus.read_byte_data(LSM9DS1_ACC_ADDRESS, LSM9DS1_OUT_Y_L_XL)
-        acc_h = bus.read_byte_data(LSM9DS1_ACC_ADDRESS, LSM9DS1_OUT_Y_H_XL)
-    elif(BerryIMUversion == 3):
-        acc_l = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTY_L_XL)
-        acc_h = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTY_H_XL)
-
-    acc_combined = (acc_l | acc_h <<8)
-    return acc_combined  if acc_combined < 32768 else acc_combined - 65536
 
 
-def readACCz():
-    acc_l = 0
-    acc_h = 0
-    if(BerryIMUversion == 1):
-        acc_l = bus.read_byte_data(LSM9DS0_ACC_ADDRESS, LSM9DS0_OUT_Z_L_A)
-        acc_h = bus.read_byte_data(LSM9DS0_ACC_ADDRESS, LSM9DS0_OUT_Z_H_A)
-    elif(BerryIMUversion == 2):
-        acc_l = bus.read_byte_data(LSM9DS1_ACC_ADDRESS, LSM9DS1_OUT_Z_L_XL)
-        acc_h = bus.read_byte_data(LSM9DS1_ACC_ADDRESS, LSM9DS1_OUT_Z_H_XL)
-    elif(BerryIMUversion == 3):
-        acc_l = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTZ_L_XL)
-        acc_h = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTZ_H_XL)
-
-    acc_combined = (acc_l | acc_h <<8)
-    return acc_combined  if acc_combined < 32768 else acc_combined - 65536
+class BerryIMUv3(BerryIMU):
+    #BerryIMUv3 uses the LSM6DSL and LIS3MDL
+    version = 3
+    name = "BerryIMUv3 (LSM6DSL and LIS3MDL)"
+    ACC = (LSM6DSL_ADDRESS, LSM6DSL_OUTX_L_XL, LSM6DSL_OUTX_L_XL)
+    GYR = (LSM6DSL_ADDRESS, LSM6DSL_OUTX_L_G, LSM6DSL_OUTX_L_G)
+    MAG = (LIS3MDL_ADDRESS, LIS3MDL_OUT_X_L, LIS3MDL_OUT_X_L | AUTO_INCREMENT)
+    WHO_AM_I = ((LSM6DSL_ADDRESS, LSM6DSL_WHO_AM_I, 0x6A),
+                (LIS3MDL_ADDRESS, LIS3MDL_WHO_AM_I, 0x3D))
+
+    def __init__(self, bus):
+        super().__init__(bus)
+        self.FIFOsampleWords = 0         #Words per FIFO sample, 0 while the FIFO is not in use
+
+    def readAll(self):
+        #The LSM6DSL gyro (0x22-0x27) and accelerometer (0x28-0x2D) outputs are contiguous,
+        #so both are fetched with a single 12 byte read
+        block = self._readBlock(LSM6DSL_ADDRESS, LSM6DSL_OUTX_L_G, 12)
+        return combineXYZ(block[6:12]), combineXYZ(block[0:6]), self.readMAG()
+
+    def initIMU(self):
+        #initialise the accelerometer
+        self.writeByte(LSM6DSL_ADDRESS,LSM6DSL_CTRL1_XL,0b10011111)           #ODR 3.33 kHz, +/- 8g , BW = 400hz
+        self.writeByte(LSM6DSL_ADDRESS,LSM6DSL_CTRL8_XL,0b11001000)           #Low pass filter enabled, BW9, composite filter
+        self.writeByte(LSM6DSL_ADDRESS,LSM6DSL_CTRL3_C,0b01000100)            #Enable Block Data update, increment during multi byte read
 
+        #initialise the gyroscope
+        self.writeByte(LSM6DSL_ADDRESS,LSM6DSL_CTRL2_G,0b10011100)            #ODR 3.3 kHz, 2000 dps
 
-def readGYRx():
-    gyr_l = 0
-    gyr_h = 0
-    if(BerryIMUversion == 1):
-        gyr_l = bus.read_byte_data(LSM9DS0_GYR_ADDRESS, LSM9DS0_OUT_X_L_G)
-        gyr_h = bus.read_byte_data(LSM9DS0_GYR_ADDRESS, LSM9DS0_OUT_X_H_G)
-    elif(BerryIMUversion == 2):
-        gyr_l = bus.read_byte_data(LSM9DS1_GYR_ADDRESS, LSM9DS1_OUT_X_L_G)
-        gyr_h = bus.read_byte_data(LSM9DS1_GYR_ADDRESS, LSM9DS1_OUT_X_H_G)
-    elif(BerryIMUversion == 3):
-        gyr_l = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTX_L_G)
-        gyr_h = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTX_H_G)
-
-    gyr_combined = (gyr_l | gyr_h <<8)
-    return gyr_combined  if gyr_combined < 32768 else gyr_combined - 65536
+        #initialise the magnetometer
+        self.writeByte(LIS3MDL_ADDRESS,LIS3MDL_CTRL_REG1, 0b11011100)         # Temp sesnor enabled, High performance, ODR 80 Hz, FAST ODR disabled and Selft test disabled.
+        self.writeByte(LIS3MDL_ADDRESS,LIS3MDL_CTRL_REG2, 0b00100000)         # +/- 8 gauss
+        self.writeByte(LIS3MDL_ADDRESS,LIS3MDL_CTRL_REG3, 0b00000000)         # Continuous-conversion mode
+
+    def initFIFO(self, odr=52, gyro=False):
+        #Put the LSM6DSL FIFO in continuous mode so samples are batched on the chip and
+        #can be drained in bulk by readFIFO(). The accelerometer (and optionally the gyro)
+        #is stored at 'odr' Hz, which must be one of FIFO_ODR. When full, the oldest samples
+        #are overwritten; at 52 Hz the FIFO holds about 13 seconds of accelerometer data.
+        #The FIFO keeps every n-th sample without filtering them, so the sensors are slowed
+        #down to 'odr' as well: their digital low pass filters then cut at odr/2 and vibration
+        #above that no longer aliases into the batched samples.
+        if odr not in FIFO_ODR:
+            raise ValueError(f"Unsupported FIFO ODR {odr} Hz, expected one of {sorted(FIFO_ODR)}")
+
+        self.writeByte(LSM6DSL_ADDRESS,LSM6DSL_CTRL1_XL,(FIFO_ODR[odr] << 4) | 0b1101)   #ODR = FIFO ODR, +/- 8g, LPF1 BW = ODR/2
+        self.writeByte(LSM6DSL_ADDRESS,LSM6DSL_CTRL8_XL,0b00000000)                      #LPF2 off, its cut-offs are below ODR/9
+        self.writeByte(LSM6DSL_ADDRESS,LSM6DSL_CTRL2_G,(FIFO_ODR[odr] << 4) | 0b1100)    #ODR = FIFO ODR, 2000 dps
+        self.writeByte(LSM6DSL_ADDRESS,LSM6DSL_FIFO_CTRL5,0b00000000)          #Bypass mode, clears the FIFO
+        self.writeByte(LSM6DSL_ADDRESS,LSM6DSL_FIFO_CTRL1,0b00000000)          #No FIFO threshold
+        self.writeByte(LSM6DSL_ADDRESS,LSM6DSL_FIFO_CTRL2,0b00000000)
+        if gyro:
+            self.writeByte(LSM6DSL_ADDRESS,LSM6DSL_FIFO_CTRL3,0b00001001)      #Gyro and accelerometer in FIFO, no decimation
+            self.FIFOsampleWords = 6
+        else:
+            self.writeByte(LSM6DSL_ADDRESS,LSM6DSL_FIFO_CTRL3,0b00000001)      #Accelerometer in FIFO, no decimation
+            self.FIFOsampleWords = 3
+        self.writeByte(LSM6DSL_ADDRESS,LSM6DSL_FIFO_CTRL4,0b00000000)
+        self.writeByte(LSM6DSL_ADDRESS,LSM6DSL_FIFO_CTRL5,(FIFO_ODR[odr] << 3) | 0b110)   #FIFO ODR, continuous mode
+
+    def readFIFO(self):
+        #Drain every complete sample currently held in the LSM6DSL FIFO.
+        #Returns an int16 NumPy array of shape (n, 3) with ACCx, ACCy, ACCz columns, or
+        #(n, 6) with ACCx, ACCy, ACCz, GYRx, GYRy, GYRz columns when initFIFO(gyro=True).
+        sampleWords = self.FIFOsampleWords
+        if sampleWords == 0:
+            raise RuntimeError("FIFO is not enabled, call initFIFO() first")
+
+        status = self._readBlock(LSM6DSL_ADDRESS, LSM6DSL_FIFO_STATUS1, 4)
+        unread = status[0] | ((status[1] & 0x07) << 8)
+        pattern = status[2] | ((status[3] & 0x03) << 8)     #Index, within a sample, of the next word
+
+        #Discard the tail of a partially read sample so that reads start on a sample boundary
+        skip = (sampleWords - pattern) % sampleWords
+        skip = min(skip, unread)
+        if skip:
+            self._readBlock(LSM6DSL_ADDRESS, LSM6DSL_FIFO_DATA_OUT_L, skip * 2)
+        samples = (unread - skip) // sampleWords
+
+        #The FIFO output address rolls back to FIFO_DATA_OUT_L after FIFO_DATA_OUT_H, so
+        #consecutive block reads keep returning the next words in the FIFO
+        sample_bytes = sampleWords * 2
+        per_read = FIFO_MAX_READ // sample_bytes
+        raw = bytearray()
+        remaining = samples
+        while remaining > 0:
+            count = min(per_read, remaining)
+            raw += bytes(self._readBlock(LSM6DSL_ADDRESS, LSM6DSL_FIFO_DATA_OUT_L, count * sample_bytes))
+            remaining -= count
+
+        data = np.frombuffer(bytes(raw), dtype='<i2').reshape(samples, sampleWords)
+        if sampleWords == 6:
+            #Gyro is the first data set in the FIFO pattern, accelerometer the second
+            data = data[:, [3, 4, 5, 0, 1, 2]]
+        return data
+
+    def enableWakeUp(self, threshold=1, duration=0):
+        #Raise INT1 when the high-pass filtered acceleration on any axis exceeds 'threshold'
+        #for longer than 'duration' samples. threshold is in units of full scale / 64
+        #(125 mg at +/- 8g, 1-63), duration is 0-3 ODR periods. The interrupt is latched
+        #until readWakeUpSource() is called.
+        if not 1 <= threshold <= 63:
+            raise ValueError("Wake-up threshold must be between 1 and 63")
+        if not 0 <= duration <= 3:
+            raise ValueError("Wake-up duration must be between 0 and 3")
+
+        self.writeByte(LSM6DSL_ADDRESS,LSM6DSL_WAKE_UP_DUR,duration << 5)       #Wake-up duration
+        self.writeByte(LSM6DSL_ADDRESS,LSM6DSL_WAKE_UP_THS,threshold)           #Wake-up threshold
+        self.writeByte(LSM6DSL_ADDRESS,LSM6DSL_TAP_CFG,0b10010001)              #Enable interrupts, slope filter, latched
+        self.writeByte(LSM6DSL_ADDRESS,LSM6DSL_MD1_CFG,0b00100000)              #Route wake-up to INT1
+        self.readWakeUpSource()
+
+    def disableWakeUp(self):
+        self.writeByte(LSM6DSL_ADDRESS,LSM6DSL_MD1_CFG,0b00000000)
+        self.writeByte(LSM6DSL_ADDRESS,LSM6DSL_TAP_CFG,0b00000000)
+        self.readWakeUpSource()
+
+    def readWakeUpSource(self):
+        #Returns True if a wake-up event occurred; reading WAKE_UP_SRC also clears a latched INT1
+        return bool(self._readByte(LSM6DSL_ADDRESS, LSM6DSL_WAKE_UP_SRC) & 0b00001000)
+
+
+
+DRIVERS = (BerryIMUv1, BerryIMUv2, BerryIMUv3)
+
+
+
+def loadDetectCache(cache_file, i2c_bus):
+    #Returns the driver recorded in cache_file if it still answers on i2c_bus, otherwise None
+    try:
+        with open(cache_file, 'r') as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
 
+    for driver in DRIVERS:
+        if driver.version == cached.get('version') and driver(i2c_bus).describe() == cached:
+            if driver.verify(i2c_bus):
+                return driver(i2c_bus)
+    return None
 
-def readGYRy():
-    gyr_l = 0
-    gyr_h = 0
-    if(BerryIMUversion == 1):
-        gyr_l = bus.read_byte_data(LSM9DS0_GYR_ADDRESS, LSM9DS0_OUT_Y_L_G)
-        gyr_h = bus.read_byte_data(LSM9DS0_GYR_ADDRESS, LSM9DS0_OUT_Y_H_G)
-    elif(BerryIMUversion == 2):
-        gyr_l = bus.read_byte_data(LSM9DS1_GYR_ADDRESS, LSM9DS1_OUT_Y_L_G)
-        gyr_h = bus.read_byte_data(LSM9DS1_GYR_ADDRESS, LSM9DS1_OUT_Y_H_G)
-    elif(BerryIMUversion == 3):
-        gyr_l = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTY_L_G)
-        gyr_h = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTY_H_G)
-
-    gyr_combined = (gyr_l | gyr_h <<8)
-    return gyr_combined  if gyr_combined < 32768 else gyr_combined - 65536
 
-def readGYRz():
-    gyr_l = 0
-    gyr_h = 0
-    if(BerryIMUversion == 1):
-        gyr_l = bus.read_byte_data(LSM9DS0_GYR_ADDRESS, LSM9DS0_OUT_Z_L_G)
-        gyr_h = bus.read_byte_data(LSM9DS0_GYR_ADDRESS, LSM9DS0_OUT_Z_H_G)
-    elif(BerryIMUversion == 2):
-        gyr_l = bus.read_byte_data(LSM9DS1_GYR_ADDRESS, LSM9DS1_OUT_Z_L_G)
-        gyr_h = bus.read_byte_data(LSM9DS1_GYR_ADDRESS, LSM9DS1_OUT_Z_H_G)
-    elif(BerryIMUversion == 3):
-        gyr_l = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTZ_L_G)
-        gyr_h = bus.read_byte_data(LSM6DSL_ADDRESS, LSM6DSL_OUTZ_H_G)
-
-    gyr_combined = (gyr_l | gyr_h <<8)
-    return gyr_combined  if gyr_combined < 32768 else gyr_combined - 65536
+def saveDetectCache(cache_file, found):
+    saveJSON(cache_file, found.describe())
 
 
-def readMAGx():
-    mag_l = 0
-    mag_h = 0
-    if(BerryIMUversion == 1):
-        mag_l = bus.read_byte_data(LSM9DS0_MAG_ADDRESS, LSM9DS0_OUT_X_L_M)
-        mag_h = bus.read_byte_data(LSM9DS0_MAG_ADDRESS, LSM9DS0_OUT_X_H_M)
-    elif(BerryIMUversion == 2):
-        mag_l = bus.read_byte_data(LSM9DS1_MAG_ADDRESS, LSM9DS1_OUT_X_L_M)
-        mag_h = bus.read_byte_data(LSM9DS1_MAG_ADDRESS, LSM9DS1_OUT_X_H_M)
-    elif(BerryIMUversion == 3):
-        mag_l = bus.read_byte_data(LIS3MDL_ADDRESS, LIS3MDL_OUT_X_L)
-        mag_h = bus.read_byte_data(LIS3MDL_ADDRESS, LIS3MDL_OUT_X_H)
-
-    mag_combined = (mag_l | mag_h <<8)
-    return mag_combined  if mag_combined < 32768 else mag_combined - 65536
+def applyMagCalibration(found, path):
+    #Loads the compass calibration saved by calibrateBerryIMU.py into the driver, if it was
+    #made with the same BerryIMU version
+    profile = loadMagCalibration(path)
+    if profile is None:
+        return
+    if profile.get('version') != found.version:
+        print("Ignoring compass calibration for " + str(profile.get('name')) + ", found " + found.name)
+        return
+    found.setMagCalibration(profile)
 
 
-def readMAGy():
-    mag_l = 0
-    mag_h = 0
-    if(BerryIMUversion == 1):
-        mag_l = bus.read_byte_data(LSM9DS0_MAG_ADDRESS, LSM9DS0_OUT_Y_L_M)
-        mag_h = bus.read_byte_data(LSM9DS0_MAG_ADDRESS, LSM9DS0_OUT_Y_H_M)
-    elif(BerryIMUversion == 2):
-        mag_l = bus.read_byte_data(LSM9DS1_MAG_ADDRESS, LSM9DS1_OUT_Y_L_M)
-        mag_h = bus.read_byte_data(LSM9DS1_MAG_ADDRESS, LSM9DS1_OUT_Y_H_M)
-    elif(BerryIMUversion == 3):
-        mag_l = bus.read_byte_data(LIS3MDL_ADDRESS, LIS3MDL_OUT_Y_L)
-        mag_h = bus.read_byte_data(LIS3MDL_ADDRESS, LIS3MDL_OUT_Y_H)
-
-    mag_combined = (mag_l | mag_h <<8)
-    return mag_combined  if mag_combined < 32768 else mag_combined - 65536
+def detectIMU(i2c_bus=None, cache_file=None, mag_calibration=MAG_CALIBRATION_FILE):
+    #Detect which version of BerryIMU is connected using the 'who am i' register
+    #BerryIMUv1 uses the LSM9DS0
+    #BerryIMUv2 uses the LSM9DS1
+    #BerryIMUv3 uses the LSM6DSL and LIS3MDL
+    #
+    #Returns a driver object for the IMU found on i2c_bus (the default bus if None),
+    #or None if no BerryIMU answers.
+    #
+    #If cache_file is given, the last detection result is stored there. On the next call
+    #a single 'who am i' read confirms the cached IMU and the full probe is skipped.
+    #
+    #The compass calibration saved by calibrateBerryIMU.py in mag_calibration, if any, is
+    #loaded into the driver; pass None to leave the compass uncalibrated.
 
+    global BerryIMUversion
+    global imu
 
-def readMAGz():
-    mag_l = 0
-    mag_h = 0
-    if(BerryIMUversion == 1):
-        mag_l = bus.read_byte_data(LSM9DS0_MAG_ADDRESS, LSM9DS0_OUT_Z_L_M)
-        mag_h = bus.read_byte_data(LSM9DS0_MAG_ADDRESS, LSM9DS0_OUT_Z_H_M)
-    elif(BerryIMUversion == 2):
-        mag_l = bus.read_byte_data(LSM9DS1_MAG_ADDRESS, LSM9DS1_OUT_Z_L_M)
-        mag_h = bus.read_byte_data(LSM9DS1_MAG_ADDRESS, LSM9DS1_OUT_Z_H_M)
-    elif(BerryIMUversion == 3):
-        mag_l = bus.read_byte_data(LIS3MDL_ADDRESS, LIS3MDL_OUT_Z_L)
-        mag_h = bus.read_byte_data(LIS3MDL_ADDRESS, LIS3MDL_OUT_Z_H)
+    if i2c_bus is None:
+        i2c_bus = getBus()
 
-    mag_combined = (mag_l | mag_h <<8)
-    return mag_combined  if mag_combined < 32768 else mag_combined - 65536
+    found = None
+    if cache_file is not None:
+        found = loadDetectCache(cache_file, i2c_bus)
 
+    if found is None:
+        for driver in DRIVERS:
+            try:
+                #If the chip is not connected, there will be an I2C bus error and the program will exit.
+                #This section of code stops this from happening.
+                matched = driver.probe(i2c_bus)
+            except IOError as e:
+                matched = False
+            if matched:
+                print("Found " + driver.name)
+                found = driver(i2c_bus)
+        time.sleep(1)
 
+        if found is not None and cache_file is not None:
+            saveDetectCache(cache_file, found)
 
-def initIMU():
+    if found is not None and mag_calibration is not None:
+        applyMagCalibration(found, mag_calibration)
 
-    if(BerryIMUversion == 1):   #For BerryIMUv1
-        #initialise the accelerometer
-        writeByte(LSM9DS0_ACC_ADDRESS,LSM9DS0_CTRL_REG1_XM, 0b01100111)  #z,y,x axis enabled, continuos update,  100Hz data rate
-        writeByte(LSM9DS0_ACC_ADDRESS,LSM9DS0_CTRL_REG2_XM, 0b00011000)  #+/- 8G full scale
+    if i2c_bus is bus:
+        imu = found
+        BerryIMUversion = found.version if found is not None else 99
+    return found
 
-        #initialise the magnetometer
-        writeByte(LSM9DS0_MAG_ADDRESS,LSM9DS0_CTRL_REG5_XM, 0b11110000)  #Temp enable, M data rate = 50Hz
-        writeByte(LSM9DS0_MAG_ADDRESS,LSM9DS0_CTRL_REG6_XM, 0b01100000)  #+/- 12gauss
-        writeByte(LSM9DS0_MAG_ADDRESS,LSM9DS0_CTRL_REG7_XM, 0b00000000)  #Continuous-conversion mode
 
-        #initialise the gyroscope
-        writeByte(LSM9DS0_GYR_ADDRESS,LSM9DS0_CTRL_REG1_G, 0b00001111)   #Normal power mode, all axes enabled
-        writeByte(LSM9DS0_GYR_ADDRESS,LSM9DS0_CTRL_REG4_G, 0b00110000)   #Continuos update, 2000 dps full scale
 
-    elif(BerryIMUversion == 2):       #For BerryIMUv2
-        #initialise the accelerometer
-        writeByte(LSM9DS1_ACC_ADDRESS,LSM9DS1_CTRL_REG5_XL,0b00111000)   #z, y, x axis enabled for accelerometer
-        writeByte(LSM9DS1_ACC_ADDRESS,LSM9DS1_CTRL_REG6_XL,0b00111000)   #+/- 8g
+#Module-level API used by the ozzmaker example scripts; each call forwards to the
+#driver found by the last detectIMU() on the default bus.
+def detectedIMU():
+    #Driver found by the last detectIMU(); raises if none was found (or detectIMU() was not called)
+    if imu is None:
+        raise RuntimeError("detectIMU() found no BerryIMU")
+    return imu
 
-        #initialise the gyroscope
-        writeByte(LSM9DS1_GYR_ADDRESS,LSM9DS1_CTRL_REG4,0b00111000)      #z, y, x axis enabled for gyro
-        writeByte(LSM9DS1_GYR_ADDRESS,LSM9DS1_CTRL_REG1_G,0b10111000)    #Gyro ODR = 476Hz, 2000 dps
-        writeByte(LSM9DS1_GYR_ADDRESS,LSM9DS1_ORIENT_CFG_G,0b10111000)   #Swap orientation
+def writeByte(device_address,register,value):
+    getBus().write_byte_data(device_address, register, value)
 
-        #initialise the magnetometer
-        writeByte(LSM9DS1_MAG_ADDRESS,LSM9DS1_CTRL_REG1_M, 0b10011100)    #Temp compensation enabled,Low power mode mode,80Hz ODR
-        writeByte(LSM9DS1_MAG_ADDRESS,LSM9DS1_CTRL_REG2_M, 0b01000000)    #+/- 2gauss
-        writeByte(LSM9DS1_MAG_ADDRESS,LSM9DS1_CTRL_REG3_M, 0b00000000)    #continuos update
-        writeByte(LSM9DS1_MAG_ADDRESS,LSM9DS1_CTRL_REG4_M, 0b00000000)    #lower power mode for Z axis
+def readBlock(device_address,register,length):
+    return getBus().read_i2c_block_data(device_address, register, length)
 
-    elif(BerryIMUversion == 3):       #For BerryIMUv3
-        #initialise the accelerometer
-        writeByte(LSM6DSL_ADDRESS,LSM6DSL_CTRL1_XL,0b10011111)           #ODR 3.33 kHz, +/- 8g , BW = 400hz
-        writeByte(LSM6DSL_ADDRESS,LSM6DSL_CTRL8_XL,0b11001000)           #Low pass filter enabled, BW9, composite filter
-        writeByte(LSM6DSL_ADDRESS,LSM6DSL_CTRL3_C,0b01000100)            #Enable Block Data update, increment during multi byte read
+def readACC():
+    return detectedIMU().readACC()
 
-        #initialise the gyroscope
-        writeByte(LSM6DSL_ADDRESS,LSM6DSL_CTRL2_G,0b10011100)            #ODR 3.3 kHz, 2000 dps
+def readGYR():
+    return detectedIMU().readGYR()
 
-        #initialise the magnetometer
-        writeByte(LIS3MDL_ADDRESS,LIS3MDL_CTRL_REG1, 0b11011100)         # Temp sesnor enabled, High performance, ODR 80 Hz, FAST ODR disabled and Selft test disabled.
-        writeByte(LIS3MDL_ADDRESS,LIS3MDL_CTRL_REG2, 0b00100000)         # +/- 8 gauss
-        writeByte(LIS3MDL_ADDRESS,LIS3MDL_CTRL_REG3, 0b00000000)         # Continuous-conversion mode
+def readMAG():
+    return detectedIMU().readMAG()
+
+def correctMAG(mag):
+    return detectedIMU().correctMAG(mag)
+
+def readAll():
+    return detectedIMU().readAll()
+
+def readACCx():
+    return detectedIMU().readACCx()
+
+def readACCy():
+    return detectedIMU().readACCy()
 
+def readACCz():
+    return detectedIMU().readACCz()
 
+def readGYRx():
+    return detectedIMU().readGYRx()
+
+def readGYRy():
+    return detectedIMU().readGYRy()
+
+def readGYRz():
+    return detectedIMU().readGYRz()
+
+def readMAGx():
+    return detectedIMU().readMAGx()
+
+def readMAGy():
+    return detectedIMU().readMAGy()
+
+def readMAGz():
+    return detectedIMU().readMAGz()
+
+def initFIFO(odr=52, gyro=False):
+    detectedIMU().initFIFO(odr, gyro)
+
+def readFIFO():
+    return detectedIMU().readFIFO()
+
+def initIMU():
+    detectedIMU().initIMU()
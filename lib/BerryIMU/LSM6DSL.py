@@ -1,6 +1,12 @@
 
 LSM6DSL_ADDRESS          =  0x6A
 
+LSM6DSL_FIFO_CTRL1       =  0x06
+LSM6DSL_FIFO_CTRL2       =  0x07
+LSM6DSL_FIFO_CTRL3       =  0x08
+LSM6DSL_FIFO_CTRL4       =  0x09
+LSM6DSL_FIFO_CTRL5       =  0x0A
+
 LSM6DSL_WHO_AM_I         =  0x0F
 LSM6DSL_RAM_ACCESS       =  0x01
 LSM6DSL_CTRL1_XL         =  0x10
@@ -22,6 +28,13 @@ LSM6DSL_OUTY_H_XL        =  0x2B
 LSM6DSL_OUTZ_L_XL        =  0x2C
 LSM6DSL_OUTZ_H_XL        =  0x2D
 
+LSM6DSL_FIFO_STATUS1     =  0x3A
+LSM6DSL_FIFO_STATUS2     =  0x3B
+LSM6DSL_FIFO_STATUS3     =  0x3C
+LSM6DSL_FIFO_STATUS4     =  0x3D
+LSM6DSL_FIFO_DATA_OUT_L  =  0x3E
+LSM6DSL_FIFO_DATA_OUT_H  =  0x3F
+
 LSM6DSL_OUT_L_TEMP       =  0x20
 LSM6DSL_OUT_H_TEMP       =  0x21
 
@@ -29,7 +29,8 @@ G_GAIN = 0.070  # [deg/s/LSB]  If you change the dps for gyro, you need to updat
 AA =  0.40      # Complementary filter constant
 
 ################# Compass Calibration values ############
-# Use calibrateBerryIMU.py to get calibration values
+# Use calibrateBerryIMU.py to get calibration values. It saves them to a profile
+# (state/mag_calibration.json in the repository root) that is used instead of the values below.
 # Calibrating the compass isnt mandatory, however a calibrated
 # compass will result in a more accurate heading values.
 
@@ -86,10 +87,14 @@ while True:
     MAGy = IMU.readMAGy()
     MAGz = IMU.readMAGz()
 
-    #Apply compass calibration
-    MAGx -= (magXmin + magXmax) /2
-    MAGy -= (magYmin + magYmax) /2
-    MAGz -= (magZmin + magZmax) /2
+    #Apply compass calibration. The profile saved by calibrateBerryIMU.py is loaded by
+    #IMU.detectIMU(); without one, the values above are used.
+    if IMU.detectedIMU().magCalibration is not None:
+        MAGx, MAGy, MAGz = IMU.correctMAG((MAGx, MAGy, MAGz))
+    else:
+        MAGx -= (magXmin + magXmax) /2
+        MAGy -= (magYmin + magYmax) /2
+        MAGz -= (magZmin + magZmax) /2
 
     ##Calculate loop Period(LP). How long between Gyro Reads
     b = datetime.datetime.now() - a
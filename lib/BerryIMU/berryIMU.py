@@ -20,6 +20,7 @@
 import time
 import math
 import IMU
+from filters import KalmanFilter, ComplementaryFilter
 import datetime
 import os
 import sys
@@ -32,7 +33,8 @@ AA =  0.40      # Complementary filter constant
 
 
 ################# Compass Calibration values ############
-# Use calibrateBerryIMU.py to get calibration values
+# Use calibrateBerryIMU.py to get calibration values. It saves them to a profile
+# (state/mag_calibration.json in the repository root) that is used instead of the values below.
 # Calibrating the compass isnt mandatory, however a calibrated
 # compass will result in a more accurate heading value.
 
@@ -61,92 +63,12 @@ Dont use the above values, these are just an example.
 Q_angle = 0.02
 Q_gyro = 0.0015
 R_angle = 0.005
-y_bias = 0.0
-x_bias = 0.0
-XP_00 = 0.0
-XP_01 = 0.0
-XP_10 = 0.0
-XP_11 = 0.0
-YP_00 = 0.0
-YP_01 = 0.0
-YP_10 = 0.0
-YP_11 = 0.0
-KFangleX = 0.0
-KFangleY = 0.0
 
-
-
-
-def kalmanFilterY ( accAngle, gyroRate, DT):
-    y=0.0
-    S=0.0
-
-    global KFangleY
-    global Q_angle
-    global Q_gyro
-    global y_bias
-    global YP_00
-    global YP_01
-    global YP_10
-    global YP_11
-
-    KFangleY = KFangleY + DT * (gyroRate - y_bias)
-
-    YP_00 = YP_00 + ( - DT * (YP_10 + YP_01) + Q_angle * DT )
-    YP_01 = YP_01 + ( - DT * YP_11 )
-    YP_10 = YP_10 + ( - DT * YP_11 )
-    YP_11 = YP_11 + ( + Q_gyro * DT )
-
-    y = accAngle - KFangleY
-    S = YP_00 + R_angle
-    K_0 = YP_00 / S
-    K_1 = YP_10 / S
-
-    KFangleY = KFangleY + ( K_0 * y )
-    y_bias = y_bias + ( K_1 * y )
-
-    YP_00 = YP_00 - ( K_0 * YP_00 )
-    YP_01 = YP_01 - ( K_0 * YP_01 )
-    YP_10 = YP_10 - ( K_1 * YP_00 )
-    YP_11 = YP_11 - ( K_1 * YP_01 )
-
-    return KFangleY
-
-def kalmanFilterX ( accAngle, gyroRate, DT):
-    x=0.0
-    S=0.0
-
-    global KFangleX
-    global Q_angle
-    global Q_gyro
-    global x_bias
-    global XP_00
-    global XP_01
-    global XP_10
-    global XP_11
-
-
-    KFangleX = KFangleX + DT * (gyroRate - x_bias)
-
-    XP_00 = XP_00 + ( - DT * (XP_10 + XP_01) + Q_angle * DT )
-    XP_01 = XP_01 + ( - DT * XP_11 )
-    XP_10 = XP_10 + ( - DT * XP_11 )
-    XP_11 = XP_11 + ( + Q_gyro * DT )
-
-    x = accAngle - KFangleX
-    S = XP_00 + R_angle
-    K_0 = XP_00 / S
-    K_1 = XP_10 / S
-
-    KFangleX = KFangleX + ( K_0 * x )
-    x_bias = x_bias + ( K_1 * x )
-
-    XP_00 = XP_00 - ( K_0 * XP_00 )
-    XP_01 = XP_01 - ( K_0 * XP_01 )
-    XP_10 = XP_10 - ( K_1 * XP_00 )
-    XP_11 = XP_11 - ( K_1 * XP_01 )
-
-    return KFangleX
+#The filters keep their own state; see filters.py
+kalmanFilterX = KalmanFilter(Q_angle, Q_gyro, R_angle)
+kalmanFilterY = KalmanFilter(Q_angle, Q_gyro, R_angle)
+complementaryFilterX = ComplementaryFilter(AA)
+complementaryFilterY = ComplementaryFilter(AA)
 
 
 IMU.detectIMU()     #Detect if BerryIMU is connected.
@@ -180,10 +102,14 @@ while True:
     MAGz = IMU.readMAGz()
 
 
-    #Apply compass calibration
-    MAGx -= (magXmin + magXmax) /2
-    MAGy -= (magYmin + magYmax) /2
-    MAGz -= (magZmin + magZmax) /2
+    #Apply compass calibration. The profile saved by calibrateBerryIMU.py is loaded by
+    #IMU.detectIMU(); without one, the values above are used.
+    if IMU.detectedIMU().magCalibration is not None:
+        MAGx, MAGy, MAGz = IMU.correctMAG((MAGx, MAGy, MAGz))
+    else:
+        MAGx -= (magXmin + magXmax) /2
+        MAGy -= (magYmin + magYmax) /2
+        MAGz -= (magZmin + magZmax) /2
 
 
     ##Calculate loop Period(LP). How long between Gyro Reads
@@ -219,12 +145,12 @@ while True:
 
 
     #Complementary filter used to combine the accelerometer and gyro values.
-    CFangleX=AA*(CFangleX+rate_gyr_x*LP) +(1 - AA) * AccXangle
-    CFangleY=AA*(CFangleY+rate_gyr_y*LP) +(1 - AA) * AccYangle
+    CFangleX = complementaryFilterX.update(AccXangle, rate_gyr_x, LP)
+    CFangleY = complementaryFilterY.update(AccYangle, rate_gyr_y, LP)
 
     #Kalman filter used to combine the accelerometer and gyro values.
-    kalmanY = kalmanFilterY(AccYangle, rate_gyr_y,LP)
-    kalmanX = kalmanFilterX(AccXangle, rate_gyr_x,LP)
+    kalmanY = kalmanFilterY.update(AccYangle, rate_gyr_y, LP)
+    kalmanX = kalmanFilterX.update(AccXangle, rate_gyr_x, LP)
 
 
     #Calculate heading
@@ -2,14 +2,18 @@
 #   This script is used to calibrate the compass on a BerryIMU.
 #
 #   Start this program and rotate your BerryIMU in all directions.
-#   You will see the maximum and minimum values change.
+#   You will see the coverage of each axis go up and the offsets settle.
 #   After about 30secs or when the values are not changing, press Ctrl-C.
-#   The script will printout some text which you then need to add to
-#   berryIMU.py or berryIMU-simple.py
+#   The calibration is saved to a profile (state/mag_calibration.json in the
+#   repository root by default) that IMU.detectIMU() loads, so berryIMU.py,
+#   berryIMU-simple.py and the canary pick it up without editing any constants.
+#   The min/max values are still printed for older copies of berryIMU.py.
 #
-#   The BerryIMUv1, BerryIMUv2 and BerryIMUv3 are supported
+#   Run it as a module from the repository root:
+#
+#       python3 -m lib.BerryIMU.calibrateBerryIMU [--output PATH] [--hard-iron-only] [--seconds N]
 #
-#   This script is python 2.7 and 3 compatible
+#   The BerryIMUv1, BerryIMUv2 and BerryIMUv3 are supported
 #
 #   Feel free to do whatever you like with this code.
 #   Distributed as-is; no warranty is given.
@@ -17,72 +21,73 @@
 #   http://ozzmaker.com/
 
 
-import sys,signal,os
+import sys,signal
 import time
-import math
+import argparse
 
-import IMU
-import datetime
+from . import IMU
+from .magcal import MagCalibrator, saveMagCalibration, MAG_CALIBRATION_FILE
 
 
-def handle_ctrl_c(signal, frame):
-    print(" ")
-    print("magXmin = %i"%  (magXmin))
-    print("magYmin = %i"%  (magYmin))
-    print("magZmin = %i"%  (magZmin))
-    print("magXmax = %i"%  (magXmax))
-    print("magYmax = %i"%  (magYmax))
-    print("magZmax = %i"%  (magZmax))
-    sys.exit(130) # 130 is standard exit code for ctrl-c
+parser = argparse.ArgumentParser(description="Calibrate the BerryIMU compass")
+parser.add_argument('--output', default=MAG_CALIBRATION_FILE, help="calibration profile to write")
+parser.add_argument('--hard-iron-only', action='store_true', help="only correct the offset, not the scale")
+parser.add_argument('--seconds', type=float, default=None, help="stop after this long instead of at Ctrl-C")
+args = parser.parse_args()
 
 
+stopping = False
 
-IMU.detectIMU()
-IMU.initIMU()
-
-#This will capture exit when using Ctrl-C
-signal.signal(signal.SIGINT, handle_ctrl_c)
+def handle_ctrl_c(signal, frame):
+    global stopping
+    stopping = True
 
 
-a = datetime.datetime.now()
 
+imu = IMU.detectIMU(mag_calibration=None)   #Calibrate from raw readings, not from an older profile
+if imu is None:
+    print("No BerryIMU found")
+    sys.exit(1)
+imu.initIMU()
 
-#Preload the variables used to keep track of the minimum and maximum values
-magXmin = 32767
-magYmin = 32767
-magZmin = 32767
-magXmax = -32767
-magYmax = -32767
-magZmax = -32767
+#This will capture exit when using Ctrl-C
+signal.signal(signal.SIGINT, handle_ctrl_c)
 
 
+#Only running sums are kept, so the calibration can run for as long as needed
+calibrator = MagCalibrator()
+started = time.time()
 
-while True:
+while not stopping and (args.seconds is None or time.time() - started < args.seconds):
 
     #Read magnetometer values
-    MAGx = IMU.readMAGx()
-    MAGy = IMU.readMAGy()
-    MAGz = IMU.readMAGz()
-
-    if MAGx > magXmax:
-        magXmax = MAGx
-    if MAGy > magYmax:
-        magYmax = MAGy
-    if MAGz > magZmax:
-        magZmax = MAGz
-
-    if MAGx < magXmin:
-        magXmin = MAGx
-    if MAGy < magYmin:
-        magYmin = MAGy
-    if MAGz < magZmin:
-        magZmin = MAGz
-
-    print((" magXmin  %i  magYmin  %i  magZmin  %i  ## magXmax  %i  magYmax  %i  magZmax %i  " %(magXmin,magYmin,magZmin,magXmax,magYmax,magZmax)))
-
+    calibrator.update(imu.readMAG())
 
+    coverage = calibrator.coverage()
+    print((" samples  %i  coverage  X %3.0f%%  Y %3.0f%%  Z %3.0f%%  ## min  %i  %i  %i  max  %i  %i  %i  " %
+           (calibrator.samples, coverage[0] * 100, coverage[1] * 100, coverage[2] * 100,
+            calibrator.minimum[0], calibrator.minimum[1], calibrator.minimum[2],
+            calibrator.maximum[0], calibrator.maximum[1], calibrator.maximum[2])))
 
     #slow program down a bit, makes the output more readable
     time.sleep(0.03)
 
 
+print(" ")
+calibration = calibrator.solve(softIron=not args.hard_iron_only)
+if calibration is None:
+    print("Not enough data: rotate the BerryIMU in all directions until every axis shows a high coverage")
+    sys.exit(1)
+
+saveMagCalibration(calibration, imu, args.output)
+print("Saved %s calibration from %i samples to %s" % (calibration['method'], calibration['samples'], args.output))
+print("offset  %.1f  %.1f  %.1f" % tuple(calibration['offset']))
+print("scale   %.3f  %.3f  %.3f" % tuple(calibration['scale']))
+print(" ")
+print("magXmin = %i"%  (calibrator.minimum[0]))
+print("magYmin = %i"%  (calibrator.minimum[1]))
+print("magZmin = %i"%  (calibrator.minimum[2]))
+print("magXmax = %i"%  (calibrator.maximum[0]))
+print("magYmax = %i"%  (calibrator.maximum[1]))
+print("magZmax = %i"%  (calibrator.maximum[2]))
+sys.exit(130 if stopping else 0) # 130 is standard exit code for ctrl-c
@@ -0,0 +1,202 @@
+#   Block filters for BerryIMU samples.
+#
+#   The Kalman and complementary filters of berryIMU.py, with their state kept per
+#   instance and able to process a whole block of samples (e.g. one FIFO read) per
+#   call. Both reduce to linear recurrences once their gains are constant, which
+#   LinearFilter evaluates with matrix products instead of a Python loop per sample.
+#
+#       kalmanX = KalmanFilter()
+#       angles = kalmanX.update(accAngles, gyroRates, 1.0 / 52)    #arrays in, array out
+#       angle = kalmanX.update(accAngle, gyroRate, LP)             #scalars in, scalar out
+#
+#   Single Python floats, as berryIMU.py passes once per loop, skip NumPy altogether:
+#   for one sample its call overhead costs far more than the arithmetic.
+
+import numpy as np
+
+
+SCALAR = (int, float)       #Python numbers, including np.float64, taken by the plain Python path
+
+
+class LinearFilter:
+    # x[n] = A x[n-1] + B u[n] for a block of inputs u shaped (n, inputs), or
+    # (n, inputs, channels) to run independent channels (e.g. axes) through the same
+    # system with a state shaped (states, channels). The response is evaluated in
+    # chunks with one matrix product each: the initial state decays through powers of
+    # A, and the inputs go through the lower triangular Toeplitz matrix of the impulse
+    # responses A^k B.
+
+    def __init__(self, A, B, state=None, chunk=128):
+        self.chunk = chunk
+        self.state = np.zeros(np.atleast_2d(A).shape[0]) if state is None else np.array(state, dtype=np.float64)
+        self.setCoefficients(A, B)
+
+    def setCoefficients(self, A, B):
+        # Changes A and B, keeping the state
+        self.A = np.atleast_2d(np.asarray(A, dtype=np.float64))
+        self.B = np.atleast_2d(np.asarray(B, dtype=np.float64))
+        self.length = 0
+        self.decay = None
+        self.toeplitz = None
+
+    def _extend(self, length):
+        #For blocks of up to length samples, with samples and states flattened in order:
+        #decay[n*s + i, :] = row i of A^(n+1), and toeplitz[n*s + i, k*m + j] = (A^(n-k) B)[i, j]
+        #for k <= n. Shorter blocks use the top left corner of both.
+        if self.length >= length:
+            return
+        states, inputs = self.B.shape
+        powers = [np.eye(states)]
+        for _ in range(length):
+            powers.append(powers[-1] @ self.A)
+        powers = np.array(powers)
+        impulse = powers[:length] @ self.B
+        lag = np.subtract.outer(np.arange(length), np.arange(length))
+        toeplitz = np.where((lag >= 0)[:, :, None, None], impulse[np.maximum(lag, 0)], 0.0)
+        self.toeplitz = np.ascontiguousarray(toeplitz.transpose(0, 2, 1, 3)).reshape(length * states, length * inputs)
+        self.decay = powers[1:].reshape(length * states, states)
+        self.length = length
+
+    def process(self, u):
+        # Returns the states after each input, shaped (n, states) or (n, states, channels)
+        u = np.asarray(u, dtype=np.float64)
+        if u.ndim == 1:
+            u = u[:, None]
+        if len(u) > self.chunk:
+            return np.concatenate([self.process(u[start:start + self.chunk])
+                                   for start in range(0, len(u), self.chunk)])
+
+        length = len(u)
+        states, inputs = self.B.shape
+        self._extend(length)
+        channels = u.shape[2:]
+        out = (self.decay[:length * states] @ self.state +
+               self.toeplitz[:length * states, :length * inputs] @ u.reshape((length * inputs,) + channels))
+        out = out.reshape((length, states) + channels)
+        self.state = out[-1]
+        return out
+
+
+class ComplementaryFilter:
+    # angle = AA * (angle + gyroRate * DT) + (1 - AA) * accAngle, as in berryIMU.py.
+    # AA is the weight of the gyro; DT may be a scalar or one period per sample.
+
+    def __init__(self, AA=0.40, angle=0.0):
+        self.AA = AA
+        self.filter = LinearFilter([[AA]], [[1.0]], [angle])
+
+    @property
+    def angle(self):
+        return float(self.filter.state[0])
+
+    @angle.setter
+    def angle(self, value):
+        self.filter.state = np.array([value], dtype=np.float64)
+
+    def update(self, accAngle, gyroRate, DT):
+        if isinstance(accAngle, SCALAR) and isinstance(gyroRate, SCALAR) and isinstance(DT, SCALAR):
+            angle = self.AA * (float(self.filter.state[0]) + gyroRate * DT) + (1 - self.AA) * accAngle
+            self.filter.state[0] = angle
+            return angle
+
+        scalar = np.ndim(accAngle) == 0
+        u = self.AA * np.asarray(gyroRate, dtype=np.float64) * DT + (1 - self.AA) * np.asarray(accAngle)
+        angles = self.filter.process(np.atleast_1d(u))[:, 0]
+        return float(angles[0]) if scalar else angles
+
+
+class KalmanFilter:
+    # Angle/gyro bias Kalman filter of berryIMU.py (kalmanFilterX and kalmanFilterY).
+    # The covariance depends only on DT, so with a constant DT it settles to fixed
+    # gains after a while. Until then, or while DT varies, samples are processed one
+    # at a time exactly as in berryIMU.py; after that each block is one LinearFilter call.
+    # Angles and rates shaped (n, axes) filter several axes at once: they share the
+    # covariance, since it does not depend on the data.
+
+    def __init__(self, Q_angle=0.02, Q_gyro=0.0015, R_angle=0.005):
+        self.Q_angle = Q_angle
+        self.Q_gyro = Q_gyro
+        self.R_angle = R_angle
+        self.angle = 0.0
+        self.bias = 0.0
+        self.P = [0.0, 0.0, 0.0, 0.0]   #P_00, P_01, P_10, P_11
+        self.gains = None               #(K_0, K_1) of the previous step
+        self.steadyDT = None            #DT the gains have settled for
+        self.steadyFilter = None
+
+    def _step(self, accAngle, gyroRate, DT):
+        P_00, P_01, P_10, P_11 = self.P
+        self.angle = self.angle + DT * (gyroRate - self.bias)
+
+        P_00 = P_00 + ( - DT * (P_10 + P_01) + self.Q_angle * DT )
+        P_01 = P_01 + ( - DT * P_11 )
+        P_10 = P_10 + ( - DT * P_11 )
+        P_11 = P_11 + ( + self.Q_gyro * DT )
+
+        y = accAngle - self.angle
+        S = P_00 + self.R_angle
+        K_0 = P_00 / S
+        K_1 = P_10 / S
+
+        self.angle = self.angle + ( K_0 * y )
+        self.bias = self.bias + ( K_1 * y )
+
+        #Same update order as berryIMU.py: P_10 and P_11 use the already updated P_00 and P_01
+        P_00 = P_00 - ( K_0 * P_00 )
+        P_01 = P_01 - ( K_0 * P_01 )
+        P_10 = P_10 - ( K_1 * P_00 )
+        P_11 = P_11 - ( K_1 * P_01 )
+        self.P = [P_00, P_01, P_10, P_11]
+
+        #Gains have settled once a step leaves them unchanged
+        if self.steadyDT != DT and self.gains is not None and \
+                abs(K_0 - self.gains[0]) < 1e-12 and abs(K_1 - self.gains[1]) < 1e-12:
+            self.steadyDT = DT
+            A = [[1 - K_0, -(1 - K_0) * DT], [-K_1, 1 + K_1 * DT]]
+            B = [[K_0, (1 - K_0) * DT], [K_1, -K_1 * DT]]
+            self.steadyFilter = LinearFilter(A, B)
+        self.gains = (K_0, K_1)
+        return self.angle
+
+    def update(self, accAngle, gyroRate, DT):
+        if isinstance(accAngle, SCALAR) and isinstance(gyroRate, SCALAR) and isinstance(DT, SCALAR):
+            #One sample: a plain step, which also keeps the covariance at its settled value
+            if self.steadyDT is not None and DT != self.steadyDT:
+                self.steadyDT = None
+                self.steadyFilter = None
+            return self._step(float(accAngle), float(gyroRate), float(DT))
+
+        scalar = np.ndim(accAngle) == 0
+        if not scalar and np.ndim(DT) == 0 and DT == self.steadyDT:
+            #Settled gains and a constant DT: the whole block in one go
+            u = np.empty((len(accAngle), 2) + np.shape(accAngle)[1:])
+            u[:, 0] = accAngle
+            u[:, 1] = gyroRate
+            self.steadyFilter.state = np.array([self.angle, self.bias])
+            states = self.steadyFilter.process(u)
+            self.angle, self.bias = states[-1]
+            return states[:, 0]
+
+        accAngle = np.atleast_1d(np.asarray(accAngle, dtype=np.float64))
+        gyroRate = np.broadcast_to(np.asarray(gyroRate, dtype=np.float64), accAngle.shape)
+        DT = np.broadcast_to(np.asarray(DT, dtype=np.float64), accAngle.shape[:1])
+
+        angles = np.empty(accAngle.shape)
+        i = 0
+        while i < len(accAngle):
+            if self.steadyDT is not None and DT[i] == self.steadyDT:
+                #Run the longest stretch at the settled DT through the linear filter
+                other = np.flatnonzero(DT[i:] != self.steadyDT)
+                end = len(DT) if len(other) == 0 else i + other[0]
+                self.steadyFilter.state = np.array([self.angle, self.bias])
+                states = self.steadyFilter.process(np.stack((accAngle[i:end], gyroRate[i:end]), axis=1))
+                self.angle, self.bias = states[-1]
+                angles[i:end] = states[:, 0]
+                i = end
+            else:
+                if self.steadyDT is not None:
+                    self.steadyDT = None    #DT changed, the covariance moves again
+                    self.steadyFilter = None
+                angles[i] = self._step(accAngle[i], gyroRate[i], float(DT[i]))
+                i += 1
+        return float(angles[0]) if scalar else angles
@@ -0,0 +1,65 @@
+#   Interrupt line backends for the BerryIMU wake-on-motion mode.
+#
+#   The IMU's INT1 output is wired to a Raspberry Pi GPIO pin. GPIOInterruptPin blocks on
+#   that pin with RPi.GPIO; SimulatedInterruptPin follows the INT1 line of an
+#   i2c.SimulatedBus so the same code paths can run off-device.
+
+import threading
+
+from .i2c import SimulatedBus
+
+
+def openInterruptPin(bus, gpio_pin):
+    # Returns the interrupt pin matching the bus backend
+    if isinstance(bus, SimulatedBus):
+        return SimulatedInterruptPin(bus)
+    return GPIOInterruptPin(gpio_pin)
+
+
+class GPIOInterruptPin:
+    # Active-high interrupt input on a BCM numbered GPIO pin
+
+    def __init__(self, gpio_pin):
+        import RPi.GPIO as GPIO
+        self.GPIO = GPIO
+        self.pin = gpio_pin
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(gpio_pin, GPIO.IN, pull_up_down=GPIO.PUD_DOWN)
+
+    def wait(self, timeout):
+        # Blocks until the line is high or timeout seconds pass; returns True if it is high.
+        # The IMU latches its interrupt, so a line that is already high returns immediately.
+        if self.GPIO.input(self.pin):
+            return True
+        return self.GPIO.wait_for_edge(self.pin, self.GPIO.RISING, timeout=max(int(timeout * 1000), 1)) is not None
+
+    def close(self):
+        self.GPIO.cleanup(self.pin)
+
+
+class SimulatedInterruptPin:
+    # Polls the simulated INT1 line every poll_interval seconds. trigger() raises the line
+    # immediately, e.g. to simulate a knock on the car.
+
+    def __init__(self, bus, poll_interval=0.05):
+        self.bus = bus
+        self.poll_interval = poll_interval
+        self.event = threading.Event()
+
+    def trigger(self):
+        self.event.set()
+
+    def wait(self, timeout):
+        remaining = timeout
+        while True:
+            if self.event.is_set() or self.bus.interrupt_active():
+                self.event.clear()
+                return True
+            if remaining <= 0:
+                return False
+            interval = min(self.poll_interval, remaining)
+            self.event.wait(interval)
+            remaining -= interval
+
+    def close(self):
+        pass
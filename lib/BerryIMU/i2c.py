@@ -0,0 +1,284 @@
+#   I2C bus backends for the BerryIMU driver.
+#
+#   openBus() returns either a real smbus.SMBus or a SimulatedBus, which emulates a
+#   BerryIMUv3 (LSM6DSL and LIS3MDL) well enough for IMU.detectIMU(), the vector and
+#   per-axis reads and the LSM6DSL FIFO. The simulated sensors are fed by a motion
+#   source: SyntheticMotion, a simple parked/moving model, or TraceReplay, which plays
+#   back a recorded trace file (CSV, or the binary format of trace.py).
+#
+#   The backend is selected with the BERRYIMU_BUS environment variable:
+#       BERRYIMU_BUS=1                  smbus.SMBus(1), the default
+#       BERRYIMU_BUS=sim                SimulatedBus(SyntheticMotion())
+#       BERRYIMU_BUS=sim:trace.csv      SimulatedBus(TraceReplay('trace.csv'))
+#       BERRYIMU_BUS=sim:drive.trace    SimulatedBus(TraceReplay('drive.trace'))
+
+import errno
+import math
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+from .LSM6DSL import *
+from .LIS3MDL import *
+from .trace import isTrace, openTrace
+
+
+TRACE_COLUMNS = ('t', 'acc_x', 'acc_y', 'acc_z', 'gyr_x', 'gyr_y', 'gyr_z', 'mag_x', 'mag_y', 'mag_z')
+
+# Raw sensor units with the ranges set by BerryIMUv3.initIMU()
+ACC_1G = 4098           # +/- 8 g, 0.244 mg/LSB
+GYR_1DPS = 14.3         # 2000 dps, 70 mdps/LSB
+MAG_1GAUSS = 3421       # +/- 8 gauss
+
+
+def openBus(spec=None):
+    # Opens the bus described by spec (see the module comment); defaults to $BERRYIMU_BUS
+    if spec is None:
+        spec = os.environ.get('BERRYIMU_BUS', '1')
+    spec = str(spec)
+
+    if spec == 'sim':
+        return SimulatedBus(SyntheticMotion())
+    if spec.startswith('sim:'):
+        return SimulatedBus(TraceReplay(spec[len('sim:'):]))
+
+    import smbus
+    return smbus.SMBus(int(spec))
+
+
+class SyntheticMotion:
+    # Motion model that alternates between parked and moving phases.
+    #
+    # schedule is a list of (seconds, 'parked' | 'moving') phases, played in a loop.
+    # Parked: gravity on Z plus sensor noise. Moving: gravity plus road vibration, surging
+    # acceleration/braking (in g), slow turns (in degrees) that rotate the magnetometer heading
+    # and the body pitching and rolling on the road (peak rate in degrees per second).
+
+    def __init__(self, schedule=((30, 'parked'), (30, 'moving')), noise=4, vibration=400, surge=0.3,
+                 turn=40, rock=4, seed=0):
+        self.schedule = [(float(duration), state) for duration, state in schedule]
+        self.period = sum(duration for duration, _ in self.schedule)
+        self.noise = noise
+        self.vibration = vibration
+        self.surge = surge
+        self.turn = turn
+        self.rock = rock
+        self.rng = np.random.default_rng(seed)
+
+    def state_at(self, t):
+        # Returns 'parked' or 'moving' for time t (seconds since the start of the schedule)
+        t = t % self.period
+        for duration, state in self.schedule:
+            if t < duration:
+                return state
+            t -= duration
+        return self.schedule[-1][1]
+
+    def sample(self, t):
+        # Returns raw (ACCx, ACCy, ACCz, GYRx, GYRy, GYRz, MAGx, MAGy, MAGz) at time t
+        acc = np.array([0.0, 0.0, ACC_1G])
+        gyr = np.zeros(3)
+        heading = 0.0
+        noise = self.noise
+
+        if self.state_at(t) == 'moving':
+            acc[0] += self.surge * ACC_1G * math.sin(2 * math.pi * t / 12)
+            noise = self.vibration
+            # Sinusoidal turns keep the heading bounded; the gyro reports its derivative
+            heading = self.turn * math.sin(2 * math.pi * t / 90)
+            gyr[2] = self.turn * 2 * math.pi / 90 * math.cos(2 * math.pi * t / 90)
+            gyr[0] = self.rock * math.sin(2 * math.pi * t / 2.3)
+            gyr[1] = self.rock * math.sin(2 * math.pi * t / 1.7)
+
+        acc += self.rng.normal(0, noise, 3)
+        gyr = gyr * GYR_1DPS + self.rng.normal(0, 3, 3)
+        mag = 0.25 * MAG_1GAUSS * np.array([math.cos(math.radians(heading)),
+                                            -math.sin(math.radians(heading)),
+                                            -1.6])
+        mag += self.rng.normal(0, 6, 3)
+
+        return tuple(int(np.clip(round(v), -32768, 32767)) for v in np.concatenate((acc, gyr, mag)))
+
+
+class TraceReplay:
+    # Plays back a recorded trace: a binary trace (see trace.py) or a CSV file with a
+    # TRACE_COLUMNS header, timestamps in seconds and raw sensor values. The trace loops
+    # when loop is True, otherwise the last sample is held.
+
+    def __init__(self, path, loop=True):
+        if isTrace(path):
+            trace = openTrace(path)
+            if len(trace) == 0:
+                raise ValueError(f"{path}: trace has no samples")
+            self.times = trace['t'] - trace['t'][0]
+            self.values = np.concatenate((trace['acc'], trace['gyr'], trace['mag']), axis=1)
+        else:
+            data = np.loadtxt(path, delimiter=',', skiprows=1, ndmin=2)
+            if data.shape[1] != len(TRACE_COLUMNS):
+                raise ValueError(f"{path}: expected columns {','.join(TRACE_COLUMNS)}")
+            self.times = data[:, 0] - data[0, 0]
+            self.values = data[:, 1:].astype(np.int16)
+        self.loop = loop
+        self.period = self.times[-1] + (self.times[-1] / max(len(self.times) - 1, 1))
+
+    def sample(self, t):
+        if self.loop and self.period > 0:
+            t = t % self.period
+        index = np.searchsorted(self.times, t, side='right') - 1
+        return tuple(int(v) for v in self.values[max(index, 0)])
+
+
+class SimulatedBus:
+    # Emulates the smbus.SMBus calls used by the BerryIMU driver for a BerryIMUv3.
+    # Output registers are refreshed from source.sample(t) on every read, where t is the
+    # number of seconds since the bus was created according to clock.
+
+    FIFO_RATES = {0b0001: 12.5, 0b0010: 26, 0b0011: 52, 0b0100: 104, 0b0101: 208,
+                  0b0110: 416, 0b0111: 833, 0b1000: 1660, 0b1001: 3330, 0b1010: 6660}
+    FIFO_WORDS = 2048
+
+    def __init__(self, source, clock=time.monotonic):
+        self.source = source
+        self.clock = clock
+        self.start_time = clock()
+        self.lock = threading.Lock()
+        self.registers = {LSM6DSL_ADDRESS: bytearray(256), LIS3MDL_ADDRESS: bytearray(256)}
+        self.registers[LSM6DSL_ADDRESS][LSM6DSL_WHO_AM_I] = 0x6A
+        self.registers[LSM6DSL_ADDRESS][LSM6DSL_CTRL3_C] = 0b00000100        # IF_INC is set at reset
+        self.registers[LIS3MDL_ADDRESS][LIS3MDL_WHO_AM_I] = 0x3D
+
+        self.fifo = deque()
+        self.fifo_time = None       # Simulated time of the last sample pushed into the FIFO
+        self.fifo_pattern = 0       # Index of the next word within a FIFO sample
+
+        self.wake_up_latched = False
+        self.last_acc = None        # Previous accelerometer sample, for the wake-up slope filter
+
+    def now(self):
+        return self.clock() - self.start_time
+
+    def _device(self, address):
+        if address not in self.registers:
+            raise OSError(errno.EREMOTEIO, "Remote I/O error")
+        return self.registers[address]
+
+    def _fifo_config(self):
+        regs = self.registers[LSM6DSL_ADDRESS]
+        rate = self.FIFO_RATES.get((regs[LSM6DSL_FIFO_CTRL5] >> 3) & 0x0F)
+        mode = regs[LSM6DSL_FIFO_CTRL5] & 0x07
+        words = 3 * (((regs[LSM6DSL_FIFO_CTRL3] & 0x07) != 0) + (((regs[LSM6DSL_FIFO_CTRL3] >> 3) & 0x07) != 0))
+        return rate, mode, words
+
+    def _fill_fifo(self):
+        # Push every sample the FIFO would have collected since the last fill
+        rate, mode, words = self._fifo_config()
+        if rate is None or mode != 0b110 or words == 0:
+            self.fifo.clear()
+            self.fifo_time = None
+            return
+
+        now = self.now()
+        if self.fifo_time is None:
+            self.fifo_time = now
+            return
+
+        count = int((now - self.fifo_time) * rate)
+        capacity = self.FIFO_WORDS // words
+        if count > capacity:
+            # Older samples would already have been overwritten, only generate the ones still held
+            self.fifo_time += (count - capacity) / rate
+            count = capacity
+        gyro = words == 6
+        for i in range(count):
+            t = self.fifo_time + (i + 1) / rate
+            sample = self.source.sample(t)
+            self.fifo.extend(sample[3:6] + sample[0:3] if gyro else sample[0:3])
+        self.fifo_time += count / rate
+
+        # Continuous mode: the oldest samples are overwritten when the FIFO is full
+        while len(self.fifo) > self.FIFO_WORDS:
+            for _ in range(words):
+                self.fifo.popleft()
+
+    def _read_fifo_word(self):
+        _, _, words = self._fifo_config()
+        word = self.fifo.popleft() if self.fifo else 0
+        self.fifo_pattern = (self.fifo_pattern + 1) % max(words, 1)
+        return word & 0xFFFF
+
+    def _refresh_outputs(self):
+        sample = self.source.sample(self.now())
+        acc_gyr = self.registers[LSM6DSL_ADDRESS]
+        mag = self.registers[LIS3MDL_ADDRESS]
+        for i, value in enumerate(sample[3:6] + sample[0:3]):
+            # Gyro at OUTX_L_G (0x22), accelerometer directly after it at OUTX_L_XL (0x28)
+            acc_gyr[LSM6DSL_OUTX_L_G + 2 * i] = value & 0xFF
+            acc_gyr[LSM6DSL_OUTX_L_G + 2 * i + 1] = (value >> 8) & 0xFF
+        for i, value in enumerate(sample[6:9]):
+            mag[LIS3MDL_OUT_X_L + 2 * i] = value & 0xFF
+            mag[LIS3MDL_OUT_X_L + 2 * i + 1] = (value >> 8) & 0xFF
+
+    def write_byte_data(self, address, register, value):
+        with self.lock:
+            regs = self._device(address)
+            regs[register & 0x7F] = value & 0xFF
+            if address == LSM6DSL_ADDRESS and register in (LSM6DSL_FIFO_CTRL3, LSM6DSL_FIFO_CTRL5):
+                self.fifo.clear()
+                self.fifo_time = None
+                self.fifo_pattern = 0
+                self._fill_fifo()
+
+    def interrupt_active(self):
+        # Level of the LSM6DSL INT1 line. Wake-up compares the slope between consecutive
+        # accelerometer samples with WAKE_UP_THS (full scale / 64 per LSB) and latches.
+        with self.lock:
+            regs = self.registers[LSM6DSL_ADDRESS]
+            if not (regs[LSM6DSL_TAP_CFG] & 0x80) or not (regs[LSM6DSL_MD1_CFG] & 0x20):
+                self.last_acc = None
+                return False
+
+            acc = self.source.sample(self.now())[0:3]
+            if self.last_acc is not None:
+                threshold = (regs[LSM6DSL_WAKE_UP_THS] & 0x3F) * (8 * ACC_1G) / 64
+                if max(abs(a - b) for a, b in zip(acc, self.last_acc)) > threshold:
+                    self.wake_up_latched = True
+            self.last_acc = acc
+            return self.wake_up_latched
+
+    def read_byte_data(self, address, register):
+        return self.read_i2c_block_data(address, register, 1)[0]
+
+    def read_i2c_block_data(self, address, register, length):
+        with self.lock:
+            regs = self._device(address)
+            if address == LIS3MDL_ADDRESS:
+                register &= 0x7F        # Auto-increment bit
+
+            if address == LSM6DSL_ADDRESS and register == LSM6DSL_FIFO_DATA_OUT_L:
+                # Address rolls back to FIFO_DATA_OUT_L, every word pair is the next FIFO word
+                out = []
+                for _ in range(length // 2):
+                    word = self._read_fifo_word()
+                    out += [word & 0xFF, word >> 8]
+                return out
+
+            if address == LSM6DSL_ADDRESS and register == LSM6DSL_FIFO_STATUS1:
+                self._fill_fifo()
+                unread = len(self.fifo)
+                regs[LSM6DSL_FIFO_STATUS1] = unread & 0xFF
+                regs[LSM6DSL_FIFO_STATUS2] = ((unread >> 8) & 0x07) | (0x10 if unread == 0 else 0)
+                regs[LSM6DSL_FIFO_STATUS3] = self.fifo_pattern & 0xFF
+                regs[LSM6DSL_FIFO_STATUS4] = (self.fifo_pattern >> 8) & 0x03
+            elif address == LSM6DSL_ADDRESS and register == LSM6DSL_WAKE_UP_SRC:
+                regs[LSM6DSL_WAKE_UP_SRC] = 0b00001000 if self.wake_up_latched else 0
+                self.wake_up_latched = False
+            else:
+                self._refresh_outputs()
+
+            return list(regs[register:register + length])
+
+    def close(self):
+        pass
@@ -0,0 +1,118 @@
+#   Magnetometer calibration for the BerryIMU.
+#
+#   Hard iron (magnets and magnetised steel near the compass) shifts the readings by a
+#   fixed offset; soft iron (nearby unmagnetised steel) stretches them differently along
+#   each axis. Rotated in every direction, the raw readings of a calibrated compass lie on
+#   a sphere around the origin; uncorrected they lie on an axis aligned ellipsoid.
+#
+#   MagCalibrator fits that ellipsoid while the samples stream in, keeping only running
+#   sums (constant memory however long the calibration runs), and falls back to the
+#   min/max method of calibrateBerryIMU.py when the fit is not possible. The result is
+#   saved to a profile that detectIMU() loads, so each driver corrects its own compass:
+#
+#       MAGx, MAGy, MAGz = imu.correctMAG(imu.readMAG())
+
+import json
+import time
+import numpy as np
+from .statefile import statePath, saveJSON
+
+
+MAG_CALIBRATION_FILE = statePath('mag_calibration.json')
+
+#Fits are only trusted once the readings cover most of the sphere: each axis must have
+#been seen at both ends of its range, i.e. the IMU was turned over in every direction
+MIN_SAMPLES = 200
+MIN_COVERAGE = 0.5          #Fraction of the largest axis range each axis must span
+
+
+
+class MagCalibrator:
+    #Accumulates raw magnetometer readings and solves for the hard iron offset and the soft
+    #iron scale of each axis.
+    #
+    #The ellipsoid a*x^2 + b*y^2 + c*z^2 + d*x + e*y + f*z = 1 is fitted by least squares;
+    #its normal equations only need the sums of the products of those six terms, which are
+    #updated per block of samples.
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.samples = 0
+        self.normal = np.zeros((6, 6))      #Sum of the outer products of the ellipsoid terms
+        self.rhs = np.zeros(6)              #Sum of the ellipsoid terms
+        self.minimum = np.full(3, np.inf)
+        self.maximum = np.full(3, -np.inf)
+
+    def update(self, mag):
+        #Adds one (MAGx, MAGy, MAGz) reading or a block of readings shaped (n, 3)
+        mag = np.atleast_2d(np.asarray(mag, dtype=np.float64))
+        terms = np.concatenate((mag ** 2, mag), axis=1)
+        self.normal += terms.T @ terms
+        self.rhs += terms.sum(axis=0)
+        self.minimum = np.minimum(self.minimum, mag.min(axis=0))
+        self.maximum = np.maximum(self.maximum, mag.max(axis=0))
+        self.samples += len(mag)
+
+    def coverage(self):
+        #Range of each axis as a fraction of the largest one; near 1 once the IMU has been
+        #turned in every direction
+        if self.samples == 0:
+            return np.zeros(3)
+        ranges = self.maximum - self.minimum
+        return ranges / max(ranges.max(), 1e-9)
+
+    def minMax(self):
+        #Offset and scale from the extremes of each axis, as in the original calibrateBerryIMU.py
+        offset = (self.minimum + self.maximum) / 2
+        radii = np.maximum((self.maximum - self.minimum) / 2, 1e-9)
+        return offset, radii.mean() / radii
+
+    def ellipsoid(self):
+        #Offset and scale from the least squares ellipsoid, or None if the readings do not
+        #describe one (too few samples, or not turned in every direction)
+        try:
+            a = np.linalg.solve(self.normal, self.rhs)
+        except np.linalg.LinAlgError:
+            return None
+        if np.any(a[:3] <= 0):
+            return None
+        offset = -a[3:] / (2 * a[:3])
+        g = 1 + np.sum(a[:3] * offset ** 2)
+        radii = np.sqrt(g / a[:3])
+        return offset, radii.mean() / radii
+
+    def solve(self, softIron=True):
+        #Returns the calibration as a dict, or None until enough readings have been seen.
+        #Without softIron the scale is left at 1 and only the hard iron offset is corrected.
+        if self.samples < MIN_SAMPLES or np.any(self.coverage() < MIN_COVERAGE):
+            return None
+        method = 'ellipsoid'
+        fit = self.ellipsoid()
+        if fit is None:
+            method = 'minmax'
+            fit = self.minMax()
+        offset, scale = fit
+        if not softIron:
+            scale = np.ones(3)
+        return {'offset': offset.tolist(), 'scale': scale.tolist(), 'method': method,
+                'samples': self.samples, 'min': self.minimum.tolist(), 'max': self.maximum.tolist()}
+
+
+
+def saveMagCalibration(calibration, imu, path=MAG_CALIBRATION_FILE):
+    profile = dict(calibration, version=imu.version, name=imu.name, timestamp=time.time())
+    saveJSON(path, profile, indent=1)
+
+
+def loadMagCalibration(path=MAG_CALIBRATION_FILE):
+    #Returns the saved profile, or None if there is none or it can not be read
+    try:
+        with open(path, 'r') as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if len(profile.get('offset', ())) != 3 or len(profile.get('scale', ())) != 3:
+        return None
+    return profile
@@ -0,0 +1,25 @@
+#   Small JSON files kept between boots, such as the IMU detection cache. By default they
+#   live in the state directory of the repository root, so they are found whatever the
+#   working directory of the script that writes or reads them.
+
+import json
+import os
+
+
+STATE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'state')
+
+
+def statePath(name):
+    #Default location of the state file 'name'
+    return os.path.join(STATE_DIR, name)
+
+
+def saveJSON(path, data, indent=None):
+    #Write through a temporary file so a power cut never leaves a truncated file behind
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(data, f, indent=indent)
+    os.replace(tmp_file, path)
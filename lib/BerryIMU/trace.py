@@ -0,0 +1,154 @@
+#   Compact binary IMU traces.
+#
+#   A trace file is a 32 byte header followed by fixed-width little-endian records of
+#   TRACE_DTYPE: a float64 timestamp (seconds since the epoch) and the raw int16 acc, gyr
+#   and mag vectors, 26 bytes per sample. TraceRecorder appends records; openTrace() maps
+#   a trace with numpy.memmap, so hours of samples can be replayed without loading them.
+#   Traces also play back through the simulated bus: BERRYIMU_BUS=sim:drive.trace
+#
+#   Record from the IMU on the default bus:
+#       python -m lib.BerryIMU.trace record drive.trace --rate 50
+#   Show what a trace holds:
+#       python -m lib.BerryIMU.trace info drive.trace
+
+import argparse
+import os
+import struct
+import time
+
+import numpy as np
+
+
+TRACE_MAGIC = b'BIMUTRC\x00'
+TRACE_VERSION = 1
+TRACE_DTYPE = np.dtype([('t', '<f8'), ('acc', '<i2', (3,)), ('gyr', '<i2', (3,)), ('mag', '<i2', (3,))])
+
+#magic, format version, header size, record size, BerryIMU version, creation time, nominal sample rate (0 if unknown)
+HEADER = struct.Struct('<8sHHHHdf4x')
+
+
+def readHeader(f):
+    # Returns the header fields of an open trace file as a dict
+    f.seek(0)
+    raw = f.read(HEADER.size)
+    if len(raw) < HEADER.size:
+        raise ValueError(f"{f.name}: not an IMU trace (file too short)")
+    magic, version, header_size, record_size, imu_version, created, rate = HEADER.unpack(raw)
+    if magic != TRACE_MAGIC:
+        raise ValueError(f"{f.name}: not an IMU trace")
+    if version != TRACE_VERSION or record_size != TRACE_DTYPE.itemsize:
+        raise ValueError(f"{f.name}: unsupported trace format {version}")
+    return {'version': version, 'header_size': header_size, 'imu': imu_version, 'created': created, 'rate': rate}
+
+
+def isTrace(path):
+    # Whether path starts with the binary trace magic (as opposed to e.g. a CSV trace)
+    with open(path, 'rb') as f:
+        return f.read(len(TRACE_MAGIC)) == TRACE_MAGIC
+
+
+def openTrace(path):
+    # Maps the records of a trace read-only. Returns a structured array of TRACE_DTYPE;
+    # trace['t'] is (n,), trace['acc'], trace['gyr'] and trace['mag'] are (n, 3) views.
+    # A partial record at the end (recording interrupted mid-write) is ignored.
+    with open(path, 'rb') as f:
+        header = readHeader(f)
+    count = (os.path.getsize(path) - header['header_size']) // TRACE_DTYPE.itemsize
+    if count <= 0:
+        return np.empty(0, dtype=TRACE_DTYPE)
+    return np.memmap(path, dtype=TRACE_DTYPE, mode='r', offset=header['header_size'], shape=(count,))
+
+
+class TraceRecorder:
+    # Appends samples to a trace file, creating it with a header if it does not exist.
+    # Records are buffered by the file object; call flush() to push them to disk.
+
+    def __init__(self, path, imu_version=0, rate=0.0):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, 'r+b') as f:
+                header = readHeader(f)
+                #Drop a partial record left by an interrupted recording so appends stay aligned
+                records = (os.path.getsize(path) - header['header_size']) // TRACE_DTYPE.itemsize
+                f.truncate(header['header_size'] + records * TRACE_DTYPE.itemsize)
+            self.file = open(path, 'ab')
+        else:
+            self.file = open(path, 'wb')
+            self.file.write(HEADER.pack(TRACE_MAGIC, TRACE_VERSION, HEADER.size, TRACE_DTYPE.itemsize,
+                                        imu_version, time.time(), rate))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def record(self, t, acc, gyr=(0, 0, 0), mag=(0, 0, 0)):
+        # Appends one sample
+        self.file.write(struct.pack('<d9h', t, *acc, *gyr, *mag))
+
+    def recordBatch(self, t, acc, gyr=None, mag=None):
+        # Appends n samples at once: t is (n,), acc, gyr and mag are (n, 3). Missing sensors are stored as zeros.
+        records = np.zeros(len(t), dtype=TRACE_DTYPE)
+        records['t'] = t
+        records['acc'] = acc
+        if gyr is not None:
+            records['gyr'] = gyr
+        if mag is not None:
+            records['mag'] = mag
+        self.file.write(records.tobytes())
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record or inspect binary BerryIMU traces")
+    commands = parser.add_subparsers(dest='command', required=True)
+    record = commands.add_parser('record', help="record the IMU on $BERRYIMU_BUS until interrupted")
+    record.add_argument('path')
+    record.add_argument('--rate', type=float, default=50.0, help="samples per second")
+    record.add_argument('--seconds', type=float, default=None, help="stop after this many seconds")
+    info = commands.add_parser('info', help="summarise a trace")
+    info.add_argument('path')
+    args = parser.parse_args()
+
+    if args.command == 'info':
+        with open(args.path, 'rb') as f:
+            header = readHeader(f)
+        trace = openTrace(args.path)
+        print(f"BerryIMU version {header['imu']}, {len(trace)} samples, nominal rate {header['rate']:g} Hz")
+        if len(trace):
+            duration = trace['t'][-1] - trace['t'][0]
+            print(f"{time.ctime(trace['t'][0])} to {time.ctime(trace['t'][-1])} ({duration:.1f} s)")
+        return
+
+    from . import IMU
+    imu = IMU.detectIMU()
+    if imu is None:
+        raise SystemExit("No BerryIMU found")
+    imu.initIMU()
+
+    period = 1.0 / args.rate
+    stop_time = None if args.seconds is None else time.time() + args.seconds
+    with TraceRecorder(args.path, imu.version, args.rate) as recorder:
+        next_time = time.time()
+        try:
+            while stop_time is None or next_time < stop_time:
+                acc, gyr, mag = imu.readAll()
+                recorder.record(time.time(), acc, gyr, mag)
+                next_time += period
+                time.sleep(max(next_time - time.time(), 0))
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
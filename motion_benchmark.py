@@ -0,0 +1,251 @@
+from lib.BerryIMU.i2c import SimulatedBus, SyntheticMotion
+from lib.BerryIMU.trace import TRACE_DTYPE
+from motion_features import motion_classifier
+from motion_fusion import fusion_detector
+from motion_monitor import motion_monitor
+import argparse
+import json
+import platform
+import sys
+import threading
+import time
+import numpy as np
+
+# Benchmarks for motion_monitor on the simulated IMU (lib/BerryIMU/i2c.py), so they run anywhere:
+#
+#   replay.<scenario>.*   Processing cost per second of driving and parked/moving detection latency, from replaying a
+#                         synthetic drive through motion_monitor.replay() (simulated time, so latencies are exact
+#                         and fast). The scenarios take different numbers of samples, so cost is per trace second.
+#   poll.*                Wall time of one poll(), i.e. one sample in polling mode, including the simulated I2C reads
+#   live.*                A threaded monitor running for --seconds with a reader polling is_parked(): how long the
+#                         monitor lock is held and waited for, and CPU used by the sampler and dispatcher threads
+#
+# Results are a flat JSON object of metric name to value. Each entry of BUDGETS is an upper limit on one metric; the
+# script exits with status 1 if any is exceeded, so it can gate a release:
+#
+#   python motion_benchmark.py --output bench.json
+
+SCENARIOS = {'polling': {},
+             'fifo': {'use_fifo': True},
+             'classifier': {'use_fifo': True, 'classifier': motion_classifier()},
+             'fusion': {'use_fifo': True, 'fusion': fusion_detector()}}
+
+# Upper limits for a Raspberry Pi; override with --budgets budgets.json
+BUDGETS = {'replay.polling.us_per_trace_second': 5000,
+           'replay.fifo.us_per_trace_second': 5000,
+           'replay.classifier.us_per_trace_second': 20000,
+           'replay.polling.moving_latency_max': 15,
+           'replay.polling.parked_latency_max': 10,
+           'replay.classifier.moving_latency_max': 10,
+           'replay.classifier.parked_latency_max': 10,
+           'replay.classifier.missed': 0,
+           'replay.classifier.false_transitions': 0,
+           'replay.fusion.us_per_trace_second': 20000,
+           'replay.fusion.moving_latency_max': 10,
+           'replay.fusion.parked_latency_max': 10,
+           'replay.fusion.missed': 0,
+           'replay.fusion.false_transitions': 0,
+           'poll.us_p99': 5000,
+           'live.lock_hold_us_p99': 200,
+           'live.lock_wait_us_max': 20000,
+           'live.sampler_cpu_percent': 10,
+           'live.dispatcher_cpu_percent': 1}
+
+
+# Drop-in for the monitor's threading.Lock that records how long each acquisition waited and held the lock
+class timed_lock:
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__acquired = 0.0
+        self.holds = []
+        self.waits = []
+
+    def acquire(self, blocking=True, timeout=-1):
+        start = time.perf_counter()
+        acquired = self.__lock.acquire(blocking, timeout)
+        self.__acquired = time.perf_counter()
+        self.waits.append(self.__acquired - start)
+        return acquired
+
+    def release(self):
+        self.holds.append(time.perf_counter() - self.__acquired)
+        self.__lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+
+
+# Generates a trace array (see lib/BerryIMU/trace.py) of `cycles` parked/moving cycles, and the true transitions
+def synthetic_drive(parked_time=120, moving_time=120, cycles=5, rate=52, seed=0):
+    motion = SyntheticMotion(schedule=((parked_time, 'parked'), (moving_time, 'moving')), seed=seed)
+    times = np.arange(0, cycles * (parked_time + moving_time), 1 / rate)
+    data = np.array([motion.sample(t) for t in times])
+    trace = np.zeros(len(times), dtype=TRACE_DTYPE)
+    trace['t'] = times
+    trace['acc'], trace['gyr'], trace['mag'] = data[:, 0:3], data[:, 3:6], data[:, 6:9]
+
+    truth = []
+    for cycle in range(cycles):
+        start = cycle * (parked_time + moving_time)
+        truth += [(start, True), (start + parked_time, False)]
+    return trace, truth
+
+
+# Matches detected transitions to the true ones: each true transition is detected by the first transition to the same
+# state after it and before the next true transition; every other detected transition is false
+def match_transitions(detected, truth):
+    latencies = {True: [], False: []}
+    missed = 0
+    matched = 0
+    for i, (start, parked) in enumerate(truth):
+        end = truth[i + 1][0] if i + 1 < len(truth) else float('inf')
+        hits = [t for t, state in detected if state == parked and start <= t < end]
+        if hits:
+            latencies[parked].append(hits[0] - start)
+            matched += 1
+        elif i > 0:
+            missed += 1  # The first interval only counts if the initial state was wrong
+    return latencies, missed, len(detected) - matched
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if len(values) else 0.0
+
+
+def bench_replay(results, trace, truth):
+    for name, options in SCENARIOS.items():
+        monitor = motion_monitor(bus=SimulatedBus(SyntheticMotion()), imu_cache=None, profile_path=None,
+                                 mag_calibration=None, **options)
+        start = time.perf_counter()
+        detected = monitor.replay(trace, parked=True)
+        elapsed = time.perf_counter() - start
+        latencies, missed, false = match_transitions(detected, truth)
+
+        prefix = f'replay.{name}.'
+        results[prefix + 'us_per_trace_second'] = elapsed / (trace['t'][-1] - trace['t'][0]) * 1e6
+        results[prefix + 'moving_latency_mean'] = float(np.mean(latencies[False])) if latencies[False] else None
+        results[prefix + 'moving_latency_max'] = max(latencies[False], default=None)
+        results[prefix + 'parked_latency_mean'] = float(np.mean(latencies[True])) if latencies[True] else None
+        results[prefix + 'parked_latency_max'] = max(latencies[True], default=None)
+        results[prefix + 'missed'] = missed
+        results[prefix + 'false_transitions'] = false
+
+
+def bench_poll(results, polls=2000):
+    monitor = motion_monitor(bus=SimulatedBus(SyntheticMotion()), imu_cache=None, profile_path=None,
+                             mag_calibration=None)
+    durations = []
+    for _ in range(polls):
+        start = time.perf_counter()
+        monitor.poll()
+        durations.append(time.perf_counter() - start)
+    durations = np.array(durations) * 1e6
+    results['poll.us_p50'] = percentile(durations, 50)
+    results['poll.us_p99'] = percentile(durations, 99)
+    results['poll.us_max'] = float(durations.max())
+
+
+def thread_cpu_time(name):
+    for thread in threading.enumerate():
+        if thread.name == name:
+            return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+    return None
+
+
+def bench_live(results, seconds):
+    monitor = motion_monitor(bus=SimulatedBus(SyntheticMotion(schedule=((seconds / 2, 'parked'),
+                                                                         (seconds / 2, 'moving')))),
+                             imu_cache=None, profile_path=None, mag_calibration=None, use_fifo=True)
+    lock = timed_lock()
+    monitor._motion_monitor__lock = lock  # Instrument the monitor's private lock
+
+    # A reader checking the state as often as the rest of the canary might, to create contention
+    reading = True
+
+    def reader():
+        while reading:
+            monitor.is_parked()
+            monitor.get_avg_motion()
+            time.sleep(0.001)
+
+    reader_thread = threading.Thread(target=reader)
+    monitor.start(on_parked=lambda: None, on_moving=lambda: None)
+    reader_thread.start()
+    cpu_start = {name: thread_cpu_time(name) for name in ('motion_monitor', 'motion_monitor_events')}
+    wall_start = time.perf_counter()
+    time.sleep(seconds)
+    cpu_end = {name: thread_cpu_time(name) for name in ('motion_monitor', 'motion_monitor_events')}
+    wall = time.perf_counter() - wall_start
+    reading = False
+    reader_thread.join()
+    monitor.stop()
+
+    holds = np.array(lock.holds) * 1e6
+    waits = np.array(lock.waits) * 1e6
+    results['live.lock_acquisitions'] = len(holds)
+    results['live.lock_hold_us_p50'] = percentile(holds, 50)
+    results['live.lock_hold_us_p99'] = percentile(holds, 99)
+    results['live.lock_hold_us_max'] = float(holds.max(initial=0))
+    results['live.lock_wait_us_p99'] = percentile(waits, 99)
+    results['live.lock_wait_us_max'] = float(waits.max(initial=0))
+    results['live.sampler_cpu_percent'] = (cpu_end['motion_monitor'] - cpu_start['motion_monitor']) / wall * 100
+    results['live.dispatcher_cpu_percent'] = \
+        (cpu_end['motion_monitor_events'] - cpu_start['motion_monitor_events']) / wall * 100
+
+
+# Returns a list of (metric, limit, value) for every budget the results exceed. A missing or None value (e.g. a
+# transition that was never detected) counts as exceeded.
+def check_budgets(results, budgets):
+    failures = []
+    for metric, limit in budgets.items():
+        if metric.split('.')[0] not in {name.split('.')[0] for name in results}:
+            continue  # Benchmark group was skipped
+        value = results.get(metric)
+        if value is None or value > limit:
+            failures.append((metric, limit, value))
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark motion_monitor on the simulated IMU")
+    parser.add_argument('--seconds', type=float, default=10, help="duration of the live benchmark")
+    parser.add_argument('--cycles', type=int, default=5, help="parked/moving cycles in the replayed drive")
+    parser.add_argument('--skip-live', action='store_true', help="only run the replay and poll benchmarks")
+    parser.add_argument('--budgets', help="JSON file of metric limits, replacing the built-in BUDGETS")
+    parser.add_argument('--output', help="write the results to this file instead of stdout")
+    args = parser.parse_args()
+
+    budgets = BUDGETS
+    if args.budgets:
+        with open(args.budgets, 'r') as f:
+            budgets = json.load(f)
+
+    results = {}
+    trace, truth = synthetic_drive(cycles=args.cycles)
+    bench_replay(results, trace, truth)
+    bench_poll(results)
+    if not args.skip_live:
+        bench_live(results, args.seconds)
+
+    failures = check_budgets(results, budgets)
+    report = {'python': platform.python_version(), 'machine': platform.machine(), 'time': time.time(),
+              'results': results, 'budgets': budgets,
+              'failures': [{'metric': metric, 'limit': limit, 'value': value} for metric, limit, value in failures]}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=1)
+    else:
+        print(json.dumps(report, indent=1))
+
+    for metric, limit, value in failures:
+        print(f"Over budget: {metric} = {value} (limit {limit})", file=sys.stderr)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Windowed features used to tell a moving car from a parked one. Features are computed for many windows at once:
+# every function takes raw accelerometer samples shaped (windows, samples, 3) and returns one row per window.
+#
+#   mean, variance  Mean and variance of the acceleration magnitude (raw IMU units, LSB and LSB^2)
+#   jerk            Mean magnitude of the change in acceleration per second (LSB/s)
+#   *_band          Power of the detrended magnitude in each frequency band of BANDS (LSB^2); the bands add up to
+#                   the variance. Accelerating, braking and turning land in the low band, road and suspension
+#                   vibration in the mid band, and engine vibration of an idling car mostly in the high band, which
+#                   runs up to the Nyquist frequency (26 Hz at the 52 Hz FIFO rate; IMU.initFIFO() low-pass filters
+#                   the accelerometer there, so faster vibration does not alias into the lower bands).
+
+BANDS = {'low_band': (0.2, 3.0), 'mid_band': (3.0, 10.0), 'high_band': (10.0, np.inf)}
+FEATURE_NAMES = ('mean', 'variance', 'jerk') + tuple(BANDS)
+
+
+# Returns a view of every window of `window` consecutive samples, `step` samples apart, shaped (windows, window, 3)
+def sliding_windows(samples, window, step=1):
+    samples = np.asarray(samples)
+    if len(samples) < window:
+        return np.empty((0, window) + samples.shape[1:], dtype=samples.dtype)
+    return np.moveaxis(sliding_window_view(samples, window, axis=0), -1, 1)[::step]
+
+
+# Returns an array shaped (windows, len(FEATURE_NAMES)) for accelerometer windows sampled at sample_rate Hz
+def extract_features(windows, sample_rate):
+    windows = np.asarray(windows, dtype=np.float64)
+    length = windows.shape[1]
+    magnitudes = np.linalg.norm(windows, axis=2)
+    mean = magnitudes.mean(axis=1)
+    variance = magnitudes.var(axis=1)
+    jerk = np.linalg.norm(np.diff(windows, axis=1), axis=2).mean(axis=1) * sample_rate
+
+    # One-sided power spectrum scaled so that the bins sum to the variance (Parseval)
+    spectrum = np.abs(np.fft.rfft(magnitudes - mean[:, None], axis=1)) ** 2 * (2.0 / length ** 2)
+    frequencies = np.fft.rfftfreq(length, 1.0 / sample_rate)
+    bands = [spectrum[:, (frequencies >= low) & (frequencies < high)].sum(axis=1) for low, high in BANDS.values()]
+
+    return np.column_stack([mean, variance, jerk] + bands)
+
+
+# Column of a feature matrix by name
+def feature(features, name):
+    return features[:, FEATURE_NAMES.index(name)]
+
+
+# Classifies feature rows as moving (True) or parked (False). A window counts as moving when it is not quiet and either
+# the low band shows sustained acceleration, the mid band shows road vibration stronger than the high (engine) band,
+# or the jerk shows bumps that are not just engine vibration. Idling engines raise the variance and jerk through the
+# high band only, so they no longer look like driving.
+class motion_classifier:
+
+    def __init__(self, variance_threshold=100.0, low_band_threshold=2000.0, mid_band_threshold=2000.0,
+                 jerk_threshold=50000.0):
+        self.variance_threshold = variance_threshold
+        self.low_band_threshold = low_band_threshold
+        self.mid_band_threshold = mid_band_threshold
+        self.jerk_threshold = jerk_threshold
+
+    # Derives thresholds from features of windows recorded while parked (engine off or idling): each threshold is
+    # `factor` times the largest value seen while parked
+    @classmethod
+    def from_parked(cls, features, factor=4.0):
+        largest = features.max(axis=0)
+        return cls(variance_threshold=factor * largest[FEATURE_NAMES.index('variance')],
+                   low_band_threshold=factor * largest[FEATURE_NAMES.index('low_band')],
+                   mid_band_threshold=factor * largest[FEATURE_NAMES.index('mid_band')],
+                   jerk_threshold=factor * largest[FEATURE_NAMES.index('jerk')])
+
+    def predict(self, features):
+        low = feature(features, 'low_band')
+        mid = feature(features, 'mid_band')
+        high = feature(features, 'high_band')
+        quiet = feature(features, 'variance') < self.variance_threshold
+        accelerating = low > self.low_band_threshold
+        road = (mid > self.mid_band_threshold) & (mid > high)
+        bumps = (feature(features, 'jerk') > self.jerk_threshold) & (low + mid > high)
+        return ~quiet & (accelerating | road | bumps)
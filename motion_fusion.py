@@ -0,0 +1,121 @@
+from lib.BerryIMU.filters import ComplementaryFilter, LinearFilter
+import numpy as np
+
+# Parked/moving decision fused from all three BerryIMU sensors. Each update takes a block of raw samples (e.g. one FIFO
+# drain) and runs the filters (lib/BerryIMU/filters.py) over the whole block at once:
+#
+#   acceleration   Standard deviation of the acceleration magnitude over the window (raw LSB). Engine vibration,
+#                  road vibration and people getting in all raise it.
+#   rotation       Gyro rate with its bias removed, low-pass filtered so vibration averages out (deg/s). Turning,
+#                  pitching under acceleration and rolling on the road keep it up while driving.
+#   heading        Range of the heading over the window (deg), from a complementary filter of the integrated gyro
+#                  yaw rate and the tilt compensated magnetometer heading.
+#
+# The car counts as moving when at least two of the three are above their thresholds, so an idling engine
+# (acceleration only) or a passing truck disturbing the compass (heading only) is not mistaken for driving. Short
+# events that move two sensors, like a door slam, are left to the monitor's debouncing.
+
+G_GAIN = 0.070  # [deg/s/LSB] at the 2000 dps range set by IMU.initIMU()
+
+
+# Tilt compensated compass heading in degrees (0-360) for raw accelerometer and magnetometer samples shaped (n, 3),
+# following lib/BerryIMU/berryIMU.py. The sign of the Z terms depends on how the compass is mounted on each BerryIMU.
+def tilt_compensated_heading(acc, mag, imu_version=3):
+    acc = np.asarray(acc, dtype=np.float64)
+    mag = np.asarray(mag, dtype=np.float64)
+    norm = np.maximum(np.linalg.norm(acc, axis=1), 1e-9)
+    pitch = np.arcsin(np.clip(acc[:, 0] / norm, -1, 1))
+    roll = -np.arcsin(np.clip(acc[:, 1] / norm / np.maximum(np.cos(pitch), 1e-9), -1, 1))
+
+    sign = 1 if imu_version in (1, 3) else -1
+    mag_x = mag[:, 0] * np.cos(pitch) + sign * mag[:, 2] * np.sin(pitch)
+    mag_y = mag[:, 0] * np.sin(roll) * np.sin(pitch) + mag[:, 1] * np.cos(roll) \
+        - sign * mag[:, 2] * np.sin(roll) * np.cos(pitch)
+    return np.degrees(np.arctan2(mag_y, mag_x)) % 360
+
+
+class fusion_detector:
+
+    def __init__(self, acc_threshold=40.0, gyro_threshold=1.0, heading_threshold=3.0, window=2.0, gyro_smoothing=0.25,
+                 heading_gain=0.98, bias_time_constant=60.0, imu_version=3):
+        self.acc_threshold = acc_threshold
+        self.gyro_threshold = gyro_threshold
+        self.heading_threshold = heading_threshold
+        self.window = window  # Seconds of samples each decision looks at
+        self.gyro_smoothing = gyro_smoothing  # Time constant of the gyro low-pass filter, in seconds
+        self.heading_gain = heading_gain  # Weight of the gyro in the heading filter, per sample
+        self.bias_time_constant = bias_time_constant  # Gyro bias follows the parked gyro rate this slowly
+        self.imu_version = imu_version
+        self.gyro_bias = None
+        self.reset()
+
+    # Forgets the buffered window and filter states, e.g. after the monitor slept; keeps the learned gyro bias
+    def reset(self):
+        self.__times = np.empty(0)
+        self.__acc_mags = np.empty(0)
+        self.__rates = np.empty(0)
+        self.__headings = np.empty(0)
+        self.__last_time = None
+        self.__gyro_filter = None  # Low-pass over the three gyro axes, rebuilt when the sample period changes
+        self.__gyro_smoothing = None
+        self.__heading_filter = None  # Filtered yaw, unwrapped (can leave 0-360)
+        self.__moving = False
+
+    # Feeds a block of raw samples: times (n,) in seconds and acc, gyr, mag shaped (n, 3). Returns whether the car is
+    # moving, or None until a full window has been seen. Blocks must arrive well within `window` of each other (FIFO
+    # drains, or polling without adaptive back-off); sparser samples never fill a window and every update returns None.
+    def update(self, times, acc, gyr, mag):
+        times = np.asarray(times, dtype=np.float64)
+        acc = np.asarray(acc, dtype=np.float64)
+        rates = np.asarray(gyr, dtype=np.float64) * G_GAIN
+        if self.gyro_bias is None:
+            self.gyro_bias = rates.mean(axis=0)
+        if self.__last_time is None:
+            self.__last_time = times[0] - (times[1] - times[0] if len(times) > 1 else 0.0)
+        dt = np.diff(times, prepend=self.__last_time)
+        self.__last_time = times[-1]
+
+        # Low-pass the bias corrected gyro; the coefficient uses the block's mean sample period
+        period = max(float(dt.mean()), 1e-6)
+        smoothing = np.exp(-period / self.gyro_smoothing)
+        if self.__gyro_filter is None:
+            self.__gyro_filter = LinearFilter([[smoothing]], [[1 - smoothing]], np.zeros((1, 3)))
+        elif abs(smoothing - self.__gyro_smoothing) > 1e-3 * smoothing:
+            self.__gyro_filter.setCoefficients([[smoothing]], [[1 - smoothing]])
+        self.__gyro_smoothing = smoothing
+        filtered = self.__gyro_filter.process((rates - self.gyro_bias)[:, None, :])[:, 0, :]
+
+        # The compass heading turns clockwise while the gyro yaw rate is positive counterclockwise; fuse in yaw angle
+        compass_yaw = -tilt_compensated_heading(acc, mag, self.imu_version)
+        if self.__heading_filter is None:
+            self.__heading_filter = ComplementaryFilter(self.heading_gain, compass_yaw[0])
+        # Unwrap the compass next to the filtered yaw so the filter never sees a 360 degree jump
+        previous = self.__heading_filter.angle
+        compass_yaw = np.degrees(np.unwrap(np.radians(np.concatenate(([previous], compass_yaw)))))[1:]
+        yaw = self.__heading_filter.update(compass_yaw, rates[:, 2], dt)
+
+        keep = self.__times > times[-1] - self.window
+        self.__times = np.concatenate((self.__times[keep], times))
+        self.__acc_mags = np.concatenate((self.__acc_mags[keep], np.linalg.norm(acc, axis=1)))
+        self.__rates = np.concatenate((self.__rates[keep], np.linalg.norm(filtered, axis=1)))
+        self.__headings = np.concatenate((self.__headings[keep], yaw))
+        if self.__times[-1] - self.__times[0] < self.window * 0.9:
+            return None
+
+        votes = (int(self.__acc_mags.std() > self.acc_threshold)
+                 + int(self.__rates.mean() > self.gyro_threshold)
+                 + int(np.ptp(self.__headings) > self.heading_threshold))
+        self.__moving = votes >= 2
+
+        # While parked, let the gyro bias follow the raw rate (temperature drift)
+        if not self.__moving:
+            alpha = min(float(dt.sum()) / self.bias_time_constant, 1.0)
+            self.gyro_bias = self.gyro_bias + alpha * (rates.mean(axis=0) - self.gyro_bias)
+        return self.__moving
+
+    # Latest values of the three fused measures, for tuning
+    def measures(self):
+        if len(self.__times) == 0:
+            return None
+        return {'acc_std': float(self.__acc_mags.std()), 'gyro_rate': float(self.__rates.mean()),
+                'heading_change': float(np.ptp(self.__headings))}
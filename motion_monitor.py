@@ -1,15 +1,36 @@
 import lib.BerryIMU.IMU as IMU
-from collections import deque
+from lib.BerryIMU.gpio import openInterruptPin
+from lib.BerryIMU.statefile import statePath, saveJSON
+from lib.BerryIMU.trace import TraceRecorder, openTrace
+from running_window import running_window
+from adaptive_scheduler import adaptive_scheduler
+from motion_features import extract_features, sliding_windows
+import json
+import math
+import queue
 import time
 import threading
+import traceback
 import numpy as np
-from statistics import mean
 import types
+from collections import namedtuple
+
+
+# Immutable view of the monitor state, published by the sampler after every update. seq counts the updates and
+# timestamp is when the update was made (trace time during replay()).
+motion_state = namedtuple('motion_state', ['is_parked', 'avg_motion', 'threshold', 'seq', 'timestamp'])
+
+
+# Default calibration profile, next to the IMU detection cache in the state directory of the repository root
+PROFILE_FILE = statePath('motion_profile.json')
 
 
 class motion_monitor:
 
-    def __init__(self, verbose=False):
+    def __init__(self, verbose=False, use_fifo=False, bus=None, imu_cache=IMU.DETECT_CACHE_FILE, window_size=None,
+                 wake_on_motion=False, interrupt_gpio=None, wake_threshold=1, adaptive_sampling=False,
+                 classifier=None, profile_path=PROFILE_FILE, drift_tracking=False, trace_path=None,
+                 recorder=None, fusion=None, mag_calibration=IMU.MAG_CALIBRATION_FILE):
         # Top-level variables
         self.__is_parked = False
         self.__running = False
@@ -17,6 +38,10 @@ class motion_monitor:
         self.__motion_threshold = 4200
         self.__verbose = verbose
 
+        # Latest motion_state. Writers replace it while holding __lock; readers only read the reference, which is
+        # atomic, so they never wait for the sampler and always see fields from the same update.
+        self.__state = motion_state(self.__is_parked, self.__avg_motion, self.__motion_threshold, 0, time.time())
+
         # Internal thread/loop variables
         self.__thread = None
         self.__lock = threading.Lock()
@@ -26,20 +51,108 @@ class motion_monitor:
         self.__transition_time = 3  # Car must be in a new state for 5 seconds for self.__is_parked to update
         self.__debounce_time = time.time()
 
-        # Event handlers
+        # Calibration profile (see calibrate()), persisted to profile_path so later boots can skip calibration
+        self.__profile_path = profile_path
+        self.__calibration = None  # dict with noise_floor, noise_std, bias and threshold once calibrated or loaded
+        self.__min_margin = 25  # Smallest gap between the noise floor and the motion threshold
+
+        # Drift tracking: while confidently parked, the noise floor follows the measured average with a time constant of
+        # __drift_time_constant seconds, and the threshold moves with it. The profile is saved every __drift_save_time.
+        self.__drift_tracking = drift_tracking
+        self.__drift_time_constant = 600
+        self.__drift_save_time = 600
+        self.__drift_updated = None
+        self.__drift_saved = time.time()
+        self.__profile_dirty = False
+
+        # Event handlers. Transitions are queued by the sampling loop and the handlers are run by a separate dispatcher
+        # thread, so a slow handler never delays sampling or blocks is_parked()/get_avg_motion() callers.
         self.__on_parked = None  # Function pointer that is called when the motion_monitor transitions to parked
         self.__on_moving = None  # Function pointer that is called when the motion_monitor transitions to not-parked
+        self.__events = queue.Queue()
+        self.__dispatcher = None
 
-        # Deque used to calculate average motion
-        self.__deque_size = 20
-        self.__deque_count = 0
-        self.__measurements = deque([0.0] * self.__deque_size, self.__deque_size)
+        # Sliding window used to calculate average motion. Its statistics are updated in O(1) per sample, so
+        # window_size can be raised to thousands of samples without slowing down the loop.
+        self.__window_size = 20
+        self.__window_time = self.__window_size * self.__pause_time  # Seconds of motion covered by the window
 
-        # Check connection w/ IMU and init it
-        IMU.detectIMU()
-        if IMU.BerryIMUversion == 99:
+        # FIFO batch sampling: the IMU buffers samples at __fifo_rate and the loop drains them in bulk,
+        # so the thread only wakes once every __pause_time seconds. The window still spans __window_time.
+        self.__use_fifo = use_fifo
+        self.__fifo_rate = 52
+        if self.__use_fifo:
+            self.__pause_time = 1.0
+            self.__window_size = int(self.__fifo_rate * self.__window_time)
+
+        if window_size is not None:
+            self.__window_size = window_size
+        self.__measurements = running_window(self.__window_size)
+
+        # Adaptive sampling: sample every __pause_time around transitions, and back off to up to __max_pause_time
+        # while the state is stable and far from the threshold. In FIFO mode the IMU keeps buffering while the loop
+        # sleeps, so the back-off only bounds how long the FIFO holds samples (about 13 s at 52 Hz, half that with
+        # the gyro in the FIFO too).
+        self.__fifo_gyro = trace_path is not None or recorder is not None or fusion is not None
+        self.__max_pause_time = 1.0
+        if self.__use_fifo:
+            self.__max_pause_time = 5.0 if self.__fifo_gyro else 10.0
+        self.__scheduler = None
+        if adaptive_sampling:
+            self.__scheduler = adaptive_scheduler(self.__pause_time, self.__max_pause_time)
+
+        # Optional feature classifier (see motion_features.py) that replaces the average-vs-threshold test. Features
+        # are computed over __feature_window raw samples, for every __feature_step new samples, in one batched call.
+        # The frequency bands (up to 26 Hz) need evenly spaced samples at the FIFO rate; polling gives about one
+        # sample per __pause_time, unevenly spaced with adaptive sampling, so the classifier requires FIFO mode.
+        if classifier is not None and not self.__use_fifo:
+            raise ValueError("The feature classifier needs use_fifo=True")
+        self.__classifier = classifier
+        self.__feature_rate = self.__fifo_rate
+        self.__feature_window = 128
+        self.__feature_step = 32
+        self.__feature_samples = np.empty((0, 3))  # Most recent raw samples, enough to complete the next windows
+        self.__feature_new = 0  # Samples received since the last classification
+        self.__motion_detected = None  # Latest classifier decision, None until a full window has been classified
+
+        # Optional sensor fusion detector (see motion_fusion.py), an alternative to the classifier that also uses the
+        # gyro and magnetometer. In FIFO mode the gyro is added to the FIFO and the magnetometer is read once per poll.
+        if classifier is not None and fusion is not None:
+            raise ValueError("Use either a classifier or a fusion detector, not both")
+        self.__fusion = fusion
+
+        # Check connection w/ IMU and init it. bus defaults to the IMU module's bus (see lib/BerryIMU/i2c.py).
+        # Detection is cached in imu_cache so that reboots only need a single 'who am i' check. The compass calibration
+        # from lib/BerryIMU/calibrateBerryIMU.py is loaded from mag_calibration and applied to the fusion detector's
+        # magnetometer readings; traces keep the raw readings.
+        self.__imu = IMU.detectIMU(bus, cache_file=imu_cache, mag_calibration=mag_calibration)
+        if self.__imu is None:
             raise RuntimeError("No BerryIMU detected on I2C Bus! Ensure connection is secure.")
-        IMU.initIMU()
+        self.__imu.initIMU()
+        if self.__use_fifo:
+            self.__imu.initFIFO(self.__fifo_rate, gyro=self.__fifo_gyro)
+        if self.__fusion is not None:
+            self.__fusion.imu_version = self.__imu.version
+
+        # Optional recording of every raw sample the monitor takes (see lib/BerryIMU/trace.py), so a wrong call in
+        # the field can be replayed later with replay(). recorder can be any object with TraceRecorder's record(),
+        # recordBatch() and flush(), e.g. the shared buffer of process_motion_monitor.
+        self.__recorder = recorder
+        if trace_path is not None:
+            self.__recorder = TraceRecorder(trace_path, self.__imu.version,
+                                            self.__fifo_rate if self.__use_fifo else 1 / self.__pause_time)
+
+        # Wake-on-motion: once parked, the loop stops polling and blocks on the IMU's wake-up interrupt, wired to
+        # interrupt_gpio. wake_threshold is in IMU units of full scale / 64 (125 mg at +/- 8g).
+        self.__wake_pin = None
+        self.__wake_threshold = wake_threshold
+        self.__wake_timeout = 1.0  # Seconds between checks of __running while waiting for the interrupt
+        self.__awake_until = 0  # After a wake-up, keep polling until this time so a move can be confirmed
+        if wake_on_motion:
+            if interrupt_gpio is None and not isinstance(self.__imu.bus, IMU.SimulatedBus):
+                raise ValueError("wake_on_motion requires the GPIO pin wired to the IMU's INT1 output")
+            self.__imu.disableWakeUp()  # Fails early if the IMU has no wake-up interrupt
+            self.__wake_pin = openInterruptPin(self.__imu.bus, interrupt_gpio)
 
     # Creates a non-blocking thread that will periodically check IMU and update
     def start(self, on_parked: types.FunctionType = None, on_moving: types.FunctionType = None):
@@ -51,7 +164,9 @@ class motion_monitor:
         self.__on_moving = on_moving
 
         self.__running = True
-        self.__thread = threading.Thread(target=self.__internal_start)
+        self.__dispatcher = threading.Thread(target=self.__dispatch_events, name="motion_monitor_events")
+        self.__dispatcher.start()
+        self.__thread = threading.Thread(target=self.__internal_start, name="motion_monitor")
         self.__thread.start()
 
     def stop(self):
@@ -65,79 +180,385 @@ class motion_monitor:
         self.__thread.join()
         self.__thread = None
 
+        # Handlers already queued still run; the sentinel ends the dispatcher after them
+        self.__events.put(None)
+        self.__dispatcher.join()
+        self.__dispatcher = None
+        if self.__recorder is not None:
+            self.__recorder.flush()
+
     def is_parked(self):
-        with self.__lock:
-            return self.__is_parked
+        return self.__state.is_parked
 
     def get_avg_motion(self):
+        return self.__state.avg_motion
+
+    # Returns the latest motion_state, for callers that need several fields from the same update
+    def get_state(self):
+        return self.__state
+
+    # Returns sample counts and the current/mean sampling period of the adaptive scheduler (None if disabled)
+    def get_sampling_stats(self):
+        if self.__scheduler is None:
+            return None
         with self.__lock:
-            return self.__avg_motion
+            return self.__scheduler.stats()
 
-    def calibrate(self):
-        print("Motion monitor calibrating; please lay the IMU down motionless on a steady table.")
-        input("Press enter to start calibration...")
+    # Returns the mean, variance, min and max of the acceleration magnitudes in the current window
+    def get_motion_stats(self):
+        with self.__lock:
+            return {'mean': self.__measurements.mean(), 'variance': self.__measurements.variance(),
+                    'min': self.__measurements.min(), 'max': self.__measurements.max(),
+                    'samples': len(self.__measurements)}
+
+    # Measures the IMU at rest: per-axis bias, the noise floor (mean acceleration magnitude) and its noise, and sets
+    # the motion threshold just above the floor. The result is saved to the profile file. With interactive=False no
+    # prompt is shown, so the IMU must already be at rest (e.g. the car standing still at boot).
+    def calibrate(self, interactive=True, samples=200):
+        if interactive:
+            print("Motion monitor calibrating; please lay the IMU down motionless on a steady table.")
+            input("Press enter to start calibration...")
         print("Calibrating...", end='')
-        for i in range(self.__deque_size):
-            self.__queryIMU()
-            if i % (self.__deque_size / 10) == 0:
-                print('.', end='')
+        if self.__use_fifo:
+            # Let the FIFO collect the samples, then drain them in one go
+            self.__imu.readFIFO()
+            time.sleep(max(self.__window_time, samples / self.__fifo_rate))
+            acc = self.__imu.readFIFO()[:, :3]  # Drop the gyro columns when it is in the FIFO too
+        else:
+            acc = []
+            for i in range(samples):
+                acc.append(self.__imu.readACC())
+                if i % max(samples // 10, 1) == 0:
+                    print('.', end='')
 
-        self.__motion_threshold = self.__avg_motion + 25
+        acc = np.asarray(acc, dtype=np.float64)
+        magnitudes = np.linalg.norm(acc, axis=1)
+        noise_floor = float(magnitudes.mean())
+        noise_std = float(magnitudes.std())
+        self.__apply_calibration({'noise_floor': noise_floor,
+                                  'noise_std': noise_std,
+                                  'bias': acc.mean(axis=0).tolist(),
+                                  'threshold': noise_floor + max(self.__min_margin, 4 * noise_std),
+                                  'samples': len(acc),
+                                  'imu': self.__imu.version,
+                                  'timestamp': time.time()})
+        with self.__lock:
+            self.__measurements.clear()
+            self.__measurements.extend(magnitudes[-self.__window_size:].tolist())
+            self.__avg_motion = self.__measurements.mean()
+            self.__publish(time.time())
+        self.save_profile()
         print("Calibration complete!")
 
+    # Loads the calibration profile saved by calibrate(). Returns False if there is no usable profile for this IMU, in
+    # which case the caller should calibrate().
+    def load_profile(self):
+        if self.__profile_path is None:
+            return False
+        try:
+            with open(self.__profile_path, 'r') as f:
+                profile = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if profile.get('imu') != self.__imu.version or 'threshold' not in profile:
+            return False
+
+        self.__apply_calibration(profile)
+        return True
+
+    def save_profile(self):
+        if self.__profile_path is None:
+            return
+        with self.__lock:
+            profile = dict(self.__calibration)
+            self.__profile_dirty = False
+        saveJSON(self.__profile_path, profile)
+
+    # Returns a copy of the current calibration profile, or None if not calibrated
+    def get_calibration(self):
+        with self.__lock:
+            return dict(self.__calibration) if self.__calibration is not None else None
+
+    def __apply_calibration(self, profile):
+        with self.__lock:
+            self.__calibration = profile
+            self.__motion_threshold = profile['threshold']
+            self.__drift_updated = None
+            self.__publish(time.time())
+
+    # Replaces the published motion_state with the current fields. Call with __lock held.
+    def __publish(self, now):
+        self.__state = motion_state(self.__is_parked, self.__avg_motion, self.__motion_threshold,
+                                    self.__state.seq + 1, now)
+
+    # Replays a recorded trace (a path or an array from openTrace()) through the detector as fast as possible, with the
+    # trace timestamps standing in for the clock. Samples are fed as the live loop would take them: the latest sample
+    # every __pause_time, or in FIFO mode everything recorded since the previous poll. The window, debounce timer and
+    # classifier start empty; parked sets the initial state (default: keep the current one). The monitor must not be
+    # running and handlers are not called. Returns the transitions as a list of (timestamp, is_parked).
+    def replay(self, trace, parked=None):
+        if self.__thread is not None:
+            raise RuntimeWarning("Cannot replay while the motion monitor is running!")
+        if isinstance(trace, str):
+            trace = openTrace(trace)
+        if len(trace) == 0:
+            return []
+
+        times = trace['t']
+        acc = trace['acc']
+        poll_times = times[0] + self.__pause_time * np.arange(int((times[-1] - times[0]) / self.__pause_time) + 1)
+        ends = np.searchsorted(times, poll_times, side='right')
+
+        with self.__lock:
+            self.__measurements.clear()
+            self.__avg_motion = 0
+            self.__debounce_time = times[0]
+            self.__motion_detected = None
+            if parked is not None:
+                self.__is_parked = parked
+            state = self.__is_parked
+            self.__publish(times[0])
+        self.__feature_samples = np.empty((0, 3))
+        self.__feature_new = 0
+        if self.__fusion is not None:
+            self.__fusion.reset()
+
+        transitions = []
+        start = 0
+        for poll_time, end in zip(poll_times.tolist(), ends.tolist()):
+            if end == start:
+                continue  # Nothing new was recorded before this poll
+            batch = slice(start, end) if self.__use_fifo else slice(end - 1, end)
+            self.__add_samples(acc[batch], times[batch], trace['gyr'][batch], trace['mag'][batch])
+            start = end
+            self.__calc_whether_parked(poll_time, notify=False)
+            if self.__is_parked != state:
+                state = self.__is_parked
+                transitions.append((poll_time, state))
+        return transitions
+
+    # Dispatcher thread: runs the handler for each queued transition, in order, until stop() queues None
+    def __dispatch_events(self):
+        while True:
+            handler = self.__events.get()
+            if handler is None:
+                return
+            try:
+                handler()
+            except Exception:
+                traceback.print_exc()
+
+    # Takes one sample and updates the parked state. Returns the number of seconds to wait before the next poll(), or
+    # None when wake-on-motion is enabled and the loop should block in wait_for_motion() instead. This is the sampling
+    # core shared by the threaded loop below and async_motion_monitor.
+    def poll(self):
+        sample = self.__queryIMU()
+        pending = self.__calc_whether_parked()
+        if self.__drift_tracking:
+            self.__track_drift(pending)
+        if self.__wake_pin is not None and self.is_parked() and not pending and time.time() >= self.__awake_until:
+            return None
+        return self.__next_pause_time(sample, pending)
+
     # Main monitor behavior loop
     def __internal_start(self):
         while self.__running:
-            self.__queryIMU()
-            self.__calc_whether_parked()
-            time.sleep(self.__pause_time)
+            pause_time = self.poll()
+            if pause_time is None:
+                self.wait_for_motion(self.__internal_is_running)
+            else:
+                time.sleep(pause_time)
+
+    # Fixed __pause_time, or the adaptive scheduler's choice based on the newest sample and window statistics
+    def __next_pause_time(self, sample, pending):
+        if self.__scheduler is None or sample is None:
+            return self.__pause_time
+        with self.__lock:
+            return self.__scheduler.update(sample, self.__avg_motion, self.__measurements.std(),
+                                           self.__motion_threshold, pending)
+
+    # Parks the loop on the IMU's wake-up interrupt instead of polling, until the interrupt fires or keep_waiting()
+    # returns False. On wake, the stale window and debounce timer are reset so the new samples alone decide whether
+    # the car is moving, and poll() keeps sampling for at least one transition time plus window before it may ask to
+    # sleep again.
+    def wait_for_motion(self, keep_waiting):
+        if self.__verbose:
+            print("Waiting for wake-up interrupt")  # DEBUG
+        self.__imu.enableWakeUp(self.__wake_threshold)
+        try:
+            while keep_waiting():
+                if self.__wake_pin.wait(self.__wake_timeout):
+                    break
+        finally:
+            self.__imu.disableWakeUp()
+
+        if self.__use_fifo:
+            self.__imu.readFIFO()  # Discard the samples buffered while asleep
+        with self.__lock:
+            self.__measurements.clear()
+            self.__debounce_time = time.time()
+            self.__motion_detected = None
+        self.__feature_samples = np.empty((0, 3))
+        self.__feature_new = 0
+        warmup_time = self.__window_time
+        if self.__classifier is not None:
+            warmup_time = max(warmup_time, self.__feature_window / self.__feature_rate)
+        if self.__fusion is not None:
+            self.__fusion.reset()
+            warmup_time = max(warmup_time, self.__fusion.window)
+        self.__awake_until = time.time() + self.__transition_time + warmup_time
+        if self.__scheduler is not None:
+            self.__scheduler.reset()
+        if self.__verbose:
+            print("Woken up by motion")  # DEBUG
 
     def __internal_is_running(self):
         with self.__lock:
             return self.__running
 
-    # Gets the magnitude of acceleration from the IMU, appends it to the measurements deque, and recalculates the
-    # average acceleration
+    # Gets the acceleration from the IMU (every sample buffered since the last call in FIFO mode), records it if a
+    # trace is being written, and adds it to the measurements. Returns the result of __add_samples(), or None if there
+    # was no new data.
     def __queryIMU(self):
-        acc = np.array([IMU.readACCx(), IMU.readACCy(), IMU.readACCz()])
-        acc_mag = np.linalg.norm(acc)
-        if self.__deque_count >= self.__deque_size:
-            self.__measurements.pop()
+        now = time.time()
+        all_sensors = self.__recorder is not None or self.__fusion is not None
+        if self.__use_fifo:
+            data = self.__imu.readFIFO()
+            if len(data) == 0:
+                return None
+            acc = data[:, :3]
+            gyr = data[:, 3:6] if data.shape[1] == 6 else None
+            # The newest sample was taken about now, the rest at the FIFO rate before it
+            times = now - np.arange(len(data) - 1, -1, -1) / self.__fifo_rate
+            mag = np.tile(self.__imu.readMAG(), (len(data), 1)) if all_sensors else None
+            if self.__recorder is not None:
+                self.__recorder.recordBatch(times, acc, gyr, mag)
+        elif all_sensors:
+            sample, gyr, mag = self.__imu.readAll()
+            if self.__recorder is not None:
+                self.__recorder.record(now, sample, gyr, mag)
+            acc, times, gyr, mag = [sample], [now], [gyr], [mag]
+        else:
+            acc, times, gyr, mag = [self.__imu.readACC()], [now], None, None
+        return self.__add_samples(acc, times, gyr, mag)
+
+    # Appends the magnitudes of a batch of acceleration samples to the measurements window, feeds the classifier or
+    # fusion detector and recalculates the average acceleration. Returns the new magnitude (the mean of the batch).
+    def __add_samples(self, acc, times, gyr=None, mag=None):
+        if len(acc) == 1:
+            acc_mags = [math.hypot(*acc[0])]
+        else:
+            acc_mags = np.linalg.norm(acc, axis=1).tolist()
+
+        motion_detected = None
+        if self.__classifier is not None:
+            motion_detected = self.__classify(acc)
+        elif self.__fusion is not None:
+            motion_detected = self.__fusion.update(times, acc, gyr, self.__imu.correctMAG(mag))
 
-        self.__measurements.appendleft(acc_mag)
-        self.__deque_count = min(self.__deque_count + 1, self.__deque_size)
         # Recalculate average acceleration
         with self.__lock:
-            self.__avg_motion = mean(list(self.__measurements)[0:self.__deque_count])
+            if motion_detected is not None:
+                self.__motion_detected = motion_detected
+            self.__measurements.extend(acc_mags)
+            self.__avg_motion = self.__measurements.mean()
             if self.__verbose:
                 print(f"Average Acceleration: {self.__avg_motion}\tThreshold:{self.__motion_threshold}")  # DEBUG
+        return sum(acc_mags) / len(acc_mags)
+
+    # Appends raw samples to the feature buffer and, once __feature_step new samples have arrived, classifies every
+    # window that ends in the new samples. Returns the majority decision, or None if no window was classified.
+    def __classify(self, acc):
+        samples = np.concatenate((self.__feature_samples, np.asarray(acc, dtype=np.float64)))
+        self.__feature_new += len(acc)
+        self.__feature_samples = samples[-(self.__feature_window - 1 + self.__feature_step):]
+        if self.__feature_new < self.__feature_step or len(samples) < self.__feature_window:
+            return None
+
+        # Windows end at the newest sample and step back through the new samples only
+        count = min((len(samples) - self.__feature_window) // self.__feature_step + 1,
+                    -(-self.__feature_new // self.__feature_step))
+        start = len(samples) - self.__feature_window - (count - 1) * self.__feature_step
+        windows = sliding_windows(samples[start:], self.__feature_window, self.__feature_step)
+        self.__feature_new = 0
 
-    # Uses a debouncing technique with the average acceleration to mark whether the car is parked or not
-    def __calc_whether_parked(self):
+        moving = self.__classifier.predict(extract_features(windows, self.__feature_rate))
+        return bool(moving.mean() > 0.5)
+
+    # Whether the latest measurements look like motion: the classifier's decision when one is configured and has
+    # seen a full window, otherwise the average acceleration compared with the threshold. Call with __lock held.
+    def __motion_now(self):
+        if self.__motion_detected is not None:
+            return self.__motion_detected
+        return self.__avg_motion > self.__motion_threshold
+
+    # Lets the noise floor and threshold follow slow sensor drift (temperature, mounting) while the car is confidently
+    # parked: parked, no transition pending, a full window, and the average within half a margin of the floor.
+    def __track_drift(self, pending):
+        now = time.time()
         with self.__lock:
+            if self.__calibration is None:
+                return
+            floor = self.__calibration['noise_floor']
+            margin = self.__calibration['threshold'] - floor
+            confident = self.__is_parked and not pending and self.__measurements.is_full() and \
+                abs(self.__avg_motion - floor) < margin / 2
+            if not confident:
+                self.__drift_updated = None
+                return
+
+            if self.__drift_updated is not None:
+                alpha = min((now - self.__drift_updated) / self.__drift_time_constant, 1.0)
+                floor += alpha * (self.__avg_motion - floor)
+                self.__calibration['noise_floor'] = floor
+                self.__calibration['threshold'] = floor + margin
+                self.__calibration['timestamp'] = now
+                self.__motion_threshold = floor + margin
+                self.__profile_dirty = True
+                self.__publish(now)
+            self.__drift_updated = now
+            save = self.__profile_dirty and now - self.__drift_saved >= self.__drift_save_time
+
+        if save:
+            self.__drift_saved = now
+            self.save_profile()
+
+    # Uses a debouncing technique with the average acceleration to mark whether the car is parked or not.
+    # Returns True while the measurements disagree with the current state, i.e. a transition is being debounced.
+    # now defaults to the current time; replay() passes trace timestamps and notify=False to skip the handlers.
+    def __calc_whether_parked(self, now=None, notify=True):
+        if now is None:
+            now = time.time()
+        with self.__lock:
+            moving = self.__motion_now()
             if self.__is_parked:
                 # Car is currently marked as parked
-                if self.__avg_motion > self.__motion_threshold:
-                    if time.time() > (self.__debounce_time + self.__transition_time):
+                if moving:
+                    if now > (self.__debounce_time + self.__transition_time):
                         # Car has been moving for more than transition time, update status
                         self.__is_parked = False
-                        if self.__on_moving is not None:
-                            self.__on_moving()
+                        self.__debounce_time = now
+                        if notify and self.__on_moving is not None:
+                            self.__events.put(self.__on_moving)
                 else:
-                    self.__debounce_time = time.time()
+                    self.__debounce_time = now
             else:
                 # Car is currently marked as moving
-                if self.__avg_motion <= self.__motion_threshold:
-                    if time.time() > (self.__debounce_time + self.__transition_time):
+                if not moving:
+                    if now > (self.__debounce_time + self.__transition_time):
                         # Car has been stationary for more than transition time, update status
                         self.__is_parked = True
-                        if self.__on_parked is not None:
-                            self.__on_parked()
+                        self.__debounce_time = now
+                        if notify and self.__on_parked is not None:
+                            self.__events.put(self.__on_parked)
                 else:
-                    self.__debounce_time = time.time()
+                    self.__debounce_time = now
 
             if self.__verbose:
-                print(f"Parked: {str(self.__is_parked)}\tTimer: {(time.time() - self.__debounce_time)}")  # DEBUG
+                print(f"Parked: {str(self.__is_parked)}\tTimer: {(now - self.__debounce_time)}")  # DEBUG
+
+            self.__publish(now)
+            return moving == self.__is_parked
 
 
 def main():
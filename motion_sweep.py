@@ -0,0 +1,182 @@
+from lib.BerryIMU.trace import openTrace
+import argparse
+import csv
+import itertools
+import json
+import numpy as np
+
+# Offline tuning of the motion_monitor detector. Recorded IMU traces (see lib/BerryIMU/trace.py) are labelled with
+# parked/moving intervals, and every combination of threshold, window size, transition time and pause time is
+# evaluated against the labels with array operations instead of running the sampling loop:
+#
+#   python motion_sweep.py drive.trace --labels drive.csv --thresholds 4150:4400:25 --windows 10,20,40
+#
+# Labels are CSV files with a start,end,state header: seconds since the start of the trace and 'parked' or 'moving'.
+# Time outside the labelled intervals is ignored. The sweep models the polling loop (the latest sample every pause
+# time, averaged over the last window_size polls), not FIFO mode.
+
+
+# Reads a labels file into a list of (start, end, moving)
+def load_labels(path):
+    with open(path, newline='') as f:
+        return [(float(row['start']), float(row['end']), row['state'].strip() == 'moving') for row in csv.DictReader(f)]
+
+
+# Returns the poll times (seconds since the start of the trace) for pause_time, and the acceleration magnitude the
+# monitor would have read at each poll: the latest recorded sample
+def poll_magnitudes(trace, pause_time):
+    times = trace['t'] - trace['t'][0]
+    poll_times = pause_time * np.arange(int(times[-1] / pause_time) + 1)
+    index = np.searchsorted(times, poll_times, side='right') - 1
+    return poll_times, np.linalg.norm(np.asarray(trace['acc'][index], dtype=np.float64), axis=1)
+
+
+# Labels the polls: truth is 1 while moving, 0 while parked and -1 outside the labels. label_start is the start time
+# of the interval each poll falls in, used to measure latency from the real transition rather than the next poll.
+def label_polls(labels, poll_times):
+    truth = np.full(len(poll_times), -1, dtype=np.int8)
+    label_start = np.zeros(len(poll_times))
+    for start, end, moving in labels:
+        inside = (poll_times >= start) & (poll_times < end)
+        truth[inside] = moving
+        label_start[inside] = start
+    return truth, label_start
+
+
+# Average over the last window_size polls, for every window size at once. Returns (len(window_sizes), polls).
+# Until a window fills up, the average is over the polls so far, like running_window.mean().
+def running_means(magnitudes, window_sizes):
+    cumsum = np.concatenate(([0.0], np.cumsum(magnitudes)))
+    end = np.arange(1, len(magnitudes) + 1)
+    start = np.maximum(end - np.asarray(window_sizes)[:, None], 0)
+    return (cumsum[end] - cumsum[start]) / (end - start)
+
+
+# Debounced state for raw per-poll decisions (True = moving), along the last axis. The monitor only changes state once
+# the raw decision has disagreed with it for longer than transition_time since the last agreeing poll, so the state at
+# each poll is the raw value of the most recent run of equal decisions that lasted longer than transition_time.
+# The monitor starts as not parked, hence initial=True.
+def debounce(raw, poll_times, transition_time, initial=True):
+    polls = raw.shape[-1]
+    index = np.arange(polls)
+    starts = np.ones(raw.shape, dtype=bool)
+    starts[..., 1:] = raw[..., 1:] != raw[..., :-1]
+    run_start = np.maximum.accumulate(np.where(starts, index, 0), axis=-1)
+
+    # A run's debounce timer starts at the poll before it (the first run's at the first poll)
+    timer_start = np.concatenate((poll_times[:1], poll_times[:-1]))[run_start]
+    settled = poll_times - timer_start > transition_time
+    last_settled = np.maximum.accumulate(np.where(settled, index, -1), axis=-1)
+    state = np.take_along_axis(raw, np.maximum(last_settled, 0), axis=-1)
+    return np.where(last_settled >= 0, state, initial)
+
+
+# Scores debounced states (..., polls) against the labelled truth. Returns a dict of arrays shaped like states[..., 0]:
+# the number of labelled transitions, how many were detected, the sum and maximum of their detection latency, the
+# number of false transitions (changes away from the labelled state), and the number of labelled/agreeing polls.
+def score(states, truth, label_start, poll_times):
+    polls = len(truth)
+    index = np.arange(polls)
+    known = truth >= 0
+    agree = (states == truth.astype(bool)) & known
+
+    # Labelled transitions: the first poll of each interval that directly follows an interval of the other state
+    boundaries = np.flatnonzero(truth[1:] != truth[:-1]) + 1
+    ends = np.append(boundaries[1:], polls)
+    changed = (truth[boundaries] >= 0) & (truth[boundaries - 1] >= 0)
+    boundaries, ends = boundaries[changed], ends[changed]
+
+    # First poll at or after each boundary where the state matches the label, if it comes before the next change
+    next_agree = np.minimum.accumulate(np.where(agree, index, polls)[..., ::-1], axis=-1)[..., ::-1]
+    first = next_agree[..., boundaries]
+    detected = first < ends
+    latency = np.where(detected, poll_times[np.minimum(first, polls - 1)] - label_start[boundaries], 0.0)
+
+    transitions = states[..., 1:] != states[..., :-1]
+    false = transitions & known[1:] & (states[..., 1:] != truth[1:].astype(bool))
+    shape = states.shape[:-1]
+    return {'transitions': np.full(shape, len(boundaries)),
+            'detected': detected.sum(axis=-1),
+            'latency_sum': latency.sum(axis=-1),
+            'latency_max': latency.max(axis=-1, initial=0.0),
+            'false_transitions': false.sum(axis=-1),
+            'labelled_polls': np.full(shape, known.sum()),
+            'agreeing_polls': agree.sum(axis=-1)}
+
+
+# Evaluates the parameter grid over (trace, labels) pairs. Thresholds and window sizes are evaluated together in one
+# array per pause and transition time. Returns one dict per setting with the totals over all traces and the derived
+# detection rate, mean/max latency (s), false transitions per labelled hour and accuracy.
+def sweep(recordings, thresholds, window_sizes, transition_times, pause_times):
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    results = []
+    for pause_time, transition_time in itertools.product(pause_times, transition_times):
+        totals = None
+        for trace, labels in recordings:
+            poll_times, magnitudes = poll_magnitudes(trace, pause_time)
+            truth, label_start = label_polls(labels, poll_times)
+            raw = running_means(magnitudes, window_sizes)[None, :, :] > thresholds[:, None, None]
+            states = debounce(raw, poll_times, transition_time)
+            scores = score(states, truth, label_start, poll_times)
+            if totals is None:
+                totals = scores
+            else:
+                totals = {name: np.maximum(totals[name], value) if name == 'latency_max' else totals[name] + value
+                          for name, value in scores.items()}
+
+        for (i, threshold), (j, window_size) in itertools.product(enumerate(thresholds), enumerate(window_sizes)):
+            total = {name: value[i, j].item() for name, value in totals.items()}
+            labelled_hours = total['labelled_polls'] * pause_time / 3600
+            results.append({'threshold': threshold.item(), 'window_size': int(window_size),
+                            'transition_time': transition_time, 'pause_time': pause_time,
+                            'detection_rate': total['detected'] / max(total['transitions'], 1),
+                            'mean_latency': total['latency_sum'] / max(total['detected'], 1),
+                            'max_latency': total['latency_max'],
+                            'false_per_hour': total['false_transitions'] / max(labelled_hours, 1e-9),
+                            'accuracy': total['agreeing_polls'] / max(total['labelled_polls'], 1),
+                            **total})
+    return results
+
+
+# Parses "1,2,5" into [1, 2, 5] and "start:stop:step" into the inclusive range
+def parse_values(text, kind=float):
+    if ':' in text:
+        start, stop, step = (float(v) for v in text.split(':'))
+        return [kind(v) for v in np.arange(start, stop + step / 2, step)]
+    return [kind(v) for v in text.split(',')]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate motion_monitor parameters against labelled IMU traces")
+    parser.add_argument('traces', nargs='+', help="binary IMU traces")
+    parser.add_argument('--labels', nargs='+', required=True, help="labels CSV for each trace, in the same order")
+    parser.add_argument('--thresholds', default='4150:4400:25')
+    parser.add_argument('--windows', default='10,20,40', help="window sizes in polls")
+    parser.add_argument('--transition-times', default='1,3,5')
+    parser.add_argument('--pause-times', default='0.1,0.5,1')
+    parser.add_argument('--top', type=int, default=20, help="number of settings to print")
+    parser.add_argument('--json', help="write every result to this file")
+    args = parser.parse_args()
+    if len(args.labels) != len(args.traces):
+        parser.error("give one labels file per trace")
+
+    recordings = [(openTrace(trace), load_labels(labels)) for trace, labels in zip(args.traces, args.labels)]
+    results = sweep(recordings, parse_values(args.thresholds), parse_values(args.windows, int),
+                    parse_values(args.transition_times), parse_values(args.pause_times))
+
+    # Best first: detect every transition, then fewest false transitions, then fastest
+    results.sort(key=lambda r: (-r['detection_rate'], r['false_per_hour'], r['mean_latency']))
+    print(f"{'threshold':>9} {'window':>6} {'trans':>5} {'pause':>5} {'detect':>6} {'latency':>7} {'max':>6} "
+          f"{'false/h':>7} {'acc':>5}")
+    for r in results[:args.top]:
+        print(f"{r['threshold']:9.0f} {r['window_size']:6d} {r['transition_time']:5g} {r['pause_time']:5g} "
+              f"{r['detection_rate']:6.0%} {r['mean_latency']:7.1f} {r['max_latency']:6.1f} "
+              f"{r['false_per_hour']:7.1f} {r['accuracy']:5.0%}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
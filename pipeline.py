@@ -0,0 +1,140 @@
+from collections import deque
+import threading
+import time
+import traceback
+
+
+# Policies for a full stage_queue: 'drop_oldest' discards the oldest item to make room, so the producer never waits
+# and consumers always get the freshest data; 'block' makes the producer wait for room (backpressure).
+DROP_OLDEST = 'drop_oldest'
+BLOCK = 'block'
+
+
+# Raised by stage_queue.get() and put() once the queue is closed and, for get(), drained
+class queue_closed(Exception):
+    pass
+
+
+# Bounded FIFO between two pipeline stages, with a policy for when it is full
+class stage_queue:
+
+    def __init__(self, maxsize, policy=DROP_OLDEST):
+        if maxsize < 1:
+            raise ValueError("Queue size must be at least 1")
+        if policy not in (DROP_OLDEST, BLOCK):
+            raise ValueError(f"Unknown queue policy '{policy}'")
+        self.__items = deque()
+        self.__maxsize = maxsize
+        self.__policy = policy
+        self.__closed = False
+        self.__condition = threading.Condition()
+
+        # Statistics reported by stats()
+        self.__put = 0
+        self.__dropped = 0
+        self.__blocked_time = 0.0
+
+    # Adds an item. Returns the item dropped to make room, if any. With the block policy, waits for room.
+    def put(self, item):
+        dropped = None
+        with self.__condition:
+            if self.__policy == BLOCK:
+                started = time.monotonic()
+                while len(self.__items) >= self.__maxsize and not self.__closed:
+                    self.__condition.wait()
+                self.__blocked_time += time.monotonic() - started
+            if self.__closed:
+                raise queue_closed()
+            if len(self.__items) >= self.__maxsize:
+                dropped = self.__items.popleft()
+                self.__dropped += 1
+            self.__items.append(item)
+            self.__put += 1
+            self.__condition.notify_all()
+        return dropped
+
+    # Removes and returns the oldest item, waiting up to timeout seconds (forever if None). Returns None on timeout.
+    def get(self, timeout=None):
+        with self.__condition:
+            if not self.__condition.wait_for(lambda: self.__items or self.__closed, timeout):
+                return None
+            if not self.__items:
+                raise queue_closed()
+            item = self.__items.popleft()
+            self.__condition.notify_all()
+            return item
+
+    # Wakes every waiting producer and consumer; consumers still get the items already queued
+    def close(self):
+        with self.__condition:
+            self.__closed = True
+            self.__condition.notify_all()
+
+    def __len__(self):
+        with self.__condition:
+            return len(self.__items)
+
+    def stats(self):
+        with self.__condition:
+            return {'queued': len(self.__items), 'put': self.__put, 'dropped': self.__dropped,
+                    'blocked_time': self.__blocked_time}
+
+
+# One pipeline stage: a worker thread that takes items from `source`, passes each to `handler` and puts the result on
+# `sink`. A handler returning None ends the item there (e.g. a photo with nothing to report). An exception in the
+# handler is printed and the item dropped, so one bad item never stops the stage.
+class pipeline_stage:
+
+    def __init__(self, name, handler, source, sink=None):
+        self.__name = name
+        self.__handler = handler
+        self.__source = source
+        self.__sink = sink
+        self.__thread = None
+
+        # Statistics reported by stats()
+        self.__processed = 0
+        self.__failed = 0
+        self.__busy_time = 0.0
+        self.__max_time = 0.0
+
+    def start(self):
+        if self.__thread is not None:
+            raise RuntimeWarning(f"Stage {self.__name} is already running!")
+        self.__thread = threading.Thread(target=self.__run, name=self.__name, daemon=True)
+        self.__thread.start()
+
+    # Waits for the worker to finish; it finishes once its source is closed and drained
+    def join(self, timeout=None):
+        if self.__thread is not None:
+            self.__thread.join(timeout)
+
+    def stats(self):
+        return {'processed': self.__processed, 'failed': self.__failed, 'busy_time': self.__busy_time,
+                'max_time': self.__max_time}
+
+    def __run(self):
+        while True:
+            try:
+                item = self.__source.get()
+            except queue_closed:
+                break
+            started = time.monotonic()
+            try:
+                result = self.__handler(item)
+            except Exception:
+                traceback.print_exc()
+                self.__failed += 1
+                result = None
+            elapsed = time.monotonic() - started
+            self.__processed += 1
+            self.__busy_time += elapsed
+            self.__max_time = max(self.__max_time, elapsed)
+
+            if result is not None and self.__sink is not None:
+                try:
+                    self.__sink.put(result)
+                except queue_closed:
+                    break
+        if self.__sink is not None:
+            self.__sink.close()  # Lets the next stage drain and finish too
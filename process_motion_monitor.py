@@ -0,0 +1,254 @@
+from motion_monitor import motion_monitor, motion_state
+from lib.BerryIMU.trace import TRACE_DTYPE
+from multiprocessing import shared_memory
+import multiprocessing
+import signal
+import threading
+import time
+import traceback
+import types
+import numpy as np
+
+
+# Header of the shared buffer. seq is a sequence lock: the writer makes it odd while updating the state fields, so a
+# reader that sees an odd or changed seq retries. written is the total number of samples put in the ring.
+HEADER_DTYPE = np.dtype([('seq', '<u8'), ('written', '<u8'), ('state_seq', '<u8'), ('avg_motion', '<f8'),
+                         ('threshold', '<f8'), ('timestamp', '<f8'), ('is_parked', 'u1')], align=True)
+
+
+# Motion state and a ring buffer of the latest raw IMU samples (TRACE_DTYPE records) in shared memory. The sampler
+# process writes, any number of readers in other processes read. Writer methods match TraceRecorder, so the buffer
+# can be handed to motion_monitor as its recorder.
+class shared_motion_buffer:
+
+    def __init__(self, capacity=4096, name=None):
+        offset = -(-HEADER_DTYPE.itemsize // 8) * 8
+        if name is None:
+            self.__memory = shared_memory.SharedMemory(create=True, size=offset + capacity * TRACE_DTYPE.itemsize)
+        else:
+            self.__memory = shared_memory.SharedMemory(name=name)
+        self.__owner = name is None
+        self.__capacity = capacity
+        self.__header = np.ndarray((), dtype=HEADER_DTYPE, buffer=self.__memory.buf)
+        self.__ring = np.ndarray((capacity,), dtype=TRACE_DTYPE, buffer=self.__memory.buf, offset=offset)
+
+    def name(self):
+        return self.__memory.name
+
+    def capacity(self):
+        return self.__capacity
+
+    def record(self, t, acc, gyr=(0, 0, 0), mag=(0, 0, 0)):
+        written = int(self.__header['written'])
+        self.__ring[written % self.__capacity] = (t, acc, gyr, mag)
+        self.__header['written'] = written + 1
+
+    def recordBatch(self, t, acc, gyr=None, mag=None):
+        written = int(self.__header['written'])
+        count = min(len(t), self.__capacity)
+        index = (written + np.arange(len(t) - count, len(t))) % self.__capacity
+        self.__ring['t'][index] = t[-count:]
+        self.__ring['acc'][index] = acc[-count:]
+        self.__ring['gyr'][index] = 0 if gyr is None else gyr[-count:]
+        self.__ring['mag'][index] = 0 if mag is None else mag[-count:]
+        self.__header['written'] = written + len(t)
+
+    def flush(self):
+        pass
+
+    def publish(self, state):
+        header = self.__header
+        header['seq'] += 1
+        header['is_parked'] = state.is_parked
+        header['avg_motion'] = state.avg_motion
+        header['threshold'] = state.threshold
+        header['state_seq'] = state.seq
+        header['timestamp'] = state.timestamp
+        header['seq'] += 1
+
+    # Returns the latest published motion_state
+    def state(self):
+        while True:
+            seq = int(self.__header['seq'])
+            if seq % 2 == 0:
+                header = self.__header.copy()
+                if int(self.__header['seq']) == seq:
+                    return motion_state(bool(header['is_parked']), float(header['avg_motion']),
+                                        float(header['threshold']), int(header['state_seq']),
+                                        float(header['timestamp']))
+            time.sleep(0)
+
+    # Returns a copy of up to `count` of the newest samples, oldest first. Samples that the writer overwrote while
+    # they were being copied are dropped.
+    def samples(self, count=None):
+        written = int(self.__header['written'])
+        count = min(written, self.__capacity if count is None else min(count, self.__capacity))
+        copy = self.__ring[(written - count + np.arange(count)) % self.__capacity]
+        overwritten = int(self.__header['written']) - self.__capacity - (written - count)
+        return copy[max(overwritten, 0):]
+
+    def close(self):
+        self.__header = self.__ring = None  # Views into the memory must go before it can be closed
+        self.__memory.close()
+        if self.__owner:
+            self.__memory.unlink()
+
+
+# Sampler process: runs a motion_monitor that writes every sample and state update to the shared buffer, and sets
+# `transition` whenever the parked state changes. Polls are scheduled from their start time so the cadence does not
+# drift by the time spent sampling. Once the monitor is set up, None is sent on `ready`; if setting it up fails (no
+# IMU, unreadable profile, calibration error), the formatted exception is sent instead so start() can raise it.
+def run_sampler(buffer_name, capacity, transition, stopping, calibrate, kwargs, ready):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # The parent stops the sampler through `stopping`
+    buffer = shared_motion_buffer(capacity, buffer_name)
+    try:
+        try:
+            monitor = motion_monitor(recorder=buffer, **kwargs)
+            if calibrate and not monitor.load_profile():
+                monitor.calibrate(interactive=False)
+            parked = monitor.is_parked()
+            buffer.publish(monitor.get_state())
+        except Exception:
+            ready.send(traceback.format_exc())
+            return
+        ready.send(None)
+        ready.close()
+
+        while not stopping.is_set():
+            started = time.monotonic()
+            pause_time = monitor.poll()
+            state = monitor.get_state()
+            buffer.publish(state)
+            if state.is_parked != parked:
+                parked = state.is_parked
+                transition.set()
+
+            if pause_time is None:
+                monitor.wait_for_motion(lambda: not stopping.is_set())
+            else:
+                stopping.wait(max(pause_time - (time.monotonic() - started), 0))
+    finally:
+        buffer.close()
+
+
+# motion_monitor with the sampler in its own process, so I2C reads keep their cadence while this process is busy with
+# JPEG handling, request signing or uploads. The sampler publishes its state and raw samples to a
+# shared_motion_buffer; is_parked(), get_avg_motion() and get_state() read it without any locking or IPC round trip,
+# and a watcher thread runs on_parked/on_moving in this process. Keyword arguments are passed to motion_monitor in
+# the sampler process. With calibrate=True the sampler loads the saved calibration profile, or calibrates headless.
+class process_motion_monitor:
+
+    def __init__(self, calibrate=False, capacity=4096, **kwargs):
+        self.__calibrate = calibrate
+        self.__kwargs = kwargs
+        self.__buffer = shared_motion_buffer(capacity)
+        self.__buffer.publish(motion_state(False, 0.0, 0.0, 0, time.time()))
+
+        # Fork where available: the sampler then inherits the parent's modules instead of re-importing __main__
+        methods = multiprocessing.get_all_start_methods()
+        self.__context = multiprocessing.get_context('fork' if 'fork' in methods else 'spawn')
+        self.__process = None
+        self.__watcher = None
+        self.__transition = self.__context.Event()
+        self.__stopping = self.__context.Event()
+        self.__on_parked = None
+        self.__on_moving = None
+        self.__failure = None  # Set by the watcher if the sampler process dies while running
+
+    # Starts the sampler process and the handler watcher thread. Waits until the sampler has detected the IMU and
+    # loaded or made its calibration; raises RuntimeError with the sampler's exception if that fails.
+    def start(self, on_parked: types.FunctionType = None, on_moving: types.FunctionType = None):
+        if self.__process is not None:
+            raise RuntimeWarning("Motion monitor is already running!")
+
+        self.__on_parked = on_parked
+        self.__on_moving = on_moving
+        self.__failure = None
+        self.__stopping.clear()
+        receiver, sender = self.__context.Pipe(duplex=False)
+        process = self.__context.Process(target=run_sampler, name="motion_monitor", daemon=True,
+                                         args=(self.__buffer.name(), self.__buffer.capacity(), self.__transition,
+                                               self.__stopping, self.__calibrate, self.__kwargs, sender))
+        process.start()
+        sender.close()  # Only the child's copy stays open, so its exit ends the wait below
+        try:
+            error = receiver.recv()
+        except EOFError:
+            process.join()
+            error = f"Sampler process exited with code {process.exitcode} before it was ready"
+        finally:
+            receiver.close()
+        if error is not None:
+            process.join()
+            raise RuntimeError(f"Motion monitor failed to start:\n{error}")
+
+        self.__process = process
+        self.__watcher = threading.Thread(target=self.__watch, name="motion_monitor_events")
+        self.__watcher.start()
+
+    def stop(self):
+        if self.__process is None:
+            raise RuntimeWarning("Motion monitor is not running!")
+
+        # A sampler killed while waiting on __stopping leaves the event's internal counters stuck, and set() would
+        # then wait for it forever; a dead sampler needs no signal anyway
+        if self.__process.is_alive():
+            self.__stopping.set()
+        self.__process.join()
+        self.__process = None
+        self.__transition.set()  # Wakes the watcher so it sees __stopping
+        self.__watcher.join()
+        self.__watcher = None
+
+    # Releases the shared memory; the monitor cannot be started again afterwards
+    def close(self):
+        if self.__process is not None:
+            self.stop()
+        self.__buffer.close()
+
+    # The state readers raise RuntimeError once the sampler process has died, rather than report its last state forever
+    def is_parked(self):
+        return self.get_state().is_parked
+
+    def get_avg_motion(self):
+        return self.get_state().avg_motion
+
+    def get_state(self):
+        if self.__failure is not None:
+            raise RuntimeError(self.__failure)
+        return self.__buffer.state()
+
+    # Returns up to `count` of the newest raw samples as TRACE_DTYPE records (see lib/BerryIMU/trace.py)
+    def get_samples(self, count=None):
+        return self.__buffer.samples(count)
+
+    # Returns the mean, standard deviation and maximum of the intervals between the buffered samples, in seconds
+    def get_sampling_stats(self):
+        intervals = np.diff(self.__buffer.samples()['t'])
+        if len(intervals) == 0:
+            return None
+        return {'mean_interval': float(intervals.mean()), 'std_interval': float(intervals.std()),
+                'max_interval': float(intervals.max()), 'samples': len(intervals) + 1}
+
+    # Watcher thread: runs the handler for each parked state change published by the sampler, until stop(). Also
+    # checks that the sampler process is still alive, and records a failure for the state readers if it is not.
+    def __watch(self):
+        process = self.__process
+        parked = self.is_parked()
+        while True:
+            if not self.__transition.wait(1.0):
+                if not process.is_alive() and not self.__stopping.is_set():
+                    self.__failure = f"Motion monitor sampler process exited with code {process.exitcode}"
+                    return
+                continue
+            self.__transition.clear()
+            if self.is_parked() != parked:
+                parked = not parked
+                handler = self.__on_parked if parked else self.__on_moving
+                if handler is not None:
+                    try:
+                        handler()
+                    except Exception:
+                        traceback.print_exc()
+            if self.__stopping.is_set():
+                return
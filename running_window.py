@@ -0,0 +1,109 @@
+from collections import deque
+import math
+
+
+# Fixed-size sliding window over a stream of measurements. The window is a preallocated ring buffer; sum, sum of
+# squares, minimum and maximum are kept up to date as values are added, so mean(), variance(), min() and max() cost
+# O(1) regardless of the window size.
+class running_window:
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError("Window size must be at least 1")
+        self.__size = size
+        self.__values = [0.0] * size
+        self.__index = 0  # Ring buffer slot that the next value is written to
+        self.__count = 0
+        self.__seq = 0  # Number of values appended since creation, used to expire min/max candidates
+
+        # Running totals. They are recomputed from the buffer once per __size appends so floating
+        # point error from the add/subtract updates cannot accumulate.
+        self.__sum = 0.0
+        self.__sum_sq = 0.0
+        self.__since_resum = 0
+
+        # Monotonic deques of (seq, value) candidates for the window minimum and maximum
+        self.__min_candidates = deque()
+        self.__max_candidates = deque()
+
+    def __len__(self):
+        return self.__count
+
+    def size(self):
+        return self.__size
+
+    def is_full(self):
+        return self.__count == self.__size
+
+    def append(self, value):
+        value = float(value)
+        if self.__count == self.__size:
+            old = self.__values[self.__index]
+            self.__sum -= old
+            self.__sum_sq -= old * old
+        else:
+            self.__count += 1
+
+        self.__values[self.__index] = value
+        self.__index = (self.__index + 1) % self.__size
+        self.__sum += value
+        self.__sum_sq += value * value
+
+        self.__since_resum += 1
+        if self.__since_resum >= self.__size:
+            self.__resum()
+
+        seq = self.__seq
+        self.__seq += 1
+        expired = seq - self.__size
+        while self.__min_candidates and self.__min_candidates[-1][1] >= value:
+            self.__min_candidates.pop()
+        self.__min_candidates.append((seq, value))
+        if self.__min_candidates[0][0] <= expired:
+            self.__min_candidates.popleft()
+        while self.__max_candidates and self.__max_candidates[-1][1] <= value:
+            self.__max_candidates.pop()
+        self.__max_candidates.append((seq, value))
+        if self.__max_candidates[0][0] <= expired:
+            self.__max_candidates.popleft()
+
+    def extend(self, values):
+        for value in values:
+            self.append(value)
+
+    def clear(self):
+        self.__values = [0.0] * self.__size
+        self.__index = 0
+        self.__count = 0
+        self.__sum = 0.0
+        self.__sum_sq = 0.0
+        self.__since_resum = 0
+        self.__min_candidates.clear()
+        self.__max_candidates.clear()
+
+    def mean(self):
+        if self.__count == 0:
+            return 0.0
+        return self.__sum / self.__count
+
+    def variance(self):
+        # Population variance of the values in the window
+        if self.__count == 0:
+            return 0.0
+        mean = self.__sum / self.__count
+        return max(self.__sum_sq / self.__count - mean * mean, 0.0)
+
+    def std(self):
+        return math.sqrt(self.variance())
+
+    def min(self):
+        return self.__min_candidates[0][1] if self.__min_candidates else 0.0
+
+    def max(self):
+        return self.__max_candidates[0][1] if self.__max_candidates else 0.0
+
+    def __resum(self):
+        values = self.__values if self.__count == self.__size else self.__values[:self.__count]
+        self.__sum = math.fsum(values)
+        self.__sum_sq = math.fsum(v * v for v in values)
+        self.__since_resum = 0
@@ -0,0 +1,66 @@
+from PIL import Image
+import io
+import time
+import numpy as np
+
+
+# Difference hash of a photo: the photo is shrunk to a (hash_size + 1) x hash_size grayscale thumbnail and each bit
+# says whether a pixel is brighter than its right neighbour. Similar scenes give hashes that differ in few bits, and
+# the hash ignores overall brightness and JPEG noise. JPEGs are decoded in draft mode, straight at 1/8 scale and in
+# grayscale, which is much faster than decoding the full photo.
+def scene_hash(photo, hash_size=8):
+    image = Image.open(io.BytesIO(photo))
+    image.draft('L', (hash_size * 8, hash_size * 8))
+    thumbnail = np.asarray(image.convert('L').resize((hash_size + 1, hash_size), Image.BOX), dtype=np.int16)
+    return thumbnail[:, 1:] > thumbnail[:, :-1]
+
+
+# Number of bits in which two scene hashes differ
+def hash_distance(a, b):
+    return int(np.count_nonzero(a != b))
+
+
+# Skips Rekognition for photos of a scene that has not changed. check() hashes a photo and, if it is within
+# `tolerance` bits of the last classified photo and that classification is at most max_reuse_age seconds old, returns
+# its labels. Otherwise it returns None and the caller classifies the photo and passes the labels to update(). In a
+# parked car the cabin is mostly still, so most photos reuse labels; max_reuse_age still refreshes them regularly.
+class scene_gate:
+
+    def __init__(self, tolerance=6, max_reuse_age=60, hash_size=8):
+        self.__tolerance = tolerance
+        self.__max_reuse_age = max_reuse_age
+        self.__hash_size = hash_size
+        self.__last = None  # (hash, labels, time) of the last classified photo, replaced as a whole so reset() is safe
+        self.__pending_hash = None  # Hash from the last check() that found a changed scene
+
+        # Statistics reported by stats()
+        self.__checks = 0
+        self.__reused = 0
+
+    # Returns the labels to reuse for this photo, or None if it needs classifying
+    def check(self, photo, now=None):
+        now = time.time() if now is None else now
+        self.__checks += 1
+        photo_hash = scene_hash(photo, self.__hash_size)
+        last = self.__last
+        if last is not None and now - last[2] <= self.__max_reuse_age and \
+                hash_distance(photo_hash, last[0]) <= self.__tolerance:
+            self.__reused += 1
+            return last[1]
+        self.__pending_hash = photo_hash
+        return None
+
+    # Records the labels of the photo passed to the last check() that returned None
+    def update(self, labels, now=None):
+        if self.__pending_hash is None:
+            raise RuntimeError("update() must follow a check() that returned None")
+        self.__last = (self.__pending_hash, labels, time.time() if now is None else now)
+        self.__pending_hash = None
+
+    # Forgets the last classification, e.g. when the car moves and the next scene will be different
+    def reset(self):
+        self.__last = None
+
+    def stats(self):
+        return {'checks': self.__checks, 'reused': self.__reused,
+                'reuse_rate': self.__reused / self.__checks if self.__checks else 0.0}
@@ -0,0 +1,84 @@
+from lib.BerryIMU.filters import ComplementaryFilter, KalmanFilter
+import numpy as np
+import pytest
+
+Q_ANGLE = 0.02
+Q_GYRO = 0.0015
+R_ANGLE = 0.005
+AA = 0.40
+
+
+# kalmanFilterX() and the complementary filter line of the original berryIMU.py loop, one sample at a time
+def reference_kalman(acc_angles, gyro_rates, periods):
+    angle = bias = 0.0
+    P_00 = P_01 = P_10 = P_11 = 0.0
+    angles = []
+    for accAngle, gyroRate, DT in zip(acc_angles, gyro_rates, periods):
+        angle = angle + DT * (gyroRate - bias)
+
+        P_00 = P_00 + ( - DT * (P_10 + P_01) + Q_ANGLE * DT )
+        P_01 = P_01 + ( - DT * P_11 )
+        P_10 = P_10 + ( - DT * P_11 )
+        P_11 = P_11 + ( + Q_GYRO * DT )
+
+        x = accAngle - angle
+        S = P_00 + R_ANGLE
+        K_0 = P_00 / S
+        K_1 = P_10 / S
+
+        angle = angle + ( K_0 * x )
+        bias = bias + ( K_1 * x )
+
+        P_00 = P_00 - ( K_0 * P_00 )
+        P_01 = P_01 - ( K_0 * P_01 )
+        P_10 = P_10 - ( K_1 * P_00 )
+        P_11 = P_11 - ( K_1 * P_01 )
+        angles.append(angle)
+    return np.array(angles)
+
+
+def reference_complementary(acc_angles, gyro_rates, periods):
+    angle = 0.0
+    angles = []
+    for accAngle, gyroRate, DT in zip(acc_angles, gyro_rates, periods):
+        angle = AA * (angle + gyroRate * DT) + (1 - AA) * accAngle
+        angles.append(angle)
+    return np.array(angles)
+
+
+# 20 s of a tilting IMU at 52 Hz, with one stretch of uneven loop periods in the middle
+def samples():
+    rng = np.random.default_rng(0)
+    periods = np.full(1040, 1 / 52)
+    periods[500:540] = rng.uniform(0.01, 0.03, 40)
+    times = np.cumsum(periods)
+    acc_angles = 30 * np.sin(times) + rng.normal(0, 2, len(times))
+    gyro_rates = 30 * np.cos(times) + 0.5 + rng.normal(0, 1, len(times))
+    return acc_angles, gyro_rates, periods
+
+
+@pytest.mark.parametrize('block', [1, 52, 1040])
+def test_kalman_matches_berryimu(block):
+    acc_angles, gyro_rates, periods = samples()
+    kalman = KalmanFilter(Q_ANGLE, Q_GYRO, R_ANGLE)
+    if block == 1:
+        angles = [kalman.update(float(a), float(g), float(dt)) for a, g, dt in zip(acc_angles, gyro_rates, periods)]
+        assert all(type(angle) is float for angle in angles)
+    else:
+        angles = np.concatenate([kalman.update(acc_angles[i:i + block], gyro_rates[i:i + block],
+                                               periods[i:i + block]) for i in range(0, len(periods), block)])
+    np.testing.assert_allclose(angles, reference_kalman(acc_angles, gyro_rates, periods), atol=1e-9)
+
+
+@pytest.mark.parametrize('block', [1, 52, 1040])
+def test_complementary_matches_berryimu(block):
+    acc_angles, gyro_rates, periods = samples()
+    complementary = ComplementaryFilter(AA)
+    if block == 1:
+        angles = [complementary.update(float(a), float(g), float(dt))
+                  for a, g, dt in zip(acc_angles, gyro_rates, periods)]
+        assert all(type(angle) is float for angle in angles)
+    else:
+        angles = np.concatenate([complementary.update(acc_angles[i:i + block], gyro_rates[i:i + block],
+                                                      periods[i:i + block]) for i in range(0, len(periods), block)])
+    np.testing.assert_allclose(angles, reference_complementary(acc_angles, gyro_rates, periods), atol=1e-9)
@@ -0,0 +1,100 @@
+from lib.BerryIMU.i2c import SimulatedBus, SyntheticMotion
+from lib.BerryIMU.LSM6DSL import LSM6DSL_ADDRESS, LSM6DSL_FIFO_DATA_OUT_L, LSM6DSL_FIFO_STATUS1, LSM6DSL_WHO_AM_I
+import lib.BerryIMU.IMU as IMU
+import numpy as np
+import pytest
+
+
+# Motion source whose sample n (taken at n / 52 s) encodes n in every sensor, so FIFO frames can be checked exactly
+class numbered_samples:
+
+    def sample(self, t):
+        n = round(t * 52)
+        return (n, -n, 1000 + n, 2 * n, -2 * n, 3000 + n, 0, 0, 0)
+
+
+class manual_clock:
+
+    def __init__(self):
+        self.time = 0.0
+
+    def __call__(self):
+        return self.time
+
+
+def expected_frames(first, last, gyro):
+    n = np.arange(first, last + 1)
+    columns = [n, -n, 1000 + n] + ([2 * n, -2 * n, 3000 + n] if gyro else [])
+    return np.column_stack(columns)
+
+
+@pytest.mark.parametrize('gyro', [False, True])
+def test_read_fifo_frames(gyro):
+    clock = manual_clock()
+    bus = SimulatedBus(numbered_samples(), clock=clock)
+    imu = IMU.BerryIMUv3(bus)
+    imu.initIMU()
+    imu.initFIFO(52, gyro=gyro)
+
+    clock.time = 1.0
+    data = imu.readFIFO()
+    assert data.dtype == np.int16
+    np.testing.assert_array_equal(data, expected_frames(1, 52, gyro))
+
+    clock.time = 1.5
+    np.testing.assert_array_equal(imu.readFIFO(), expected_frames(53, 78, gyro))
+    assert len(imu.readFIFO()) == 0
+
+
+# A read that stopped part way through a frame leaves the FIFO pattern mid-frame; readFIFO() must drop the rest of
+# that frame instead of returning words shifted across columns
+def test_read_fifo_resyncs_to_frame_boundary():
+    clock = manual_clock()
+    bus = SimulatedBus(numbered_samples(), clock=clock)
+    imu = IMU.BerryIMUv3(bus)
+    imu.initIMU()
+    imu.initFIFO(52, gyro=True)
+
+    clock.time = 0.5
+    bus.read_i2c_block_data(LSM6DSL_ADDRESS, LSM6DSL_FIFO_STATUS1, 4)
+    bus.read_i2c_block_data(LSM6DSL_ADDRESS, LSM6DSL_FIFO_DATA_OUT_L, 2)  # First word of frame 1 only
+    np.testing.assert_array_equal(imu.readFIFO(), expected_frames(2, 26, True))
+
+
+def test_detect_cache_round_trip(tmp_path):
+    cache_file = str(tmp_path / 'state' / 'imu_detect.json')
+    bus = SimulatedBus(SyntheticMotion())
+    IMU.saveDetectCache(cache_file, IMU.BerryIMUv3(bus))
+    assert not (tmp_path / 'state' / 'imu_detect.json.tmp').exists()
+
+    found = IMU.loadDetectCache(cache_file, bus)
+    assert isinstance(found, IMU.BerryIMUv3)
+
+    # The cached chip no longer answers: fall back to a full probe
+    bus.registers[LSM6DSL_ADDRESS][LSM6DSL_WHO_AM_I] = 0
+    assert IMU.loadDetectCache(cache_file, bus) is None
+
+
+def test_detect_cache_ignores_bad_files(tmp_path):
+    bus = SimulatedBus(SyntheticMotion())
+    assert IMU.loadDetectCache(str(tmp_path / 'missing.json'), bus) is None
+
+    truncated = tmp_path / 'truncated.json'
+    truncated.write_text('{"version": 3, "na')
+    assert IMU.loadDetectCache(str(truncated), bus) is None
+
+    unknown = tmp_path / 'unknown.json'
+    unknown.write_text('{"version": 7}')
+    assert IMU.loadDetectCache(str(unknown), bus) is None
+
+
+def test_module_reads_without_imu_raise(monkeypatch):
+    monkeypatch.setattr(IMU, 'imu', None)
+    with pytest.raises(RuntimeError, match="found no BerryIMU"):
+        IMU.readACCx()
+
+
+def test_drivers_must_implement_init():
+    with pytest.raises(TypeError):
+        IMU.BerryIMU(SimulatedBus(SyntheticMotion()))
+    assert IMU.BerryIMUv3(SimulatedBus(SyntheticMotion())).version == 3
@@ -0,0 +1,25 @@
+from lib.BerryIMU.i2c import SimulatedBus, SyntheticMotion, ACC_1G
+from motion_features import motion_classifier
+from motion_monitor import motion_monitor
+import pytest
+
+
+# Calibration must only use the accelerometer columns of the FIFO, even when the gyro is batched in it too (which
+# happens with trace_path, recorder or fusion set)
+def test_calibrate_with_gyro_in_fifo(tmp_path):
+    motion = SyntheticMotion(schedule=((60, 'parked'),))
+    monitor = motion_monitor(bus=SimulatedBus(motion), imu_cache=None, profile_path=str(tmp_path / 'profile.json'),
+                             mag_calibration=None, use_fifo=True, trace_path=str(tmp_path / 'drive.trace'))
+    monitor.calibrate(interactive=False)
+
+    calibration = monitor.get_calibration()
+    assert len(calibration['bias']) == 3
+    assert calibration['bias'][2] == pytest.approx(ACC_1G, abs=5 * motion.noise)
+    assert calibration['noise_floor'] == pytest.approx(ACC_1G, abs=5 * motion.noise)
+
+
+# The classifier's frequency bands are meaningless at the polling rate
+def test_classifier_requires_fifo():
+    with pytest.raises(ValueError, match="use_fifo"):
+        motion_monitor(bus=SimulatedBus(SyntheticMotion()), imu_cache=None, profile_path=None, mag_calibration=None,
+                       classifier=motion_classifier())
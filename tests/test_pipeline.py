@@ -0,0 +1,85 @@
+from pipeline import stage_queue, pipeline_stage, queue_closed, DROP_OLDEST, BLOCK
+import threading
+import time
+import pytest
+
+
+def test_drop_oldest_keeps_newest():
+    queue = stage_queue(2, DROP_OLDEST)
+    assert queue.put(1) is None
+    assert queue.put(2) is None
+    assert queue.put(3) == 1
+    assert queue.put(4) == 2
+    assert [queue.get(), queue.get()] == [3, 4]
+    assert queue.get(timeout=0.01) is None
+    assert queue.stats()['dropped'] == 2
+
+
+def test_block_waits_for_room():
+    queue = stage_queue(1, BLOCK)
+    queue.put(1)
+    put_done = threading.Event()
+
+    def producer():
+        queue.put(2)
+        put_done.set()
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    assert not put_done.wait(0.1)  # Full: the producer waits instead of dropping
+    assert queue.get() == 1
+    assert put_done.wait(1)
+    assert queue.get() == 2
+    thread.join(1)
+
+    stats = queue.stats()
+    assert stats['dropped'] == 0
+    assert stats['blocked_time'] >= 0.1
+
+
+def test_close_wakes_blocked_producer():
+    queue = stage_queue(1, BLOCK)
+    queue.put(1)
+    errors = []
+
+    def producer():
+        try:
+            queue.put(2)
+        except queue_closed as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=producer, daemon=True)
+    thread.start()
+    time.sleep(0.05)
+    queue.close()
+    thread.join(1)
+    assert not thread.is_alive() and len(errors) == 1
+
+    # Items queued before close() are still delivered, then get() reports the end
+    assert queue.get() == 1
+    with pytest.raises(queue_closed):
+        queue.get()
+
+
+@pytest.mark.parametrize('policy', [DROP_OLDEST, BLOCK])
+def test_stage_processes_and_closes_sink(policy):
+    source = stage_queue(10, policy)
+    sink = stage_queue(10, policy)
+
+    def handler(item):
+        if item == 'bad':
+            raise ValueError(item)
+        return None if item % 2 else item * 10
+
+    stage = pipeline_stage('test', handler, source, sink)
+    stage.start()
+    for item in [1, 2, 'bad', 3, 4]:
+        source.put(item)
+    source.close()
+    stage.join(1)
+
+    assert [sink.get(), sink.get()] == [20, 40]
+    with pytest.raises(queue_closed):
+        sink.get()
+    assert stage.stats()['processed'] == 5
+    assert stage.stats()['failed'] == 1
@@ -0,0 +1,37 @@
+from lib.BerryIMU.i2c import SimulatedBus, SyntheticMotion
+from process_motion_monitor import process_motion_monitor
+import time
+import pytest
+
+
+# I2C bus with nothing connected
+class empty_bus:
+
+    def read_byte_data(self, address, register):
+        raise IOError("No device at address")
+
+    def read_i2c_block_data(self, address, register, length):
+        raise IOError("No device at address")
+
+
+def test_start_raises_sampler_setup_error():
+    monitor = process_motion_monitor(bus=empty_bus(), imu_cache=None, profile_path=None, mag_calibration=None)
+    try:
+        with pytest.raises(RuntimeError, match="No BerryIMU detected"):
+            monitor.start()
+    finally:
+        monitor.close()
+
+
+def test_state_readers_raise_after_sampler_dies():
+    monitor = process_motion_monitor(bus=SimulatedBus(SyntheticMotion()), imu_cache=None, profile_path=None,
+                                     mag_calibration=None)
+    try:
+        monitor.start()
+        assert monitor.is_parked() in (True, False)
+        monitor._process_motion_monitor__process.kill()
+        time.sleep(2)
+        with pytest.raises(RuntimeError, match="exited"):
+            monitor.is_parked()
+    finally:
+        monitor.close()
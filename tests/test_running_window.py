@@ -0,0 +1,90 @@
+from running_window import running_window
+from collections import deque
+import random
+import pytest
+
+
+# Window statistics recomputed from scratch after every append
+class brute_force_window:
+
+    def __init__(self, size):
+        self.values = deque(maxlen=size)
+
+    def append(self, value):
+        self.values.append(float(value))
+
+    def clear(self):
+        self.values.clear()
+
+    def stats(self):
+        if not self.values:
+            return 0.0, 0.0, 0.0, 0.0
+        mean = sum(self.values) / len(self.values)
+        variance = sum((v - mean) ** 2 for v in self.values) / len(self.values)
+        return mean, variance, min(self.values), max(self.values)
+
+
+def assert_same(window, expected):
+    mean, variance, low, high = expected.stats()
+    assert len(window) == len(expected.values)
+    assert window.mean() == pytest.approx(mean, rel=1e-9, abs=1e-9)
+    assert window.variance() == pytest.approx(variance, rel=1e-6, abs=1e-6)
+    assert window.min() == low
+    assert window.max() == high
+
+
+# Runs through several re-sums of the totals (one per `size` appends) and many min/max expiries
+@pytest.mark.parametrize('size', [1, 2, 7, 64])
+def test_matches_brute_force(size):
+    rng = random.Random(size)
+    window = running_window(size)
+    expected = brute_force_window(size)
+    for i in range(10 * size + 50):
+        # Accelerometer magnitudes around 1 g, with runs of equal values and occasional spikes
+        value = 16400 + rng.choice([0, 0, rng.gauss(0, 30), rng.gauss(0, 3000)])
+        window.append(value)
+        expected.append(value)
+        assert_same(window, expected)
+        assert window.is_full() == (i + 1 >= size)
+
+
+def test_min_max_expire():
+    window = running_window(5)
+    window.extend([10, 1, 10, 10, 10])
+    assert window.min() == 1
+    window.append(10)
+    assert window.min() == 1
+    window.append(10)
+    assert window.min() == 10
+
+    window.extend([99, 10, 10, 10, 10])
+    assert window.max() == 99
+    window.append(10)
+    assert window.max() == 10
+    assert len(window) == 5
+
+
+def test_clear():
+    rng = random.Random(0)
+    window = running_window(16)
+    expected = brute_force_window(16)
+    for _ in range(3):
+        for _ in range(rng.randrange(1, 40)):
+            value = rng.gauss(16400, 100)
+            window.append(value)
+            expected.append(value)
+        window.clear()
+        expected.clear()
+        assert_same(window, expected)
+        assert not window.is_full()
+
+        # Min/max candidates from before clear() must not come back
+        for value in (5.0, 6.0, 4.0):
+            window.append(value)
+            expected.append(value)
+            assert_same(window, expected)
+
+
+def test_size_must_be_positive():
+    with pytest.raises(ValueError):
+        running_window(0)